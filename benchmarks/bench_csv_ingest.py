@@ -0,0 +1,128 @@
+"""
+Loading and chunking throughput, and peak memory, of a parsed-news CSV: the whole CSV
+read with pandas and chunked row by row with iterrows() (the old path) vs. the CSV
+streamed in batches of rows that are chunked together (load_csv_rows and
+chunk_loaded_sources in rag/maintain_vectordb.py). Embedding is left out, it's the
+same for both.
+
+A synthetic CSV with the columns of parsed_news_items.csv is written first, unless
+"csv_file" points to an existing one. Every path runs in its own process, so that the
+peak RSS of one doesn't hide the other's.
+
+Usage:
+python3 benchmarks/bench_csv_ingest.py '{"num_rows": 20000, "words_per_row": 600}'
+python3 benchmarks/bench_csv_ingest.py '{"csv_file": "results/leopard_news/news/parsed_news_items.csv"}'
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import resource
+import tempfile
+import contextlib
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+
+PATHS = ["iterrows", "streaming"]
+
+
+def write_synthetic_csv(filepath: str, num_rows: int, words_per_row: int, seed: int):
+    rnd = random.Random(seed)
+    vocabulary = [
+        "".join(rnd.choices("abcdefghij", k=rnd.randint(3, 9))) for _ in range(5000)
+    ]
+    with open(filepath, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["title", "date_serpapi", "source", "content", "url"])
+        for i in range(num_rows):
+            writer.writerow(
+                [
+                    f"Synthetic news item {i}",
+                    "01/15/2025, 08:00 AM, +0000 UTC",
+                    f"Publisher {i % 50}",
+                    " ".join(rnd.choices(vocabulary, k=words_per_row)),
+                    f"https://example.com/news/{i}",
+                ]
+            )
+
+
+def run_path(path: str, filepath: str) -> dict:
+    """Load and chunk every row of the CSV; runs in a subprocess"""
+    import pandas as pd
+    import rag.maintain_vectordb as mv
+
+    num_rows, num_chunks = 0, 0
+    start = time.time()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if path == "iterrows":
+            df = pd.read_csv(filepath)
+            for _, row in df.iterrows():
+                data = mv.load_csv_row(row_dict=row.to_dict())
+                num_chunks += len(mv.create_chunks(data))
+                num_rows += 1
+        else:
+            for rows in mv.read_csv_in_batches(filepath):
+                docs = []
+                for row_dict in rows:
+                    docs += mv.load_csv_row(row_dict=row_dict) or []
+                chunks_by_source = mv.chunk_sources(docs)
+                num_chunks += sum(len(c) for c in chunks_by_source.values())
+                num_rows += len(rows)
+    elapsed = time.time() - start
+
+    return {
+        "path": path,
+        "seconds": elapsed,
+        "rows_per_second": num_rows / elapsed,
+        "num_rows": num_rows,
+        "num_chunks": num_chunks,
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+if __name__ == "__main__":
+    inputs = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+
+    if "run_path" in inputs:
+        print(json.dumps(run_path(inputs["run_path"], inputs["csv_file"])))
+        sys.exit(0)
+
+    filepath = inputs.get("csv_file")
+    if not filepath:
+        filepath = os.path.join(tempfile.gettempdir(), "tht_bench_news.csv")
+        write_synthetic_csv(
+            filepath,
+            inputs.get("num_rows", 20_000),
+            inputs.get("words_per_row", 600),
+            inputs.get("seed", 0),
+        )
+    prnt.prPurple(
+        f"Loading and chunking {filepath} ({os.path.getsize(filepath) / 1024 / 1024:.0f} MB)"
+    )
+
+    results = []
+    for path in inputs.get("paths", PATHS):
+        output = subprocess.run(
+            [sys.executable, __file__, json.dumps({"run_path": path, "csv_file": filepath})],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        prnt.prYellow(f"\n{path}")
+        print(
+            f"{result['seconds']:.1f}s  {result['rows_per_second']:.0f} rows/s  "
+            f"{result['num_chunks']} chunks  peak RSS {result['peak_rss_mb']:.0f} MB"
+        )
+
+    if inputs.get("output_file"):
+        with open(inputs["output_file"], "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        prnt.prLightPurple(f"\nSaved the results to {inputs['output_file']}")
@@ -0,0 +1,130 @@
+"""
+Startup (import) time of the entry points, measured with `python -X importtime`.
+Every entry point is imported in a fresh interpreter a few times; the median total
+import time and the slowest top-level imports are printed, and each run is appended
+to a JSONL file so that regressions show up over time.
+
+Usage:
+python3 benchmarks/bench_import_time.py '{"runs": 5}'
+python3 benchmarks/bench_import_time.py '{"modules": ["src.rag_query"], "history_file": "import_times.jsonl"}'
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+
+ROOT_DIR = os.path.join(os.path.dirname(__file__), "..")
+
+# importing streamlit_app outside `streamlit run` runs the page in bare mode, which is
+# enough to measure what the app imports
+ENTRY_POINTS = [
+    "streamlit_app",
+    "src.rag_query",
+    "src.google_news_v1",
+    "src.google_scholar_v1",
+]
+DEFAULT_HISTORY_FILE = os.path.join(os.path.dirname(__file__), "import_times.jsonl")
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(stderr: str) -> tuple[float, dict]:
+    """
+    Returns the total import time (s) and the cumulative time (s) of every top-level
+    import, from the `-X importtime` output.
+    """
+    total_us = 0
+    top_level = {}
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+
+        self_us, cumulative_us, indent, module = match.groups()
+        total_us += int(self_us)
+        # nested imports are indented by two spaces per level
+        if len(indent) == 1:
+            top_level[module] = top_level.get(module, 0) + int(cumulative_us) / 1e6
+
+    return total_us / 1e6, top_level
+
+
+def time_import(module: str) -> dict:
+    start = time.time()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=ROOT_DIR,
+    )
+    wall = time.time() - start
+
+    total, top_level = parse_importtime(result.stderr)
+    return {
+        "ok": result.returncode == 0,
+        "wall": wall,
+        "import_total": total,
+        "top_level": top_level,
+        "error": result.stderr.strip().splitlines()[-1] if result.returncode else "",
+    }
+
+
+def bench_module(module: str, runs: int, top_n: int) -> dict:
+    measurements = [time_import(module) for _ in range(runs)]
+    failed = [m for m in measurements if not m["ok"]]
+    if failed:
+        prnt.prRed(f"\n{module}: import failed: {failed[0]['error']}")
+        return {"module": module, "ok": False, "error": failed[0]["error"]}
+
+    # the run with the median total import time stands for the module
+    measurements.sort(key=lambda m: m["import_total"])
+    median_run = measurements[len(measurements) // 2]
+    slowest = sorted(median_run["top_level"].items(), key=lambda x: -x[1])[:top_n]
+
+    prnt.prYellow(f"\n{module}")
+    print(
+        f"import time: median={median_run['import_total']:.3f}s  "
+        f"min={measurements[0]['import_total']:.3f}s  max={measurements[-1]['import_total']:.3f}s  "
+        f"(process wall time: median={statistics.median(m['wall'] for m in measurements):.3f}s)"
+    )
+    for name, seconds in slowest:
+        print(f"    {seconds:7.3f}s  {name}")
+
+    return {
+        "module": module,
+        "ok": True,
+        "runs": runs,
+        "import_total_median": median_run["import_total"],
+        "import_total_min": measurements[0]["import_total"],
+        "wall_median": statistics.median(m["wall"] for m in measurements),
+        "slowest_imports": dict(slowest),
+    }
+
+
+if __name__ == "__main__":
+    inputs = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    modules = inputs.get("modules") or ENTRY_POINTS
+    runs = inputs.get("runs", 5)
+    history_file = inputs.get("history_file", DEFAULT_HISTORY_FILE)
+
+    results = [bench_module(m, runs, inputs.get("top_n", 10)) for m in modules]
+
+    commit = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        capture_output=True,
+        text=True,
+        cwd=ROOT_DIR,
+    ).stdout.strip()
+    with open(history_file, "a", encoding="utf-8") as f:
+        f.write(
+            json.dumps({"timestamp": time.time(), "commit": commit, "results": results})
+            + "\n"
+        )
+    prnt.prLightPurple(f"\nAppended the results to {history_file}")
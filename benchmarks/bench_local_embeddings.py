@@ -0,0 +1,79 @@
+"""
+Latency and throughput of the local CPU embeddings (rag/local_embeddings.py):
+single queries one after another, queries sent from several threads at once (which the
+embedder merges into shared batches), and bulk embedding of chunk-sized texts like an
+ingest does. Texts are synthetic, so nothing but the model is needed.
+
+Usage:
+python3 benchmarks/bench_local_embeddings.py '{"model": "all-MiniLM-L6-v2"}'
+python3 benchmarks/bench_local_embeddings.py '{"model": "all-MiniLM-L6-v2", "backend": "onnx", "threads": 4, "num_chunks": 5000}'
+"""
+
+import os
+import sys
+import json
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+from rag.local_embeddings import LocalEmbedder
+from benchmarks.offline_fakes import make_vocabulary
+from benchmarks.bench_utils import print_summary
+
+
+def make_texts(count: int, num_words: int, seed: int) -> list[str]:
+    rnd = random.Random(seed)
+    vocabulary = make_vocabulary(5000, seed)
+    return [" ".join(rnd.choices(vocabulary, k=num_words)) for _ in range(count)]
+
+
+def time_queries(embedder: LocalEmbedder, queries: list[str], concurrency: int) -> list:
+    def embed_query(query):
+        start = time.perf_counter()
+        embedder.embed([query])
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(embed_query, queries))
+
+
+if __name__ == "__main__":
+    inputs = json.loads(sys.argv[1])
+    embedder = LocalEmbedder(
+        inputs["model"],
+        backend=inputs.get("backend"),
+        num_threads=inputs.get("threads"),
+        max_batch_size=inputs.get("max_batch_size"),
+    )
+    prnt.prPurple(f"Embedding dimension {embedder.dimension}")
+    embedder.embed(["warm up"])
+
+    queries = make_texts(inputs.get("num_queries", 200), 12, seed=0)
+    results = {}
+    for concurrency in inputs.get("concurrency", [1, 8]):
+        batches_before = embedder.num_batches
+        latencies = time_queries(embedder, queries, concurrency)
+        num_batches = embedder.num_batches - batches_before
+        results[f"queries_concurrency_{concurrency}"] = print_summary(
+            f"Queries, concurrency {concurrency} "
+            f"({len(queries) / num_batches:.1f} queries per model call)",
+            [latency * 1000 for latency in latencies],
+            unit="ms",
+        )
+
+    chunks = make_texts(inputs.get("num_chunks", 2000), 250, seed=1)
+    start = time.perf_counter()
+    embedder.embed(chunks)
+    elapsed = time.perf_counter() - start
+    prnt.prYellow("\nBulk")
+    print(
+        f"{len(chunks)} chunks in {elapsed:.1f}s, {len(chunks) / elapsed:.0f} chunks/s"
+    )
+    results["bulk_chunks_per_second"] = len(chunks) / elapsed
+
+    if inputs.get("output_file"):
+        with open(inputs["output_file"], "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        prnt.prLightPurple(f"\nSaved the results to {inputs['output_file']}")
@@ -0,0 +1,243 @@
+"""
+Offline benchmark of the query path: no network, no API costs.
+
+A synthetic Chroma collection of the requested size is built with a deterministic
+hashing embedding function (benchmarks/offline_fakes.py) in a separate work directory,
+and reused by later runs. Then retrieve_docs, retrieve_docs_alt,
+rag_chroma_without_history and rag_langchain_without_history are run with a fake LLM
+at each concurrency level, and their latency distribution, throughput and the
+process RSS are reported, followed by the per-stage latencies (rag/query_metrics.py).
+
+Usage:
+python3 benchmarks/bench_offline_query.py '{"num_chunks": 10000, "concurrency": [1, 4], "num_queries": 50}'
+python3 benchmarks/bench_offline_query.py '{"num_chunks": 1000000, "functions": ["retrieve_docs_alt"], "llm_latency": 0.5}'
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import resource
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+import src.config as cfg
+import src.rag_query as rag
+import rag.chroma_registry as registry
+import rag.lexical_index as lexical_index
+import rag.query_metrics as metrics
+import benchmarks.offline_fakes as fakes
+from benchmarks.bench_utils import print_summary
+
+FUNCTIONS = [
+    "retrieve_docs",
+    "retrieve_docs_alt",
+    "rag_chroma_without_history",
+    "rag_langchain_without_history",
+]
+DEFAULT_WORK_DIR = os.path.join(tempfile.gettempdir(), "tht_offline_bench")
+
+
+def get_rss_mb() -> float:
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def get_peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def use_offline_environment(work_dir: str, dim: int, llm_latency: float) -> None:
+    """Point the vector db, caches and providers at the work dir and the fakes"""
+    cfg.VECTORDB_DIR = os.path.join(work_dir, "vectordb")
+    cfg.CACHE_DIR = os.path.join(work_dir, "cache")
+    cfg.LEXICAL_INDEX_DIR = os.path.join(work_dir, "lexical_index")
+
+    fakes.register_offline_provider(dim=dim, llm_latency=llm_latency)
+    cfg.LLM_PROVIDER = cfg.EMBEDDINGS_PROVIDER = fakes.OFFLINE_PROVIDER
+    cfg.LLM_MODEL = fakes.OFFLINE_LLM_MODEL
+    cfg.EMBEDDINGS_MODEL = fakes.OFFLINE_EMBEDDINGS_MODEL
+
+
+def build_collection(
+    collection_name: str, num_chunks: int, seed: int, with_lexical_index: bool
+) -> None:
+    """Create the synthetic collection, unless it already exists with num_chunks chunks"""
+    embedding_function = cfg.get_chroma_embedding_function()
+    collection = registry.get_collection(
+        collection_name=collection_name,
+        embedding_function=embedding_function,
+        create=True,
+    )
+    if collection.count() == num_chunks:
+        prnt.prLightPurple(f"Reusing {collection_name} ({num_chunks} chunks)")
+    else:
+        registry.get_client().delete_collection(collection_name)
+        registry.invalidate(collection_name)
+        lexical_index.drop_collection(collection_name)
+        collection = registry.get_collection(
+            collection_name=collection_name,
+            embedding_function=embedding_function,
+            create=True,
+        )
+
+        prnt.prPurple(f"Building {collection_name} with {num_chunks} chunks")
+        client = registry.get_client()
+        batch_size = getattr(client, "get_max_batch_size", lambda: 5000)()
+        start = time.time()
+        batch = []
+        for chunk in fakes.generate_chunks(num_chunks, seed=seed):
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                add_batch(collection, batch, embedding_function)
+                batch = []
+                print(f"{collection.count()}/{num_chunks} chunks")
+        if batch:
+            add_batch(collection, batch, embedding_function)
+
+        elapsed = time.time() - start
+        prnt.prLightPurple(
+            f"Built in {elapsed:.1f}s ({num_chunks / elapsed:.0f} chunks/s), "
+            f"RSS {get_rss_mb():.0f} MB"
+        )
+
+    if with_lexical_index and lexical_index.count(collection_name) != num_chunks:
+        lexical_index.rebuild_from_chroma(collection_name)
+
+
+def add_batch(collection, batch: list, embedding_function) -> None:
+    ids, documents, metadatas = zip(*batch)
+    collection.add(
+        ids=list(ids),
+        documents=list(documents),
+        metadatas=list(metadatas),
+        embeddings=embedding_function(list(documents)),
+    )
+
+
+def sample_queries(collection_name: str, num_queries: int, seed: int) -> list[str]:
+    """A window of words cut out of randomly sampled chunks"""
+    rnd = random.Random(seed)
+    collection = registry.get_client().get_collection(
+        name=collection_name, embedding_function=None
+    )
+    num_chunks = collection.count()
+
+    queries = []
+    for _ in range(num_queries):
+        page = collection.get(
+            limit=1, offset=rnd.randrange(num_chunks), include=["documents"]
+        )
+        words = page["documents"][0].split()
+        start = rnd.randrange(max(1, len(words) - 12))
+        queries.append(" ".join(words[start : start + 12]))
+
+    return queries
+
+
+def make_runner(function_name: str, collection_name: str):
+    """The function under test, as a callable that takes a query"""
+    embeddings = cfg.get_embeddings()
+
+    if function_name == "retrieve_docs":
+        vectordb = rag.load_vectordb(collection_name, embeddings)
+        return lambda q: rag.retrieve_docs(vectordb, q)
+    elif function_name == "retrieve_docs_alt":
+        return lambda q: rag.retrieve_docs_alt(
+            collection_name, None, q, embedding_function=embeddings
+        )
+    elif function_name == "rag_chroma_without_history":
+        embedding_function = cfg.get_chroma_embedding_function()
+        return lambda q: rag.rag_chroma_without_history(
+            q, collection_name, embedding_function=embedding_function
+        )
+    elif function_name == "rag_langchain_without_history":
+        return lambda q: rag.rag_langchain_without_history(
+            q, [collection_name], embedding_function=embeddings
+        )
+
+    raise ValueError(f"Unknown function: {function_name}")
+
+
+def run_concurrently(
+    runner, queries: list[str], concurrency: int
+) -> tuple[list, float]:
+    """Returns the latency of every call and the wall time of all of them"""
+
+    def timed_call(query):
+        start = time.perf_counter()
+        runner(query)
+        return time.perf_counter() - start
+
+    # the functions under test print their results, keep them out of the report (and
+    # out of memory, which would skew the RSS)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        runner(queries[0])  # warm-up
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(timed_call, queries))
+        wall = time.perf_counter() - start
+
+    return latencies, wall
+
+
+if __name__ == "__main__":
+    inputs = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    num_chunks = inputs.get("num_chunks", 10_000)
+    dim = inputs.get("dim", 384)
+    seed = inputs.get("seed", 0)
+    functions = inputs.get("functions", FUNCTIONS)
+    concurrency_levels = inputs.get("concurrency", [1, 4])
+
+    use_offline_environment(
+        inputs.get("work_dir", DEFAULT_WORK_DIR), dim, inputs.get("llm_latency", 0.0)
+    )
+
+    collection_name = f"offline_{num_chunks}_{dim}d"
+    build_collection(
+        collection_name,
+        num_chunks,
+        seed,
+        with_lexical_index=cfg.RETRIEVAL_MODE != "mmr",
+    )
+    queries = sample_queries(collection_name, inputs.get("num_queries", 50), seed)
+
+    results = []
+    for function_name in functions:
+        runner = make_runner(function_name, collection_name)
+        for concurrency in concurrency_levels:
+            latencies, wall = run_concurrently(runner, queries, concurrency)
+            summary = print_summary(
+                f"{function_name}, {num_chunks} chunks, concurrency {concurrency}",
+                latencies,
+            )
+            summary.update(
+                {
+                    "function": function_name,
+                    "num_chunks": num_chunks,
+                    "concurrency": concurrency,
+                    "throughput": len(queries) / wall,
+                    "rss_mb": get_rss_mb(),
+                    "peak_rss_mb": get_peak_rss_mb(),
+                }
+            )
+            print(
+                f"throughput={summary['throughput']:.1f} queries/s  "
+                f"RSS={summary['rss_mb']:.0f} MB  peak RSS={summary['peak_rss_mb']:.0f} MB"
+            )
+            results.append(summary)
+
+    metrics.print_summary()
+
+    if inputs.get("output_file"):
+        with open(inputs["output_file"], "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        prnt.prLightPurple(f"\nSaved the results to {inputs['output_file']}")
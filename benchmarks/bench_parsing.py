@@ -0,0 +1,73 @@
+"""
+Parse throughput of a folder of local files (PDF, docx, text) with different numbers of
+worker processes (rag/source_parsing.py), and the peak RSS of the workers.
+A single worker parses in this process, like the loader did before the process pool.
+
+Usage:
+python3 benchmarks/bench_parsing.py '{"dir_name": "results/leopards_india/scholar/2020_2025/pdf", "workers": [1, 2, 4, 8]}'
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+import rag.source_parsing as source_parsing
+
+
+def time_parsing(files: list, workers: int) -> dict:
+    start = time.time()
+    num_pages, num_chars, num_failed = 0, 0, 0
+    for _, pages, _ in source_parsing.parse_files(files, max_workers=workers):
+        if pages is None:
+            num_failed += 1
+            continue
+        num_pages += len(pages)
+        num_chars += sum(len(text) for text, _ in pages)
+    elapsed = time.time() - start
+
+    return {
+        "workers": workers,
+        "seconds": elapsed,
+        "files_per_second": len(files) / elapsed,
+        "pages_per_second": num_pages / elapsed,
+        "num_pages": num_pages,
+        "num_chars": num_chars,
+        "num_failed": num_failed,
+    }
+
+
+if __name__ == "__main__":
+    inputs = json.loads(sys.argv[1])
+    dir_name = inputs["dir_name"]
+    files = [
+        (f, os.path.join(dir_name, f))
+        for f in sorted(os.listdir(dir_name))
+        if source_parsing.can_parse(f)
+    ][: inputs.get("max_files")]
+    prnt.prPurple(f"Parsing {len(files)} files from {dir_name}")
+
+    results = []
+    for workers in inputs.get("workers", [1, os.cpu_count()]):
+        result = time_parsing(files, workers)
+        results.append(result)
+        prnt.prYellow(f"\n{workers} worker(s)")
+        print(
+            f"{result['seconds']:.1f}s  {result['files_per_second']:.1f} files/s  "
+            f"{result['pages_per_second']:.1f} pages/s  ({result['num_pages']} pages, "
+            f"{result['num_failed']} failed)"
+        )
+
+    # ru_maxrss is in KB on Linux; for children it's the largest single worker
+    print(
+        f"\nPeak RSS: this process {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB, "
+        f"largest worker {resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.0f} MB"
+    )
+
+    if inputs.get("output_file"):
+        with open(inputs["output_file"], "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        prnt.prLightPurple(f"\nSaved the results to {inputs['output_file']}")
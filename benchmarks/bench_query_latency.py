@@ -0,0 +1,85 @@
+"""
+Per-question latency of the chat path: one `src/rag_query.py` subprocess per question
+(the old path) vs. the long-lived in-process query service (the current path), plus the
+service's time to first streamed token. The answer cache is bypassed.
+
+Usage:
+python3 benchmarks/bench_query_latency.py '{"data_source": "link", "collection_name_prefix": "my_docs", "num_questions": 5}'
+"""
+
+import os
+import sys
+import json
+import time
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+from benchmarks.bench_utils import print_summary
+
+ROOT_DIR = os.path.join(os.path.dirname(__file__), "..")
+
+DEFAULT_QUESTIONS = [
+    "What are the major threats facing leopards in India?",
+    "Where have leopard-human conflicts been reported?",
+    "Which protected areas are mentioned?",
+    "How are leopard populations monitored?",
+    "What conflict mitigation measures have been tried?",
+]
+
+
+def time_subprocess_path(rag_inputs: dict) -> float:
+    start = time.time()
+    subprocess.run(
+        ["python3", "src/rag_query.py", json.dumps(rag_inputs)],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=ROOT_DIR,
+    )
+    return time.time() - start
+
+
+def time_service_path(service, rag_inputs: dict) -> tuple[float, float]:
+    """Returns (time to first token, time to full answer)"""
+    start = time.time()
+    ttft = None
+    for _ in service.stream_with_inputs(rag_inputs):
+        if ttft is None:
+            ttft = time.time() - start
+    return ttft or 0.0, time.time() - start
+
+
+if __name__ == "__main__":
+    inputs = json.loads(sys.argv[1])
+    questions = inputs.get("questions") or DEFAULT_QUESTIONS
+    questions = questions[: inputs.get("num_questions", len(questions))]
+
+    all_rag_inputs = [
+        {
+            "question": q,
+            "data_source": inputs["data_source"],
+            "collection_name_prefix": inputs["collection_name_prefix"],
+        }
+        for q in questions
+    ]
+
+    prnt.prPurple(f"Timing {len(questions)} questions, one subprocess per question")
+    before = [time_subprocess_path(r) for r in all_rag_inputs]
+
+    prnt.prPurple(f"Timing {len(questions)} questions through the query service")
+    # The first call includes imports and warm-up, report it separately
+    start = time.time()
+    from src.query_service import QueryService
+
+    import_time = time.time() - start
+    service = QueryService(use_answer_cache=False)
+    timings = [time_service_path(service, r) for r in all_rag_inputs]
+    ttfts = [t[0] for t in timings]
+    after = [t[1] for t in timings]
+
+    print_summary("Before: subprocess per question", before)
+    print_summary("After: in-process query service (all questions)", after)
+    print_summary("After: in-process query service (excluding first)", after[1:])
+    print_summary("After: time to first streamed token", ttfts)
+    print(f"\nOne-time import cost of the query service: {import_time:.2f}s")
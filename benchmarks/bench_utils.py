@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile, pct in [0, 100]"""
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies: list) -> dict:
+    if not latencies:
+        return {"n": 0}
+
+    return {
+        "n": len(latencies),
+        "mean": sum(latencies) / len(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies),
+    }
+
+
+def print_summary(label: str, latencies: list, unit: str = "s") -> dict:
+    summary = summarize(latencies)
+    prnt.prYellow(f"\n{label}")
+    if summary["n"] == 0:
+        print("No measurements.")
+        return summary
+
+    print(
+        f"n={summary['n']}  mean={summary['mean']:.3f}{unit}  p50={summary['p50']:.3f}{unit}  "
+        f"p95={summary['p95']:.3f}{unit}  p99={summary['p99']:.3f}{unit}  max={summary['max']:.3f}{unit}"
+    )
+    return summary
@@ -0,0 +1,277 @@
+"""
+Recall@k, vector search latency and bytes per vector of the ways a collection can
+store its vectors (EMBEDDING_DIMENSIONS / EMBEDDING_QUANTIZATION in src/config.py):
+all dimensions in float32 (the current setup, the baseline), fewer dimensions, and
+either of them with the int8 index (rag/quantized_index.py). Bytes per vector are
+counted three ways: scanned by a search, on disk (everything the setting stores:
+Chroma, and the int8 index if any), and resident (the index a searching process keeps
+in memory: Chroma's HNSW index, or the int8 matrix).
+
+The vectors of an existing collection (or of a synthetic one, embedded with the offline
+hashing embedder) are copied into one collection per setting, in a separate work
+directory. Queries are windows of words cut out of sampled chunks; the exact top k of
+the full-precision vectors is the ground truth, and every setting is searched with
+rag_query.fetch_candidates, like the chat does. The hashing embedder isn't trained to
+be shortened, so its recall with fewer dimensions is lower than a text-embedding-3
+model's.
+
+Usage:
+python3 benchmarks/bench_vector_storage.py '{"collection_name": "leopard_news", "num_queries": 100}'
+python3 benchmarks/bench_vector_storage.py '{"num_chunks": 20000, "dimensions": [384, 192, 96]}'
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+import src.config as cfg
+import src.rag_query as rag
+import rag.chroma_registry as registry
+import rag.quantized_index as quantized_index
+import benchmarks.offline_fakes as fakes
+from benchmarks.bench_utils import summarize
+
+DEFAULT_WORK_DIR = os.path.join(tempfile.gettempdir(), "tht_vector_storage_bench")
+
+
+def load_collection(collection_name: str, page_size: int = 1000) -> tuple:
+    """(ids, documents, embeddings, its vector settings) of an existing collection"""
+    collection = registry.get_client().get_collection(
+        name=collection_name, embedding_function=None
+    )
+    ids, documents, embeddings = [], [], []
+    offset = 0
+    while True:
+        page = collection.get(
+            limit=page_size, offset=offset, include=["documents", "embeddings"]
+        )
+        if not len(page["ids"]):
+            break
+        ids += page["ids"]
+        documents += page["documents"]
+        embeddings += list(page["embeddings"])
+        offset += page_size
+
+    return (
+        ids,
+        documents,
+        np.asarray(embeddings, dtype=np.float32),
+        registry.get_vector_settings(collection),
+    )
+
+
+def make_synthetic_collection(num_chunks: int, dim: int) -> tuple:
+    fakes.register_offline_provider(dim=dim)
+    cfg.EMBEDDINGS_PROVIDER = fakes.OFFLINE_PROVIDER
+    cfg.EMBEDDINGS_MODEL = fakes.OFFLINE_EMBEDDINGS_MODEL
+
+    ids, documents, _ = zip(*fakes.generate_chunks(num_chunks))
+    embedding_function = cfg.get_chroma_embedding_function()
+    embeddings = np.asarray(embedding_function(list(documents)), dtype=np.float32)
+    return list(ids), list(documents), embeddings, {"dimensions": None}
+
+
+def sample_queries(documents: list, num_queries: int, seed: int) -> list[str]:
+    rnd = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        words = rnd.choice(documents).split()
+        start = rnd.randrange(max(1, len(words) - 12))
+        queries.append(" ".join(words[start : start + 12]))
+    return queries
+
+
+def exact_top_k(embeddings: np.ndarray, query_embedding, k: int) -> list[int]:
+    query = np.asarray(query_embedding, dtype=np.float32)
+    distances = ((embeddings - query) ** 2).sum(axis=1)
+    top = np.argpartition(distances, k - 1)[:k]
+    return top[np.argsort(distances[top])].tolist()
+
+
+def get_dir_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path)
+        for f in files
+    )
+
+
+def get_disk_bytes(work_dir: str, name: str) -> int:
+    """Everything the setting stores, once the int8 index's WAL is written into it"""
+    index_file = quantized_index.get_index_path(name)
+    if os.path.exists(index_file):
+        conn = sqlite3.connect(index_file)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+    return get_dir_size(os.path.join(work_dir, name))
+
+
+def get_resident_bytes(work_dir: str, name: str, quantization: str) -> int:
+    """
+    The bytes of the vector index the chat keeps in memory: the int8 matrix and its
+    scales, or the HNSW vectors and graph, which hnswlib loads whole from the
+    data_level0.bin and link_lists.bin files of the collection's segment
+    """
+    if quantization == "int8":
+        _, matrix, scales = quantized_index.load(name)
+        return matrix.nbytes + scales.nbytes
+
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(os.path.join(work_dir, name, "vectordb"))
+        for f in files
+        if f in ["data_level0.bin", "link_lists.bin"]
+    )
+
+
+def build_variant(
+    work_dir: str, name: str, ids: list, documents: list, embeddings, settings: dict
+) -> None:
+    """A collection created with the settings, holding the given vectors"""
+    cfg.VECTORDB_DIR = os.path.join(work_dir, name, "vectordb")
+    cfg.QUANTIZED_INDEX_DIR = os.path.join(work_dir, name, "quantized_index")
+    cfg.COLLECTION_VECTOR_SETTINGS = {name: settings}
+
+    collection = registry.get_collection(name, embedding_function=None, create=True)
+    vectors = np.asarray(
+        registry.shorten_embeddings(embeddings, settings.get("dimensions")),
+        dtype=np.float32,
+    )
+    chroma_vectors = quantized_index.get_chroma_embeddings(
+        registry.get_vector_settings(collection), vectors.tolist()
+    )
+    batch_size = getattr(registry.get_client(), "get_max_batch_size", lambda: 5000)()
+    for i in range(0, len(ids), batch_size):
+        metadatas = [{"source": id_} for id_ in ids[i : i + batch_size]]
+        collection.add(
+            ids=ids[i : i + batch_size],
+            documents=documents[i : i + batch_size],
+            metadatas=metadatas,
+            embeddings=chroma_vectors[i : i + batch_size],
+        )
+        if settings.get("quantization") == "int8":
+            quantized_index.upsert_vectors(
+                name, ids[i : i + batch_size], vectors[i : i + batch_size], metadatas
+            )
+
+
+def run_variant(
+    work_dir: str, name: str, query_embeddings: list, truths: list, k: int
+) -> dict:
+    cfg.VECTORDB_DIR = os.path.join(work_dir, name, "vectordb")
+    cfg.QUANTIZED_INDEX_DIR = os.path.join(work_dir, name, "quantized_index")
+
+    # the first search loads the HNSW or int8 index
+    rag.fetch_candidates(query_embeddings[0], [name], fetch_k=k)
+
+    latencies, recalls = [], []
+    for query_embedding, truth in zip(query_embeddings, truths):
+        start = time.perf_counter()
+        candidates = rag.fetch_candidates(query_embedding, [name], fetch_k=k)
+        latencies.append(time.perf_counter() - start)
+        found = {c["document"].id for c in candidates}
+        recalls.append(len(found & set(truth)) / k)
+
+    return {"latency": summarize(latencies), "recall": sum(recalls) / len(recalls)}
+
+
+if __name__ == "__main__":
+    inputs = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    k = inputs.get("k", 10)
+
+    if inputs.get("collection_name"):
+        prnt.prPurple(f"Reading the vectors of {inputs['collection_name']}")
+        ids, documents, embeddings, source_settings = load_collection(
+            inputs["collection_name"]
+        )
+    else:
+        prnt.prPurple("Embedding a synthetic collection")
+        ids, documents, embeddings, source_settings = make_synthetic_collection(
+            inputs.get("num_chunks", 20_000), inputs.get("dim", 384)
+        )
+    dim = embeddings.shape[1]
+    prnt.prLightPurple(f"{len(ids)} vectors of {dim} dimensions")
+
+    # queries are embedded like the chat embeds them, then shortened to the source's
+    query_embeddings = registry.shorten_embeddings(
+        [
+            cfg.get_embeddings().embed_query(query)
+            for query in sample_queries(
+                documents, inputs.get("num_queries", 100), inputs.get("seed", 0)
+            )
+        ],
+        source_settings["dimensions"],
+    )
+    truths = [
+        [ids[i] for i in exact_top_k(embeddings, q, k)] for q in query_embeddings
+    ]
+
+    work_dir = inputs.get("work_dir", DEFAULT_WORK_DIR)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    results = []
+    for dimensions in inputs.get("dimensions", [dim, dim // 2, dim // 4]):
+        for quantization in inputs.get("quantization", [None, "int8"]):
+            name = f"bench_{dimensions}_{quantization or 'float32'}"
+            settings = {"dimensions": dimensions if dimensions < dim else None}
+            if quantization:
+                settings["quantization"] = quantization
+
+            build_variant(work_dir, name, ids, documents, embeddings, settings)
+            result = run_variant(work_dir, name, query_embeddings, truths, k)
+            result.update(
+                name=name,
+                dimensions=dimensions,
+                quantization=quantization,
+                # what the vector search scans: float32 vectors, or int8 + a scale
+                search_bytes_per_vector=(
+                    dimensions + 4 if quantization == "int8" else dimensions * 4
+                ),
+                disk_bytes_per_vector=get_disk_bytes(work_dir, name) / len(ids),
+                resident_bytes_per_vector=(
+                    get_resident_bytes(work_dir, name, quantization) / len(ids)
+                ),
+            )
+            results.append(result)
+
+            prnt.prYellow(f"\n{name}")
+            print(
+                f"recall@{k} {result['recall']:.3f}  "
+                f"p50 {result['latency']['p50'] * 1000:.1f}ms  "
+                f"p95 {result['latency']['p95'] * 1000:.1f}ms  "
+                f"{result['search_bytes_per_vector']} bytes/vector searched  "
+                f"{result['disk_bytes_per_vector']:.0f} on disk  "
+                f"{result['resident_bytes_per_vector']:.0f} resident"
+            )
+
+    # the baseline: all the dimensions in float32, in Chroma's HNSW index (which is
+    # only written to disk, and counted, once it has 1000 vectors)
+    baseline = next((r for r in results if r["name"] == f"bench_{dim}_float32"), None)
+    if baseline and baseline["resident_bytes_per_vector"]:
+        prnt.prYellow(f"\nBytes per vector, against {baseline['name']}")
+        for result in results:
+            for key in ["disk", "resident"]:
+                result[f"{key}_vs_baseline"] = (
+                    result[f"{key}_bytes_per_vector"]
+                    / baseline[f"{key}_bytes_per_vector"]
+                )
+            print(
+                f"{result['name']:<24} "
+                f"disk {result['disk_bytes_per_vector']:>8.0f} "
+                f"({result['disk_vs_baseline']:.2f}x)  "
+                f"resident {result['resident_bytes_per_vector']:>8.0f} "
+                f"({result['resident_vs_baseline']:.2f}x)"
+            )
+
+    if inputs.get("output_file"):
+        with open(inputs["output_file"], "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        prnt.prLightPurple(f"\nSaved the results to {inputs['output_file']}")
@@ -0,0 +1,164 @@
+"""
+Deterministic stand-ins for the OpenAI embeddings and LLM, and a synthetic corpus,
+so that the query path can be benchmarked without network access or API costs.
+"""
+
+import re
+import time
+import random
+import hashlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from chromadb.api.types import Documents, EmbeddingFunction
+
+OFFLINE_PROVIDER = "offline"
+OFFLINE_EMBEDDINGS_MODEL = "offline-hashing"
+OFFLINE_LLM_MODEL = "offline-fake-llm"
+
+
+class HashingEmbedder:
+    """
+    Bag-of-words feature hashing: every word adds +-1 to a few dimensions picked by its
+    hash, and the sum is normalized. The same text always gets the same vector, and
+    texts that share words are close, so nearest-neighbour search and MMR behave like
+    they do with real embeddings (minus the semantics).
+    """
+
+    def __init__(self, dim: int = 384, hashes_per_word: int = 4) -> None:
+        self.dim = dim
+        self.hashes_per_word = hashes_per_word
+        self._word_features = {}  # word -> (dimensions, signs)
+
+    def _features(self, word: str):
+        features = self._word_features.get(word)
+        if features is None:
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=16).digest()
+            dims = [
+                int.from_bytes(digest[2 * i : 2 * i + 2], "little") % self.dim
+                for i in range(self.hashes_per_word)
+            ]
+            signs = [
+                1.0 if digest[8 + i] & 1 else -1.0 for i in range(self.hashes_per_word)
+            ]
+            features = self._word_features[word] = (dims, signs)
+        return features
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            all_dims, all_signs = [], []
+            for word in re.findall(r"\w+", text.lower()):
+                dims, signs = self._features(word)
+                all_dims += dims
+                all_signs += signs
+            np.add.at(vectors[row], all_dims, all_signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-12, None)
+
+
+class HashingEmbeddings(Embeddings):
+    """LangChain embeddings backed by HashingEmbedder"""
+
+    def __init__(self, embedder: HashingEmbedder = None) -> None:
+        self.embedder = embedder or HashingEmbedder()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embedder.embed(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embedder.embed([text])[0].tolist()
+
+
+class HashingEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Chroma embedding function backed by HashingEmbedder"""
+
+    def __init__(self, embedder: HashingEmbedder = None) -> None:
+        self.embedder = embedder or HashingEmbedder()
+        # keys the chunk embedding cache, the same model name is used at every size
+        self.dimensions = self.embedder.dim
+
+    def __call__(self, input: Documents):
+        return list(self.embedder.embed(list(input)))
+
+
+class FakeChatModel(FakeListChatModel):
+    """Chat model that answers with canned responses after a fixed latency"""
+
+    latency: float = 0.0
+
+    def _call(self, *args, **kwargs) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return super()._call(*args, **kwargs)
+
+
+def make_fake_llm(latency: float = 0.0) -> FakeChatModel:
+    return FakeChatModel(
+        responses=[
+            "Leopards in the region mostly face habitat loss and conflict with people. "
+            "Source: synthetic-source-0"
+        ],
+        latency=latency,
+    )
+
+
+def register_offline_provider(dim: int = 384, llm_latency: float = 0.0) -> dict:
+    """
+    Add the 'offline' provider to cfg.PROVIDERS, so that cfg.get_llm() and friends
+    return the fakes once cfg.LLM_PROVIDER / cfg.EMBEDDINGS_PROVIDER point to it
+    """
+    import src.config as cfg
+
+    embedder = HashingEmbedder(dim=dim)
+    cfg.PROVIDERS[OFFLINE_PROVIDER] = {
+        "llm_models": [OFFLINE_LLM_MODEL],
+        "langchain_llm": lambda model: make_fake_llm(llm_latency),
+        "langchain_embeddings": lambda model: HashingEmbeddings(embedder),
+        "chroma_embedding_function": lambda model: HashingEmbeddingFunction(embedder),
+    }
+    return cfg.PROVIDERS[OFFLINE_PROVIDER]
+
+
+def make_vocabulary(size: int, seed: int) -> list[str]:
+    rnd = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rnd.choice(letters) for _ in range(rnd.randint(3, 10))))
+    return sorted(words)
+
+
+def generate_chunks(
+    num_chunks: int,
+    words_per_chunk: int = 120,
+    chunks_per_source: int = 10,
+    vocabulary_size: int = 20_000,
+    seed: int = 0,
+):
+    """
+    Yields (id, text, metadata) of synthetic chunks, with ids like the ingest pipeline
+    creates ('<source>_page-0_chunk-<i>'). Words follow a Zipf-like distribution, like
+    natural text does, so some words are frequent and most are rare.
+    """
+    rnd = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, seed)
+    cum_weights = np.cumsum(1.0 / np.arange(1, vocabulary_size + 1)).tolist()
+
+    for i in range(num_chunks):
+        source_number, chunk_number = divmod(i, chunks_per_source)
+        source = f"synthetic-source-{source_number}"
+        text = " ".join(
+            rnd.choices(vocabulary, cum_weights=cum_weights, k=words_per_chunk)
+        )
+        yield (
+            f"{source}_page-0_chunk-{chunk_number}",
+            text,
+            {
+                "source": source,
+                "id": f"{source}_page-0_chunk-{chunk_number}",
+                "type": "plain_text",
+                "title": f"Synthetic article {source_number % 100}",
+            },
+        )
@@ -19,15 +19,11 @@ import src.config as cfg
 from datetime import datetime, timedelta
 import collections
 import asyncio
-from crawl4ai import (
-    AsyncWebCrawler,
-    # BrowserConfig,
-    CacheMode,
-    CrawlerRunConfig,
-    # LLMExtractionStrategy,
-    # LLMConfig,
-    # JsonCssExtractionStrategy,
-)
+from typing import TYPE_CHECKING
+
+# crawl4ai is slow to import, it's only imported when crawling starts
+if TYPE_CHECKING:
+    from crawl4ai import AsyncWebCrawler
 
 import pandas as pd
 from dateutil import parser
@@ -82,11 +78,6 @@ class NewsSearch:
             dut.create_csv_with_headers(
                 dirname=self.results_dirname, filename="parsed_news_items.csv"
             )
-            dut.create_csv_with_headers(
-                dirname=self.results_dirname,
-                filename="embedded_sources.csv",
-                headers=["Sources"],
-            )
 
     def fetch_news_using_serpapi(self, period_start, period_end) -> list:
         """
@@ -272,6 +263,8 @@ class NewsSearch:
         """
         Main function to crawl news data from the news website.
         """
+        from crawl4ai import AsyncWebCrawler
+
         # Initialize configurations
         browser_config = get_browser_config()
         session_id = "news_items_crawl_session"
@@ -382,7 +375,7 @@ class NewsSearch:
 
     async def fetch_and_process_page(
         self,
-        crawler: AsyncWebCrawler,
+        crawler: "AsyncWebCrawler",
         article_details: dict,
         # llm_strategy: LLMExtractionStrategy,
         # json_css_strategy: JsonCssExtractionStrategy,
@@ -400,6 +393,8 @@ class NewsSearch:
         Returns:
             - List[dict]: A list of processed news_items from the page.
         """
+        from crawl4ai import CacheMode, CrawlerRunConfig
+
         url = article_details["link"]
         source = article_details["source"]
 
@@ -20,8 +20,8 @@ import utils.print_utils as pr
 import utils.data_utils as dut
 import utils.print_utils as prnt
 import rag.maintain_vectordb as vdb
+import rag.ingest_manifest as ingest_manifest
 import re
-import pandas as pd
 import rag.fields_of_interest as foi
 from src.extract_fields_of_interest import find_and_save_rag_answer
 from src.scrape import download_pdfs, get_download_pdf_link
@@ -81,11 +81,6 @@ class ScholarSearch:
             # dut.create_csv_with_headers(
             #     dirname=self.results_dirname, filename="parsed_news_items.csv"
             # )
-            dut.create_csv_with_headers(
-                dirname=self.results_dirname,
-                filename="embedded_sources.csv",
-                headers=["Sources"],
-            )
 
     def search_scholar_with_serpapi(self, pages_per_year: int):
         prnt.prPurple(
@@ -491,14 +486,11 @@ class ScholarSearch:
         articles = dut.load_json(
             os.path.join(self.results_dirname, "filepath_" + self.results_filename)
         )
-        embedded_sources_df = pd.read_csv(
-            os.path.join(
-                self.results_dirname,
-                "embedded_sources.csv",
-                # curr_dir, "..", "rag", self.collection_name + "_embedded_sources.csv"
-            )
+        embedded_sources = ingest_manifest.embedded_among(
+            self.collection_name,
+            [art["title"] + ".pdf" for art in articles]
+            + ["Abstract: " + art["title"] for art in articles],
         )
-        embedded_sources = set(embedded_sources_df["Sources"].to_list())
 
         # df = pd.read_csv(os.path.join(self.results_dirname, filename))
         print(f"Num articles: {len(articles)}\n")
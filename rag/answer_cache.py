@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import src.config as cfg
+from rag.embedding_cache import normalize_query
+
+ANSWER_CACHE_FILE = "answers.sqlite3"
+MAX_CACHED_ANSWERS = 10_000
+
+_lock = threading.Lock()
+_puts_since_pruning = 0
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    A short-lived connection per operation: the ingest pipelines run in their own
+    processes and bump collection versions in the same file.
+    """
+    os.makedirs(cfg.CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(cfg.CACHE_DIR, ANSWER_CACHE_FILE), timeout=30)
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS collection_versions (
+            collection TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS answers (
+            key TEXT PRIMARY KEY,
+            answer TEXT NOT NULL,
+            created REAL NOT NULL
+        )"""
+    )
+    return conn
+
+
+def get_collection_versions(collection_names: list[str]) -> dict:
+    with _connect() as conn:
+        rows = conn.execute(
+            f"SELECT collection, version FROM collection_versions WHERE collection IN ({','.join('?' * len(collection_names))})",
+            list(collection_names),
+        ).fetchall()
+    conn.close()
+
+    versions = {name: 0 for name in collection_names}
+    versions.update(dict(rows))
+    return versions
+
+
+def bump_collection_version(collection_name: str) -> None:
+    """Call this after every write to a collection, so its cached answers are never served again"""
+    with _connect() as conn:
+        conn.execute(
+            """INSERT INTO collection_versions (collection, version) VALUES (?, 1)
+            ON CONFLICT(collection) DO UPDATE SET version = version + 1""",
+            (collection_name,),
+        )
+    conn.close()
+
+
+def make_answer_key(
+    question: str,
+    collection_names: list[str],
+    retrieval_params: dict,
+    prompt_template: str,
+    llm_model: str,
+) -> str:
+    key_fields = {
+        "question": normalize_query(question),
+        "collections": get_collection_versions(sorted(collection_names)),
+        "retrieval_params": retrieval_params,
+        "prompt_template": hashlib.sha256(prompt_template.encode("utf-8")).hexdigest(),
+        "llm_model": llm_model,
+    }
+    return hashlib.sha256(
+        json.dumps(key_fields, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def get_answer(key: str):
+    with _connect() as conn:
+        row = conn.execute("SELECT answer FROM answers WHERE key = ?", (key,)).fetchone()
+    conn.close()
+
+    return row[0] if row else None
+
+
+def put_answer(key: str, answer: str) -> None:
+    global _puts_since_pruning
+
+    with _connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO answers (key, answer, created) VALUES (?, ?, ?)",
+            (key, answer, time.time()),
+        )
+
+        with _lock:
+            _puts_since_pruning += 1
+            prune = _puts_since_pruning >= 100
+            if prune:
+                _puts_since_pruning = 0
+
+        if prune:
+            # answers keyed by old collection versions can never hit again, drop the oldest first
+            conn.execute(
+                """DELETE FROM answers WHERE key NOT IN
+                (SELECT key FROM answers ORDER BY created DESC LIMIT ?)""",
+                (MAX_CACHED_ANSWERS,),
+            )
+    conn.close()
@@ -0,0 +1,219 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import chromadb
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+from chromadb.api.types import Documents, EmbeddingFunction
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+import src.config as cfg
+
+MAX_OPEN_COLLECTIONS = 32
+
+_lock = threading.RLock()
+_clients = {}  # persist dir -> chromadb.PersistentClient
+# (persist dir, collection name, embedding fn id, kind) -> (Chroma wrapper or Chroma collection, embedding fn)
+_open_collections = OrderedDict()
+
+
+def get_client(persist_dir: str = None):
+    """Return the process-wide PersistentClient for persist_dir, creating it on first use"""
+    persist_dir = os.path.abspath(persist_dir or cfg.VECTORDB_DIR)
+
+    with _lock:
+        client = _clients.get(persist_dir)
+        if client is None:
+            client = chromadb.PersistentClient(path=persist_dir)
+            _clients[persist_dir] = client
+
+    return client
+
+
+def get_new_collection_metadata(collection_name: str) -> dict:
+    """
+    The vector settings a collection is created with (EMBEDDING_DIMENSIONS,
+    EMBEDDING_QUANTIZATION and COLLECTION_VECTOR_SETTINGS), as Chroma collection
+    metadata. They're fixed from then on. None if there are none.
+    """
+    settings = {
+        "dimensions": cfg.EMBEDDING_DIMENSIONS,
+        "quantization": cfg.EMBEDDING_QUANTIZATION,
+        **cfg.COLLECTION_VECTOR_SETTINGS.get(collection_name, {}),
+    }
+    if settings.get("quantization") == "int8":
+        # the vectors are kept in the int8 index only (rag/quantized_index.py)
+        settings["store"] = "quantized_index"
+    metadata = {f"embedding_{key}": val for key, val in settings.items() if val}
+    return metadata or None
+
+
+def get_vector_settings(collection) -> dict:
+    """
+    The 'dimensions' (None: the model's) and 'quantization' of a Chroma collection, and
+    where its vectors are 'store'd: "chroma", or "quantized_index" (Chroma only holds
+    placeholders)
+    """
+    metadata = collection.metadata or {}
+    return {
+        "dimensions": metadata.get("embedding_dimensions"),
+        "quantization": metadata.get("embedding_quantization"),
+        "store": metadata.get("embedding_store", "chroma"),
+    }
+
+
+def shorten_embeddings(embeddings, dimensions: int = None) -> list:
+    """
+    Keep the first `dimensions` of every embedding and rescale it to unit length, which
+    is how text-embedding-3 models are meant to be shortened. Unchanged if None.
+    """
+    if not dimensions or len(embeddings) == 0 or len(embeddings[0]) <= dimensions:
+        return embeddings
+
+    vectors = np.asarray(embeddings, dtype=np.float32)[:, :dimensions]
+    vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    return vectors.tolist()
+
+
+class ShortenedEmbeddings(Embeddings):
+    """LangChain embeddings whose vectors are shortened to a collection's dimensions"""
+
+    def __init__(self, embeddings: Embeddings, dimensions: int) -> None:
+        self.embeddings = embeddings
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return shorten_embeddings(
+            self.embeddings.embed_documents(texts), self.dimensions
+        )
+
+    def embed_query(self, text: str) -> list[float]:
+        return shorten_embeddings(
+            [self.embeddings.embed_query(text)], self.dimensions
+        )[0]
+
+
+class ShortenedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Chroma embedding function whose vectors are shortened like ShortenedEmbeddings"""
+
+    def __init__(self, embedding_function, dimensions: int) -> None:
+        self.embedding_function = embedding_function
+        self.dimensions = dimensions
+
+    def __call__(self, input: Documents):
+        return shorten_embeddings(self.embedding_function(input), self.dimensions)
+
+
+def _find_collection(client, collection_name: str):
+    """The collection, without its embedding function, or None if it doesn't exist"""
+    try:
+        return client.get_collection(name=collection_name, embedding_function=None)
+    except Exception:
+        return None
+
+
+def _get_or_open(key: tuple, open_fn, embedding_function):
+    with _lock:
+        if key in _open_collections:
+            _open_collections.move_to_end(key)
+            return _open_collections[key][0]
+
+        opened = open_fn()
+        _open_collections[key] = (opened, embedding_function)
+
+        while len(_open_collections) > MAX_OPEN_COLLECTIONS:
+            evicted_key, _ = _open_collections.popitem(last=False)
+            prnt.prLightPurple(f"Closing {evicted_key[3]} for {evicted_key[1]} (LRU)")
+
+    return opened
+
+
+def get_vectorstore(
+    collection_name: str, embedding_function, persist_dir: str = None
+) -> Chroma:
+    """
+    Return a LangChain Chroma wrapper around the given collection.
+    Wrappers are kept in a bounded LRU cache keyed by collection name and embedding
+    function, so repeated queries against the same collection don't re-open it.
+    The embeddings are shortened to the collection's dimensions, if it has any.
+    """
+    persist_dir = os.path.abspath(persist_dir or cfg.VECTORDB_DIR)
+    # The embedding function is kept alive in the cache entry, so its id can't be reused
+    key = (persist_dir, collection_name, id(embedding_function), "vectorstore")
+
+    def open_vectorstore():
+        client = get_client(persist_dir)
+        collection = _find_collection(client, collection_name)
+        metadata = (
+            collection.metadata
+            if collection is not None
+            else get_new_collection_metadata(collection_name)
+        )
+        dimensions = (metadata or {}).get("embedding_dimensions")
+        return Chroma(
+            client=client,
+            persist_directory=persist_dir,
+            collection_name=collection_name,
+            embedding_function=(
+                ShortenedEmbeddings(embedding_function, dimensions)
+                if dimensions and embedding_function is not None
+                else embedding_function
+            ),
+            collection_metadata=metadata,
+        )
+
+    return _get_or_open(key, open_vectorstore, embedding_function)
+
+
+def get_collection(
+    collection_name: str,
+    embedding_function,
+    create: bool = False,
+    persist_dir: str = None,
+):
+    """
+    Return a native Chroma collection (for chromadb methods like query/upsert/delete),
+    cached the same way as get_vectorstore. Its embedding function's vectors are
+    shortened to the collection's dimensions, if it has any.
+    With create=False, a missing collection raises the usual chromadb exception;
+    with create=True, it's created with get_new_collection_metadata.
+    """
+    persist_dir = os.path.abspath(persist_dir or cfg.VECTORDB_DIR)
+    key = (persist_dir, collection_name, id(embedding_function), "collection")
+
+    def open_collection():
+        client = get_client(persist_dir)
+        collection = _find_collection(client, collection_name)
+        if collection is None and create:
+            metadata = get_new_collection_metadata(collection_name)
+            collection = client.get_or_create_collection(
+                name=collection_name, embedding_function=None, metadata=metadata
+            )
+        dimensions = (
+            get_vector_settings(collection)["dimensions"] if collection else None
+        )
+        return client.get_collection(
+            name=collection_name,
+            embedding_function=(
+                ShortenedEmbeddingFunction(embedding_function, dimensions)
+                if dimensions and embedding_function is not None
+                else embedding_function
+            ),
+        )
+
+    return _get_or_open(key, open_collection, embedding_function)
+
+
+def invalidate(collection_name: str, persist_dir: str = None) -> None:
+    """Drop every cached handle of a collection that has been written to or deleted"""
+    persist_dir = os.path.abspath(persist_dir or cfg.VECTORDB_DIR)
+
+    with _lock:
+        for key in [
+            k for k in _open_collections if k[:2] == (persist_dir, collection_name)
+        ]:
+            del _open_collections[key]
@@ -1,20 +1,55 @@
+"""
+Chroma helpers for the app, and maintenance of the vector db. Run these while nothing
+is ingesting into or querying it:
+
+Delete sources from a collection in bulk:
+python3 rag/chromadb_utils.py '{"command": "delete", "collection_name": "leopard_news", "sources": ["https://...", "paper.pdf"]}'
+
+Delete the HNSW segment directories Chroma left behind for deleted collections, and the
+side indexes (lexical, int8, manifest) of collections that no longer exist:
+python3 rag/chromadb_utils.py '{"command": "gc"}'
+("dry_run": true lists what would be deleted)
+
+Rebuild the HNSW index of a collection, or of every collection where at least
+HNSW_REBUILD_DELETED_FRACTION of the index is deleted elements (then runs gc):
+python3 rag/chromadb_utils.py '{"command": "rebuild", "collection_name": "leopard_news"}'
+python3 rag/chromadb_utils.py '{"command": "rebuild"}'
+
+VACUUM chroma.sqlite3 and the side indexes' SQLite files:
+python3 rag/chromadb_utils.py '{"command": "vacuum"}'
+
+All of rebuild, gc and vacuum: '{"command": "maintain"}'. With no arguments, the tables,
+collections and segment directories are listed.
+"""
+
 import os
+import re
 import sys
-import chromadb
+import json
+import glob
+import shutil
+import struct
 import sqlite3
 
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
 import src.rag_query as rag
+import src.config as cfg
+import rag.chroma_registry as registry
+import rag.answer_cache as answer_cache
+import rag.lexical_index as lexical_index
+import rag.quantized_index as quantized_index
+import rag.ingest_manifest as ingest_manifest
+from src.query_service import get_query_service
 
 curr_dir = os.path.dirname(__file__)
-PERSIST_DIR = str(os.path.join(curr_dir, "..", "test_db"))
+PERSIST_DIR = str(cfg.VECTORDB_DIR)
 SQLITE_FILE = os.path.join(PERSIST_DIR, "chroma.sqlite3")
-chromadb_client = chromadb.PersistentClient(path=PERSIST_DIR)
 
 
 def get_collections():
-    collections = chromadb_client.list_collections()
+    collections = registry.get_client().list_collections()
 
     # Get just the names
     # collection_names = [collection.name for collection in collections]
@@ -23,20 +58,52 @@ def get_collections():
 
 
 def query_collection(selected_collection, user_input):
-    return rag.rag_langchain_without_history(
-        query=user_input, collection_names=[selected_collection]
+    return get_query_service().ask(
+        question=user_input, collection_names=[selected_collection]
     )
 
 
+def stream_collection_answer(selected_collection, user_input):
+    """Yields the answer token by token, for st.write_stream"""
+    return get_query_service().stream(
+        question=user_input, collection_names=[selected_collection]
+    )
+
+
+def ask_question(rag_inputs: dict) -> str:
+    """
+    rag_inputs: dict with the keys 'question', 'data_source' and 'collection_name_prefix'
+    (and optionally 'trace': true, to get (answer, per-stage timings) back)
+    """
+    return get_query_service().ask_with_inputs(rag_inputs)
+
+
+def stream_question_answer(rag_inputs: dict):
+    """Yields the answer token by token, for st.write_stream"""
+    return get_query_service().stream_with_inputs(rag_inputs)
+
+
 def delete_collection(collection_name):
-    chromadb_client.delete_collection(name=collection_name)
+    registry.get_client().delete_collection(name=collection_name)
+    registry.invalidate(collection_name)
+    answer_cache.bump_collection_version(collection_name)
+    lexical_index.drop_collection(collection_name)
+    quantized_index.drop_collection(collection_name)
+    ingest_manifest.drop_collection(collection_name)
+    get_query_service().forget(collection_name)
     print(f"Deleted collection: {collection_name}")
 
 
+def _connect_readonly(sqlite_file: str = None) -> sqlite3.Connection:
+    # read-only, so a missing file isn't created
+    sqlite_file = os.path.abspath(sqlite_file or SQLITE_FILE)
+    return sqlite3.connect(f"file:{sqlite_file}?mode=ro", uri=True)
+
+
 def fetch_table_column_names():
     """for admin and debugging purpose only"""
 
-    conn = sqlite3.connect(SQLITE_FILE)
+    conn = _connect_readonly()
     cursor = conn.cursor()
 
     # See what tables exist
@@ -63,6 +130,341 @@ def fetch_table_column_names():
 
     conn.close()
 
+    # HNSW segment directories, and the ones no collection uses anymore
+    for collection_name, segment_id in fetch_vector_segments().items():
+        segment_dir = os.path.join(PERSIST_DIR, segment_id)
+        print(f"{collection_name}: {segment_id} ({get_size(segment_dir)} bytes)")
+    for segment_dir in find_orphaned_segment_dirs():
+        print(f"Orphaned: {segment_dir} ({get_size(segment_dir)} bytes)")
+
+
+"""### Maintenance"""
+
+UUID_PATTERN = re.compile(r"^[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}$")
+# suffixes of the collection an HNSW index is rebuilt into, and of the old collection
+# while the rebuilt one takes its name
+REBUILD_SUFFIX = "__rebuild"
+RETIRED_SUFFIX = "__old"
+
+
+def get_size(path: str) -> int:
+    """Bytes of a file, or of all the files in a directory"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path)
+        for f in files
+    )
+
+
+def get_sqlite_size(path: str) -> int:
+    return sum(
+        get_size(path + suffix)
+        for suffix in ["", "-wal"]
+        if os.path.exists(path + suffix)
+    )
+
+
+def fetch_vector_segments() -> dict:
+    """Collection name -> id of its HNSW segment, which is its directory's name"""
+    if not os.path.exists(SQLITE_FILE):
+        return {}
+
+    conn = _connect_readonly()
+    try:
+        rows = conn.execute(
+            """SELECT collections.name, segments.id FROM segments
+            JOIN collections ON segments.collection = collections.id
+            WHERE segments.scope = 'VECTOR'"""
+        ).fetchall()
+    finally:
+        conn.close()
+    return dict(rows)
+
+
+def find_orphaned_segment_dirs() -> list[str]:
+    """
+    The segment directories of PERSIST_DIR that chroma.sqlite3 doesn't reference:
+    delete_collection leaves a collection's HNSW files behind
+    """
+    if not os.path.exists(SQLITE_FILE):
+        return []
+
+    conn = _connect_readonly()
+    try:
+        segment_ids = {row[0] for row in conn.execute("SELECT id FROM segments")}
+    finally:
+        conn.close()
+
+    return sorted(
+        os.path.join(PERSIST_DIR, name)
+        for name in os.listdir(PERSIST_DIR)
+        if UUID_PATTERN.match(name)
+        and name not in segment_ids
+        and os.path.isdir(os.path.join(PERSIST_DIR, name))
+    )
+
+
+def collect_garbage(dry_run: bool = False) -> int:
+    """
+    Delete the orphaned segment directories, and the lexical, int8 and manifest files
+    of collections that no longer exist. Returns the bytes reclaimed.
+    """
+    reclaimed = 0
+    for segment_dir in find_orphaned_segment_dirs():
+        size = get_size(segment_dir)
+        print(f"Orphaned segment directory: {segment_dir} ({size} bytes)")
+        if not dry_run:
+            shutil.rmtree(segment_dir)
+        reclaimed += size
+
+    # what list_collections returns differs between Chroma versions
+    collection_names = set(fetch_vector_segments())
+    side_indexes = {
+        lexical_index.get_index_path: lexical_index.drop_collection,
+        quantized_index.get_index_path: quantized_index.drop_collection,
+        ingest_manifest.get_manifest_path: ingest_manifest.drop_collection,
+    }
+    for get_path, drop_collection in side_indexes.items():
+        index_dir = os.path.dirname(get_path("_"))
+        for path in sorted(glob.glob(os.path.join(index_dir, "*.sqlite3"))):
+            collection_name = os.path.basename(path)[: -len(".sqlite3")]
+            if collection_name in collection_names:
+                continue
+            size = get_sqlite_size(path)
+            print(f"Index of a deleted collection: {path} ({size} bytes)")
+            if not dry_run:
+                drop_collection(collection_name)
+            reclaimed += size
+
+    action = "Would reclaim" if dry_run else "Reclaimed"
+    prnt.prLightPurple(f"{action} {reclaimed} bytes")
+    return reclaimed
+
+
+# the version of chroma-hnswlib's header.bin format read by read_hnsw_element_count
+HNSW_HEADER_VERSION = 1
+HNSW_MAX_ELEMENTS = 1 << 40
+
+
+def read_hnsw_element_count(header_file: str) -> int:
+    """
+    The elements in an HNSW index, deleted ones included, from its header.bin: a
+    4-byte format version, then hnswlib's offsetLevel0, max_elements and
+    cur_element_count (size_t each). This is chroma-hnswlib's private layout, so None
+    if the file doesn't look like it.
+    """
+    with open(header_file, "rb") as f:
+        header = f.read(28)
+    if len(header) < 28:
+        return None
+
+    version, _, max_elements, num_elements = struct.unpack("<iQQQ", header)
+    if (
+        version != HNSW_HEADER_VERSION
+        or max_elements > HNSW_MAX_ELEMENTS
+        or num_elements > max_elements
+    ):
+        return None
+    return num_elements
+
+
+def get_hnsw_stats(collection_name: str) -> dict:
+    """
+    Elements in the collection's HNSW index and how many of them are deleted. Chroma's
+    HNSW index only marks deleted elements, which keep taking memory, disk and search
+    time until the index is rebuilt.
+    """
+    segment_id = fetch_vector_segments().get(collection_name)
+    header_file = os.path.join(PERSIST_DIR, segment_id or "", "header.bin")
+    if segment_id is None or not os.path.exists(header_file):
+        # nothing written to the index yet
+        return {"elements": 0, "live": 0, "deleted_fraction": 0.0}
+
+    collection = registry.get_client().get_collection(
+        name=collection_name, embedding_function=None
+    )
+    num_chunks = collection.count()
+    num_elements = read_hnsw_element_count(header_file)
+    if num_elements is None:
+        prnt.prRed(
+            f"Unknown HNSW header format in {header_file}, counting no deleted elements"
+        )
+        num_elements = num_chunks
+    # chunks not flushed to the index yet aren't among its elements: live can't be more
+    live = min(num_elements, num_chunks)
+    return {
+        "elements": num_elements,
+        "live": live,
+        "deleted_fraction": 1 - live / num_elements if num_elements else 0.0,
+        "bytes": get_size(os.path.dirname(header_file)),
+    }
+
+
+def _swap_rebuilt(client, collection_name: str) -> None:
+    """
+    Give a rebuilt collection (<name>__rebuild) the name of the one it replaces: the old
+    one is renamed <name>__old first and deleted last, so there's always a copy
+    """
+    names = fetch_vector_segments()
+    retired_name = collection_name + RETIRED_SUFFIX
+    if collection_name in names:
+        client.get_collection(name=collection_name, embedding_function=None).modify(
+            name=retired_name
+        )
+    client.get_collection(
+        name=collection_name + REBUILD_SUFFIX, embedding_function=None
+    ).modify(name=collection_name)
+    if collection_name in names or retired_name in names:
+        client.delete_collection(name=retired_name)
+
+
+def finish_interrupted_rebuild(collection_name: str) -> bool:
+    """
+    Finish the swap of a rebuild that was interrupted after the old collection was
+    renamed (<name> is missing, <name>__rebuild or <name>__old is there); returns
+    whether there was one
+    """
+    names = fetch_vector_segments()
+    rebuild_name = collection_name + REBUILD_SUFFIX
+    retired_name = collection_name + RETIRED_SUFFIX
+    client = registry.get_client()
+    if collection_name in names:
+        if retired_name in names and rebuild_name not in names:
+            # interrupted after the rebuilt collection took the name
+            client.delete_collection(name=retired_name)
+        return False
+
+    if rebuild_name in names:
+        _swap_rebuilt(client, collection_name)
+    elif retired_name in names:
+        # the copy is gone: put the old collection back
+        client.get_collection(name=retired_name, embedding_function=None).modify(
+            name=collection_name
+        )
+    else:
+        return False
+    registry.invalidate(collection_name)
+    answer_cache.bump_collection_version(collection_name)
+    get_query_service().forget(collection_name)
+    prnt.prLightPurple(f"Finished the interrupted rebuild of {collection_name}")
+    return True
+
+
+def rebuild_collection(collection_name: str, page_size: int = 1000) -> None:
+    """
+    Rebuild a collection's HNSW index with only its live chunks: the chunks and their
+    stored embeddings (nothing is embedded again) are copied into <name>__rebuild, with
+    the same metadata (and placeholder vectors, if its vectors are kept in its int8
+    index). Then the old collection is renamed <name>__old, the copy is renamed <name>
+    and the old one is deleted. If the copy is interrupted, the next rebuild starts
+    over; if the swap is, it's finished (finish_interrupted_rebuild).
+    """
+    if finish_interrupted_rebuild(collection_name):
+        return
+
+    client = registry.get_client()
+    rebuild_name = collection_name + REBUILD_SUFFIX
+    if rebuild_name in fetch_vector_segments():
+        client.delete_collection(name=rebuild_name)
+
+    collection = client.get_collection(name=collection_name, embedding_function=None)
+    rebuilt = client.create_collection(
+        name=rebuild_name, metadata=collection.metadata, embedding_function=None
+    )
+
+    settings = registry.get_vector_settings(collection)
+    placeholders = settings["store"] == "quantized_index"
+    include = ["documents", "metadatas"]
+    if not placeholders:
+        include.append("embeddings")
+
+    num_copied = 0
+    while True:
+        page = collection.get(limit=page_size, offset=num_copied, include=include)
+        if not len(page["ids"]):
+            break
+        rebuilt.add(
+            ids=page["ids"],
+            documents=page["documents"],
+            metadatas=page["metadatas"],
+            embeddings=(
+                [quantized_index.PLACEHOLDER_EMBEDDING] * len(page["ids"])
+                if placeholders
+                else page["embeddings"]
+            ),
+        )
+        num_copied += len(page["ids"])
+
+    # chunk ids don't change, so the lexical, int8 and manifest files stay valid
+    _swap_rebuilt(client, collection_name)
+    registry.invalidate(collection_name)
+    answer_cache.bump_collection_version(collection_name)
+    get_query_service().forget(collection_name)
+    prnt.prLightPurple(f"Rebuilt {collection_name} with {num_copied} chunks")
+
+
+def rebuild_fragmented_collections(min_deleted_fraction: float = None) -> list:
+    """
+    Finish the interrupted rebuilds, then rebuild the collections whose HNSW index is
+    at least this fraction deleted
+    """
+    if min_deleted_fraction is None:
+        min_deleted_fraction = cfg.HNSW_REBUILD_DELETED_FRACTION
+
+    names = fetch_vector_segments()
+    for name in sorted(names):
+        for suffix in [REBUILD_SUFFIX, RETIRED_SUFFIX]:
+            if name.endswith(suffix):
+                finish_interrupted_rebuild(name[: -len(suffix)])
+
+    rebuilt = []
+    for collection_name in sorted(fetch_vector_segments()):
+        if collection_name.endswith((REBUILD_SUFFIX, RETIRED_SUFFIX)):
+            continue
+        stats = get_hnsw_stats(collection_name)
+        print(
+            f"{collection_name}: {stats['live']} live of {stats['elements']} elements "
+            f"({stats['deleted_fraction']:.0%} deleted)"
+        )
+        if stats["elements"] and stats["deleted_fraction"] >= min_deleted_fraction:
+            rebuild_collection(collection_name)
+            rebuilt.append(collection_name)
+
+    return rebuilt
+
+
+def vacuum() -> int:
+    """VACUUM chroma.sqlite3 and the side indexes' SQLite files; returns bytes freed"""
+    paths = [SQLITE_FILE] + [
+        path
+        for index_dir in [
+            cfg.LEXICAL_INDEX_DIR,
+            cfg.QUANTIZED_INDEX_DIR,
+            cfg.INGEST_MANIFEST_DIR,
+        ]
+        for path in sorted(glob.glob(os.path.join(index_dir, "*.sqlite3")))
+    ]
+
+    reclaimed = 0
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        size_before = get_sqlite_size(path)
+        conn = sqlite3.connect(path, timeout=60)
+        try:
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+        size_after = get_sqlite_size(path)
+        print(f"{path}: {size_before} -> {size_after} bytes")
+        reclaimed += size_before - size_after
+
+    prnt.prLightPurple(f"Reclaimed {reclaimed} bytes")
+    return reclaimed
+
 
 def get_example_questions(collection_name):
     return {
@@ -101,4 +503,25 @@ def get_example_questions(collection_name):
 
 
 if __name__ == "__main__":
-    fetch_table_column_names()
+    inputs = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    command = inputs.get("command")
+
+    if command == "delete":
+        import rag.maintain_vectordb as maintain_vectordb
+
+        maintain_vectordb.delete_docs(inputs["sources"], inputs["collection_name"])
+    elif command in ["gc", "rebuild", "vacuum", "maintain"]:
+        if command == "rebuild" and inputs.get("collection_name"):
+            rebuild_collection(inputs["collection_name"])
+        elif command in ["rebuild", "maintain"]:
+            prnt.prPurple("\nRebuilding fragmented HNSW indexes")
+            rebuild_fragmented_collections(inputs.get("min_deleted_fraction"))
+        # a rebuild leaves the old index's segment directory behind
+        if command in ["gc", "rebuild", "maintain"]:
+            prnt.prPurple("\nCollecting garbage")
+            collect_garbage(dry_run=inputs.get("dry_run", False))
+        if command in ["vacuum", "maintain"]:
+            prnt.prPurple("\nVacuuming")
+            vacuum()
+    else:
+        fetch_table_column_names()
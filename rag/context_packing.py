@@ -0,0 +1,170 @@
+import re
+import sys
+import os
+
+import tiktoken
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+import src.config as cfg
+
+# create_chunks overlaps neighbouring chunks by 200 characters (content-defined chunks
+# don't overlap)
+MAX_OVERLAP_CHARS = 400
+MIN_OVERLAP_CHARS = 20
+# rough average for English text, used when the tokenizer is unavailable
+CHARS_PER_TOKEN = 4
+
+_encodings = {}
+
+
+def get_encoding(model: str = None):
+    """The tokenizer of the model, or None if it can't be loaded"""
+    model = model or cfg.LLM_MODEL
+    if model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # tiktoken downloads its vocabulary files on first use, which fails offline
+            prnt.prRed(f"Could not load the tokenizer of {model}, estimating tokens: {e}")
+            _encodings[model] = None
+
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str = None) -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN
+
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def get_chunk_index(doc: Document):
+    """
+    The chunk's position in its source: metadata['chunk_index'], or for older chunks
+    i in their id '<source>_page-<n>_chunk-<i>'
+    """
+    if doc.metadata.get("chunk_index") is not None:
+        return int(doc.metadata["chunk_index"])
+
+    match = re.search(r"_chunk-(\d+)$", str(doc.metadata.get("id", "")))
+    return int(match.group(1)) if match else None
+
+
+def get_id_stem(doc: Document) -> str:
+    """
+    The chunk's id without its page and chunk parts ('<source>' of
+    '<source>_page-<n>_chunk-<i>'): the source whose text it is. A duplicate handed
+    over to another source keeps it, along with its chunk_index in that text.
+    """
+    chunk_id = str(doc.metadata.get("id", ""))
+    return re.sub(r"(_(page|window)-\d+)?_chunk-h?[0-9a-f]+(-\d+)?$", "", chunk_id)
+
+
+def strip_overlap(first: str, second: str) -> str:
+    """Drop the start of `second` that repeats the end of `first`"""
+    max_overlap = min(len(first), len(second), MAX_OVERLAP_CHARS)
+    for size in range(max_overlap, MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return second[size:]
+
+    return second
+
+
+def merge_adjacent_chunks(docs: list[Document]) -> list[tuple[int, Document]]:
+    """
+    Merge chunks that are neighbours in the same source into one document, with the
+    overlapping text removed, and drop exact duplicates. Neighbours have consecutive
+    chunk indexes and the same id stem, so the chunks a source got from its duplicates
+    are only merged with chunks of the same text.
+    Returns (rank, document) pairs, where rank is the best retrieval rank of the merged chunks.
+    """
+    groups = {}  # (source, id stem) -> [(chunk index, rank, doc)]
+    unmergeable = []
+    seen_texts = set()
+
+    for rank, doc in enumerate(docs):
+        if doc.page_content in seen_texts:
+            continue
+        seen_texts.add(doc.page_content)
+
+        chunk_index = get_chunk_index(doc)
+        if chunk_index is None:
+            unmergeable.append((rank, doc))
+            continue
+        key = (doc.metadata.get("source"), get_id_stem(doc))
+        groups.setdefault(key, []).append((chunk_index, rank, doc))
+
+    merged = list(unmergeable)
+    for source_chunks in groups.values():
+        source_chunks.sort(key=lambda c: c[0])
+
+        run = [source_chunks[0]]
+        for chunk in source_chunks[1:]:
+            if chunk[0] == run[-1][0] + 1:
+                run.append(chunk)
+            else:
+                merged.append(_merge_run(run))
+                run = [chunk]
+        merged.append(_merge_run(run))
+
+    merged.sort(key=lambda m: m[0])
+    return merged
+
+
+def _merge_run(run: list) -> tuple[int, Document]:
+    if len(run) == 1:
+        return run[0][1], run[0][2]
+
+    text = run[0][2].page_content
+    for _, _, doc in run[1:]:
+        rest = strip_overlap(text, doc.page_content)
+        text += rest if rest != doc.page_content else "\n" + rest
+
+    first_doc = run[0][2]
+    return min(rank for _, rank, _ in run), Document(
+        page_content=text,
+        metadata={**first_doc.metadata, "merged_chunks": len(run)},
+        id=first_doc.id,
+    )
+
+
+def pack_context(
+    docs: list[Document], token_budget: int = None, model: str = None
+) -> tuple[list[Document], dict]:
+    """
+    Merge adjacent chunks, strip their overlaps, and keep documents in retrieval order
+    until the token budget is used up (documents that don't fit are skipped, so a
+    smaller one further down can still make it in).
+    Returns the packed documents and token counts before/after.
+    """
+    token_budget = token_budget or cfg.CONTEXT_TOKEN_BUDGET
+
+    tokens_before = sum(count_tokens(d.page_content, model) for d in docs)
+
+    packed, tokens_used = [], 0
+    for _, doc in merge_adjacent_chunks(docs):
+        num_tokens = count_tokens(doc.page_content, model)
+        if tokens_used + num_tokens > token_budget:
+            continue
+        packed.append(doc)
+        tokens_used += num_tokens
+
+    stats = {
+        "docs_before": len(docs),
+        "docs_after": len(packed),
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_used,
+        "tokens_saved": tokens_before - tokens_used,
+    }
+    prnt.prLightPurple(
+        f"Context: {stats['docs_before']} chunks, {tokens_before} tokens -> "
+        f"{stats['docs_after']} docs, {tokens_used} tokens ({stats['tokens_saved']} saved)"
+    )
+
+    return packed, stats
@@ -0,0 +1,446 @@
+"""
+Embedding caches: query embeddings (QueryEmbeddingCache), and chunk embeddings shared
+by all collections and re-ingests (ChunkEmbeddingCache).
+
+Compact the chunk embedding cache (evict down to its size limit and give the space
+back to the OS) with:
+python3 rag/embedding_cache.py '{"max_mb": 1024}'
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+from chromadb.api.types import Documents, EmbeddingFunction
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+import src.config as cfg
+
+QUERY_CACHE_FILE = "query_embeddings.sqlite3"
+CHUNK_CACHE_FILE = "chunk_embeddings.sqlite3"
+# max parameters per SQLite statement stay well under its limit
+SQL_BATCH_SIZE = 500
+# a full chunk cache is evicted down to this fraction of its limit, so the ingest
+# batches that follow don't each evict again
+EVICT_TO_FRACTION = 0.9
+
+
+def normalize_query(text: str) -> str:
+    """Queries that differ only in case or whitespace share a cache entry"""
+    return " ".join(text.split()).lower()
+
+
+def content_hash(text: str) -> str:
+    """Hash of a chunk's normalized text, so chunks that differ only in case or whitespace match"""
+    return hashlib.sha256(normalize_query(text).encode("utf-8")).hexdigest()
+
+
+def vector_to_blob(vector) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def blob_to_vector(blob: bytes) -> list[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class QueryEmbeddingCache:
+    """
+    Two-tier cache of query embeddings: an in-memory LRU in front of a SQLite file.
+    Entries are keyed by embedding model and normalized query text. Both tiers are
+    size-bounded; the disk tier evicts the least recently used rows.
+    """
+
+    def __init__(
+        self,
+        db_path: str = None,
+        max_memory_entries: int = 2048,
+        max_disk_entries: int = 200_000,
+    ) -> None:
+        self.db_path = db_path or os.path.join(cfg.CACHE_DIR, QUERY_CACHE_FILE)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._puts_since_eviction = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS query_embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings (last_used)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(
+            f"{model}\0{normalize_query(text)}".encode("utf-8")
+        ).hexdigest()
+
+    def get(self, model: str, text: str):
+        key = self.make_key(model, text)
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT embedding FROM query_embeddings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE query_embeddings SET last_used = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            self._conn.commit()
+            self.disk_hits += 1
+            embedding = blob_to_vector(row[0])
+            self._remember(key, embedding)
+
+        return embedding
+
+    def put(self, model: str, text: str, embedding) -> None:
+        key = self.make_key(model, text)
+        embedding = list(embedding)
+
+        with self._lock:
+            self._remember(key, embedding)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, model, embedding, last_used) VALUES (?, ?, ?, ?)",
+                (key, model, vector_to_blob(embedding), time.time()),
+            )
+            self._conn.commit()
+
+            # counting rows on every put would be wasteful, check every so often
+            self._puts_since_eviction += 1
+            if self._puts_since_eviction >= 100:
+                self._puts_since_eviction = 0
+                self._evict_from_disk()
+
+    def _remember(self, key: str, embedding: list) -> None:
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_from_disk(self) -> None:
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()
+        excess = count - self.max_disk_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM query_embeddings WHERE key IN (SELECT key FROM query_embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+
+_query_embedding_cache = None
+_query_embedding_cache_lock = threading.Lock()
+
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    """Return the process-wide query embedding cache, creating it on first use"""
+    global _query_embedding_cache
+
+    with _query_embedding_cache_lock:
+        if _query_embedding_cache is None:
+            _query_embedding_cache = QueryEmbeddingCache()
+
+    return _query_embedding_cache
+
+
+class ChunkEmbeddingCache:
+    """
+    Embeddings of chunks keyed by (embedding model, dimensions, content_hash(chunk text)),
+    in a SQLite file shared by all collections. Deleting and rebuilding a collection, or
+    embedding the same documents into another collection, reuses the stored vectors.
+    The file is kept under max_mb by evicting the least recently used embeddings.
+    """
+
+    def __init__(self, db_path: str = None, max_mb: float = None) -> None:
+        self.db_path = db_path or os.path.join(cfg.CACHE_DIR, CHUNK_CACHE_FILE)
+        self.max_bytes = (max_mb or cfg.CHUNK_EMBEDDING_CACHE_MAX_MB) * 1024 * 1024
+        self._lock = threading.Lock()
+        self._size = None  # bytes of the stored embeddings, summed on first put
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS chunk_embeddings (
+                model TEXT NOT NULL,
+                dimensions INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, dimensions, content_hash)
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chunk_embeddings_last_used ON chunk_embeddings (last_used)"
+        )
+        self._conn.commit()
+
+    def get_many(self, model: str, dimensions: int, hashes: list) -> dict:
+        """content hash -> embedding, for the hashes that are in the cache"""
+        found = {}
+        with self._lock:
+            unique_hashes = list(set(hashes))
+            for i in range(0, len(unique_hashes), SQL_BATCH_SIZE):
+                batch = unique_hashes[i : i + SQL_BATCH_SIZE]
+                rows = self._conn.execute(
+                    "SELECT content_hash, embedding FROM chunk_embeddings "
+                    f"WHERE model = ? AND dimensions = ? AND content_hash IN ({','.join('?' * len(batch))})",
+                    [model, dimensions or 0, *batch],
+                ).fetchall()
+                found.update((h, blob_to_vector(blob)) for h, blob in rows)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE chunk_embeddings SET last_used = ? "
+                    "WHERE model = ? AND dimensions = ? AND content_hash = ?",
+                    [(now, model, dimensions or 0, h) for h in found],
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(unique_hashes) - len(found)
+
+        return found
+
+    def put_many(self, model: str, dimensions: int, hashes: list, embeddings) -> None:
+        now = time.time()
+        # one row per hash, the last embedding wins like it would in the table
+        blobs = {h: vector_to_blob(e) for h, e in zip(hashes, embeddings)}
+        rows = [(model, dimensions or 0, h, blob, now) for h, blob in blobs.items()]
+        with self._lock:
+            if self._size is None:
+                self._size = self.size_bytes()
+            # the rows that get replaced no longer count
+            replaced = 0
+            unique_hashes = list(blobs)
+            for i in range(0, len(unique_hashes), SQL_BATCH_SIZE):
+                batch = unique_hashes[i : i + SQL_BATCH_SIZE]
+                (size,) = self._conn.execute(
+                    "SELECT COALESCE(SUM(LENGTH(embedding)), 0) FROM chunk_embeddings "
+                    f"WHERE model = ? AND dimensions = ? AND content_hash IN ({','.join('?' * len(batch))})",
+                    [model, dimensions or 0, *batch],
+                ).fetchone()
+                replaced += size
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunk_embeddings "
+                "(model, dimensions, content_hash, embedding, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._size += sum(len(row[3]) for row in rows) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def size_bytes(self) -> int:
+        """Size of the stored embeddings (the file is bigger until it's compacted)"""
+        (size,) = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(embedding)), 0) FROM chunk_embeddings"
+        ).fetchone()
+        return size
+
+    def _evict(self) -> int:
+        """
+        If the embeddings don't fit in max_bytes, delete the least recently used ones
+        until they take EVICT_TO_FRACTION of it. Only the evicted rows are read, the
+        size is kept up to date in _size.
+        """
+        if self._size is None:
+            self._size = self.size_bytes()
+        if self._size <= self.max_bytes:
+            return 0
+
+        excess = self._size - int(self.max_bytes * EVICT_TO_FRACTION)
+        rowids, freed = [], 0
+        # walks the last_used index, and stops once enough is freed
+        for rowid, length in self._conn.execute(
+            "SELECT rowid, LENGTH(embedding) FROM chunk_embeddings ORDER BY last_used"
+        ):
+            if freed >= excess:
+                break
+            rowids.append(rowid)
+            freed += length
+
+        for i in range(0, len(rowids), SQL_BATCH_SIZE):
+            batch = rowids[i : i + SQL_BATCH_SIZE]
+            self._conn.execute(
+                "DELETE FROM chunk_embeddings "
+                f"WHERE rowid IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+        self._conn.commit()
+        self._size -= freed
+        return len(rowids)
+
+    def _file_size(self) -> int:
+        wal_path = f"{self.db_path}-wal"
+        wal_size = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+        return os.path.getsize(self.db_path) + wal_size
+
+    def compact(self) -> dict:
+        """Evict if over max_bytes and shrink the file (slow for big files, run offline)"""
+        with self._lock:
+            file_size = self._file_size()
+            self._size = self.size_bytes()
+            evicted = self._evict()
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.execute("VACUUM")
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM chunk_embeddings").fetchone()
+
+        return {
+            "evicted": evicted,
+            "embeddings": count,
+            "file_mb_before": file_size / 1024 / 1024,
+            "file_mb_after": self._file_size() / 1024 / 1024,
+        }
+
+
+_chunk_embedding_cache = None
+_chunk_embedding_cache_lock = threading.Lock()
+
+
+def get_chunk_embedding_cache() -> ChunkEmbeddingCache:
+    """Return the process-wide chunk embedding cache, creating it on first use"""
+    global _chunk_embedding_cache
+
+    with _chunk_embedding_cache_lock:
+        if _chunk_embedding_cache is None:
+            _chunk_embedding_cache = ChunkEmbeddingCache()
+
+    return _chunk_embedding_cache
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    LangChain embeddings wrapper that serves embed_query from the query embedding cache.
+    embed_documents is passed through unchanged.
+    Pass `factory` instead of `embeddings` to create the wrapped embeddings on first use.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings = None,
+        model_name: str = None,
+        cache: QueryEmbeddingCache = None,
+        factory=None,
+    ) -> None:
+        self._embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+        self.factory = factory
+
+    @property
+    def embeddings(self) -> Embeddings:
+        if self._embeddings is None:
+            self._embeddings = self.factory()
+        return self._embeddings
+
+    def _get_cache(self) -> QueryEmbeddingCache:
+        return self.cache or get_query_embedding_cache()
+
+    def embed_query(self, text: str) -> list[float]:
+        cache = self._get_cache()
+        embedding = cache.get(self.model_name, text)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(text)
+            cache.put(self.model_name, text, embedding)
+
+        return embedding
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+
+class CachedQueryEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    Chroma embedding function wrapper for query texts (e.g. collection.query(query_texts=...)).
+    Only the texts that miss the cache are sent to the wrapped function, in one call.
+    Pass `factory` instead of `embedding_function` to create the wrapped function on first use.
+    """
+
+    def __init__(
+        self,
+        embedding_function=None,
+        model_name: str = None,
+        cache: QueryEmbeddingCache = None,
+        factory=None,
+    ) -> None:
+        self._embedding_function = embedding_function
+        self.model_name = model_name
+        self.cache = cache
+        self.factory = factory
+
+    @property
+    def embedding_function(self):
+        if self._embedding_function is None:
+            self._embedding_function = self.factory()
+        return self._embedding_function
+
+    def __call__(self, input: Documents):
+        cache = self.cache or get_query_embedding_cache()
+
+        embeddings = [cache.get(self.model_name, text) for text in input]
+        missing = [i for i, e in enumerate(embeddings) if e is None]
+        if missing:
+            new_embeddings = self.embedding_function([input[i] for i in missing])
+            for i, embedding in zip(missing, new_embeddings):
+                embedding = list(embedding)
+                cache.put(self.model_name, input[i], embedding)
+                embeddings[i] = embedding
+
+        return embeddings
+
+
+if __name__ == "__main__":
+    inputs = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    cache = ChunkEmbeddingCache(inputs.get("db_path"), inputs.get("max_mb"))
+    prnt.prPurple(f"Compacting {cache.db_path}")
+    results = cache.compact()
+    prnt.prLightPurple(
+        f"Evicted {results['evicted']} embeddings, {results['embeddings']} left, "
+        f"{results['file_mb_before']:.1f} MB -> {results['file_mb_after']:.1f} MB"
+    )
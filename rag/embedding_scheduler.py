@@ -0,0 +1,749 @@
+"""
+Batches the chunks of many sources into embedding requests, sends several of them at
+once within the provider's rate limits, and upserts the results into a collection.
+
+A news CSV with hundreds of short articles becomes a handful of large requests instead
+of one request per article, and a huge PDF is split into batches that fit both the
+provider's limits and Chroma's max batch size.
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+import src.config as cfg
+import rag.chroma_registry as registry
+import rag.answer_cache as answer_cache
+import rag.lexical_index as lexical_index
+import rag.quantized_index as quantized_index
+import rag.ingest_manifest as ingest_manifest
+from rag.context_packing import count_tokens
+from rag.embedding_cache import content_hash, get_chunk_embedding_cache
+
+MAX_ATTEMPTS = 4
+# max hashes per `$in` lookup, SQLite limits the number of query parameters
+HASH_LOOKUP_SIZE = 500
+# succeeded sources are written to the ingest manifest in groups of this many
+MANIFEST_WRITE_SIZE = 100
+
+
+class TokenRateLimiter:
+    """Blocks until sending `tokens` more keeps the last minute under tokens_per_minute"""
+
+    def __init__(self, tokens_per_minute: int = None) -> None:
+        self.tokens_per_minute = tokens_per_minute
+        self._sent = deque()  # (time, tokens)
+        self._sent_tokens = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        if not self.tokens_per_minute:
+            return
+
+        # a batch bigger than the whole budget could never fit, let it through alone
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                now = time.time()
+                while self._sent and now - self._sent[0][0] >= 60:
+                    self._sent_tokens -= self._sent.popleft()[1]
+
+                if self._sent_tokens + tokens <= self.tokens_per_minute:
+                    self._sent.append((now, tokens))
+                    self._sent_tokens += tokens
+                    return
+
+                wait = 60 - (now - self._sent[0][0])
+            time.sleep(min(max(wait, 0.05), 5))
+
+
+def release_chunks(collection, collection_name: str, released: dict) -> tuple:
+    """
+    released: chunk id -> the sources that no longer have the chunk (they were deleted,
+    or replaced by a version without it). A chunk owned by one of them goes to the
+    first of its remaining duplicate_sources, or is deleted if none remain; the sources
+    are removed from the duplicate_sources of the other chunks. The lexical and int8
+    indexes follow. Returns (chunks deleted, chunks handed over).
+    """
+    ids = sorted(released)
+    num_deleted, num_handed_over = 0, 0
+    for i in range(0, len(ids), HASH_LOOKUP_SIZE):
+        results = collection.get(
+            ids=ids[i : i + HASH_LOOKUP_SIZE], include=["metadatas"]
+        )
+        deleted_ids, updated = [], {}  # chunk id -> its new metadata
+        for chunk_id, metadata in zip(results["ids"], results["metadatas"]):
+            sources = released[chunk_id]
+            duplicate_sources = metadata.get("duplicate_sources") or ""
+            duplicate_sources = set(filter(None, duplicate_sources.split("\n")))
+            remaining = sorted(duplicate_sources - sources)
+            owner = metadata.get("source")
+            if owner in sources:
+                if not remaining:
+                    deleted_ids.append(chunk_id)
+                    continue
+                owner, remaining = remaining[0], remaining[1:]
+                num_handed_over += 1
+            elif len(remaining) == len(duplicate_sources):
+                continue
+            updated[chunk_id] = {
+                **metadata,
+                "source": owner,
+                "duplicate_sources": "\n".join(remaining),
+            }
+
+        if updated:
+            collection.update(ids=list(updated), metadatas=list(updated.values()))
+            # the side indexes store the chunks' source too
+            chunks = collection.get(ids=list(updated), include=["documents"])
+            metadatas = [updated[chunk_id] for chunk_id in chunks["ids"]]
+            lexical_index.upsert_chunks(
+                collection_name, chunks["ids"], chunks["documents"], metadatas
+            )
+            quantized_index.update_sources(collection_name, chunks["ids"], metadatas)
+        if deleted_ids:
+            collection.delete(ids=deleted_ids)
+            lexical_index.delete_ids(collection_name, deleted_ids)
+            quantized_index.delete_ids(collection_name, deleted_ids)
+            num_deleted += len(deleted_ids)
+
+    return num_deleted, num_handed_over
+
+
+def metadata_changed(stored: dict, metadata: dict) -> bool:
+    """Whether a chunk's metadata differs from the stored one (stored without Nones)"""
+    stored = {k: v for k, v in stored.items() if k != "duplicate_sources"}
+    return stored != {k: v for k, v in metadata.items() if v is not None}
+
+
+class EmbeddingScheduler:
+    """
+    scheduler = EmbeddingScheduler("my_collection")
+    scheduler.add("report.pdf", chunks)   # any number of sources
+    results = scheduler.close()           # {"succeeded": [...], "failed": [...], ...}
+
+    A source counts as succeeded once all its chunks are stored, and is then recorded
+    in the collection's ingest manifest (unless record_in_manifest is False) with its
+    chunk ids and the source_info passed to add(). Chunk ids come from
+    chunk.metadata["id"], so re-adding a source overwrites its chunks; with
+    add(..., replace=True), its chunks that are gone from the new version are deleted.
+
+    Every chunk gets a 'content_hash' (of its normalized text) in its metadata. A chunk
+    whose hash is already in the collection, or earlier in this run, isn't embedded
+    again (see cfg.DUPLICATE_CHUNKS), and a chunk that is stored with the same id and
+    text only gets its metadata updated, if that changed. Embeddings already in the
+    chunk embedding cache (rag/embedding_cache.py) are reused instead of being
+    requested from the provider. The ids of the stored chunks a source's duplicates
+    point to go into its manifest entry ('duplicate_of'), so deleting or replacing the
+    source can take it out of their duplicate_sources (see release_chunks).
+    """
+
+    def __init__(
+        self,
+        collection_name: str,
+        embedding_function=None,
+        max_batch_tokens: int = None,
+        max_batch_size: int = None,
+        max_concurrency: int = None,
+        cache=None,
+        record_in_manifest: bool = True,
+    ) -> None:
+        self.collection_name = collection_name
+        self.embedding_function = (
+            embedding_function or cfg.get_chroma_embedding_function()
+        )
+        # None when the model's native size is used
+        self.dimensions = getattr(self.embedding_function, "dimensions", None)
+        self.cache = cache or get_chunk_embedding_cache()
+        self.record_in_manifest = record_in_manifest
+        self._collection = None
+        self.vector_settings = None  # the collection's, once it's opened
+
+        provider = cfg.PROVIDERS[cfg.EMBEDDINGS_PROVIDER]
+        self.max_batch_tokens = min(
+            max_batch_tokens or cfg.EMBEDDING_BATCH_TOKENS,
+            provider.get("embedding_max_tokens_per_request", float("inf")),
+        )
+        chroma_max_batch_size = getattr(
+            registry.get_client(), "get_max_batch_size", lambda: 5461
+        )()
+        self.max_batch_size = min(
+            max_batch_size or chroma_max_batch_size,
+            chroma_max_batch_size,
+            provider.get("embedding_max_inputs_per_request", float("inf")),
+        )
+        self.rate_limiter = TokenRateLimiter(provider.get("embedding_tokens_per_minute"))
+
+        max_concurrency = max_concurrency or cfg.EMBEDDING_MAX_CONCURRENCY
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="embedding"
+        )
+        # add() blocks while this many batches are waiting or being embedded, so a big
+        # ingest doesn't pile up chunks in memory faster than they're embedded
+        self._batch_slots = threading.BoundedSemaphore(2 * max_concurrency)
+        self._futures = []
+        self._lock = threading.Lock()
+        self._upsert_lock = threading.Lock()
+
+        self._batch, self._batch_tokens = [], 0
+        self.sources = set()  # every source that has been added
+        self._pending_chunks = {}  # source -> chunks not stored yet
+        self._failed_sources = set()
+        self._succeeded_sources = []
+        self._manifest_entries = {}  # source -> its manifest entry, until it succeeds
+        self._entries_to_write = []
+        self._hash_to_id = {}  # content hash -> id of the chunk stored with it
+        self._duplicate_sources = {}  # stored chunk id -> sources of its duplicates
+        self._metadata_updates = []  # unchanged chunks whose metadata changed
+        # replaced source -> its names, its stored and new chunk ids, and duplicate_of
+        self._replaced = {}
+        self._released = {}  # chunk id -> replaced sources that no longer have it
+        # chunk id -> (document, metadata, embedding) of stored chunks that duplicates
+        # point to, and that new chunks of replaced sources overwrite with other text
+        self._displaced = {}
+        self.num_duplicates = 0
+        self.num_unchanged = 0
+        self.num_deleted = 0
+        self.num_handed_over = 0
+        self.num_chunks = 0
+        self.num_cached = 0
+        self.num_tokens = 0
+        self.num_requests = 0
+        self._start = time.time()
+
+    def add(
+        self, source: str, chunks: list, source_info: dict = None, replace: bool = False
+    ) -> None:
+        """
+        Queue the chunks (LangChain documents) of a source for embedding. source_info
+        (e.g. content_hash, mtime, size) goes into the source's manifest entry. With
+        replace, these chunks are the new version of a stored source: once they're
+        stored, the source's chunks that aren't among them are deleted.
+        Call add and close from one thread (like the ingest pipeline's embed stage):
+        the batch being filled isn't locked, only the state the embedding threads share.
+        """
+        if not chunks:
+            return
+
+        self.sources.add(source)
+        if replace and source not in self._replaced:
+            replaced = {
+                # the chunks' 'source' may not be the source's name
+                "names": {source, chunks[0].metadata.get("source", source)},
+                **self._find_source_chunk_ids(source, chunks),
+                "new_ids": set(),
+                "new_duplicate_of": set(),
+            }
+            with self._lock:
+                self._replaced[source] = replaced
+        with self._lock:
+            replaced = self._replaced.get(source)
+        replaced_ids = replaced["old_ids"] if replaced else set()
+        chunks, chunk_ids, duplicate_of = self._drop_duplicates(
+            source, chunks, replaced_ids
+        )
+        displaced = self._find_displaced(chunks, replaced_ids) if replaced else {}
+
+        with self._lock:
+            if replaced:
+                replaced["new_ids"].update(chunk_ids)
+                replaced["new_duplicate_of"].update(duplicate_of)
+                self._displaced.update(displaced)
+            if self.record_in_manifest:
+                entry = self._manifest_entries.setdefault(
+                    source,
+                    {
+                        **(source_info or {}),
+                        "source": source,
+                        "chunk_ids": [],
+                        "duplicate_of": set(),
+                    },
+                )
+                entry["chunk_ids"] += chunk_ids
+                entry["duplicate_of"].update(duplicate_of)
+
+            pending = self._pending_chunks.get(source, 0) + len(chunks)
+            if pending:
+                self._pending_chunks[source] = pending
+            elif source not in self._failed_sources:
+                # nothing new to embed in this source
+                self._source_succeeded(source)
+        self._write_manifest_entries()
+
+        for chunk in chunks:
+            tokens = count_tokens(chunk.page_content, cfg.EMBEDDINGS_MODEL)
+            if self._batch and (
+                self._batch_tokens + tokens > self.max_batch_tokens
+                or len(self._batch) >= self.max_batch_size
+            ):
+                self._submit_batch()
+            self._batch.append((source, chunk, tokens))
+            self._batch_tokens += tokens
+
+    def _drop_duplicates(
+        self, source: str, chunks: list, replaced_ids: set = frozenset()
+    ) -> tuple[list, list, set]:
+        """
+        Returns the chunks whose content isn't stored (or queued) yet, the ids of all
+        the source's chunks that are (or will be) in the collection, and the ids of the
+        stored chunks its duplicates point to. Chunks in replaced_ids are going away,
+        they don't count as stored copies of a text.
+        """
+        for chunk in chunks:
+            chunk.metadata["content_hash"] = content_hash(chunk.page_content)
+        stored = self._find_stored_hashes({c.metadata["content_hash"] for c in chunks})
+
+        new_chunks, chunk_ids, duplicate_of = [], [], set()
+        with self._lock:
+            for chunk in chunks:
+                chunk_hash = chunk.metadata["content_hash"]
+                chunk_id = chunk.metadata["id"]
+                stored_chunks = stored.get(chunk_hash, {})  # id -> metadata
+                known_id = self._hash_to_id.get(chunk_hash)
+                if known_id == chunk_id or chunk_id in stored_chunks:
+                    # the same chunk, of a source that is added again
+                    self._hash_to_id.setdefault(chunk_hash, chunk_id)
+                    self.num_unchanged += 1
+                    chunk_ids.append(chunk_id)
+                    if chunk_id in stored_chunks and metadata_changed(
+                        stored_chunks[chunk_id], chunk.metadata
+                    ):
+                        self._metadata_updates.append(chunk)
+                    continue
+
+                if known_id is None:
+                    known_id = next(
+                        (i for i in stored_chunks if i not in replaced_ids), None
+                    )
+                if known_id is None:
+                    self._hash_to_id[chunk_hash] = chunk_id
+                    if chunk_id in replaced_ids:
+                        # other text under a reused id: the upsert keeps the metadata
+                        # keys it doesn't set, the old text's duplicates go
+                        chunk.metadata["duplicate_sources"] = ""
+                    new_chunks.append(chunk)
+                    chunk_ids.append(chunk_id)
+                    continue
+
+                stored_id = self._hash_to_id.setdefault(chunk_hash, known_id)
+
+                self.num_duplicates += 1
+                if cfg.DUPLICATE_CHUNKS == "reference":
+                    self._duplicate_sources.setdefault(stored_id, set()).add(
+                        chunk.metadata.get("source", source)
+                    )
+                    duplicate_of.add(stored_id)
+
+        return new_chunks, chunk_ids, duplicate_of
+
+    def _find_displaced(self, chunks: list, replaced_ids: set) -> dict:
+        """
+        The stored chunks that duplicates point to, and that chunks about to be
+        embedded overwrite with other text: positional chunk ids ('<page id>_chunk-<i>')
+        are reused when a source is replaced. Returns id -> (document, metadata,
+        embedding), to store them again (see _store_displaced_chunks).
+        """
+        new_hashes = {
+            c.metadata["id"]: c.metadata["content_hash"]
+            for c in chunks
+            if c.metadata["id"] in replaced_ids
+        }
+        if not new_hashes:
+            return {}
+
+        ids = list(new_hashes)
+        displaced_ids = []
+        for i in range(0, len(ids), HASH_LOOKUP_SIZE):
+            results = self.collection.get(
+                ids=ids[i : i + HASH_LOOKUP_SIZE], include=["metadatas"]
+            )
+            displaced_ids += [
+                chunk_id
+                for chunk_id, metadata in zip(results["ids"], results["metadatas"])
+                if metadata.get("duplicate_sources")
+                and metadata.get("content_hash") != new_hashes[chunk_id]
+            ]
+        if not displaced_ids:
+            return {}
+
+        if self.vector_settings["store"] == "quantized_index":
+            results = self.collection.get(
+                ids=displaced_ids, include=["documents", "metadatas"]
+            )
+            stored = quantized_index.get_embeddings(self.collection_name, displaced_ids)
+            results["embeddings"] = [stored[i] for i in results["ids"]]
+        else:
+            results = self.collection.get(
+                ids=displaced_ids, include=["documents", "metadatas", "embeddings"]
+            )
+        return {
+            chunk_id: (document, metadata, embedding)
+            for chunk_id, document, metadata, embedding in zip(
+                results["ids"],
+                results["documents"],
+                results["metadatas"],
+                results["embeddings"],
+            )
+        }
+
+    def _find_source_chunk_ids(self, source: str, chunks: list) -> dict:
+        """
+        The ids of the chunks stored for a source, in the manifest and in Chroma
+        ('old_ids'), and of the chunks its duplicates pointed to ('old_duplicate_of')
+        """
+        entry = ingest_manifest.get_entry(self.collection_name, source)
+        chunk_ids = set(entry["chunk_ids"]) if entry else set()
+        results = self.collection.get(
+            where={"source": chunks[0].metadata.get("source", source)}, include=[]
+        )
+        return {
+            "old_ids": chunk_ids | set(results["ids"]),
+            "old_duplicate_of": set(entry["duplicate_of"]) if entry else set(),
+        }
+
+    def _source_succeeded(self, source: str) -> None:
+        """Call with self._lock held"""
+        self._succeeded_sources.append(source)
+        if source in self._replaced:
+            replaced = self._replaced.pop(source)
+            # its old chunks, and the ones its old duplicates pointed to
+            for chunk_id in (replaced["old_ids"] - replaced["new_ids"]) | (
+                replaced["old_duplicate_of"] - replaced["new_duplicate_of"]
+            ):
+                self._released.setdefault(chunk_id, set()).update(replaced["names"])
+        entry = self._manifest_entries.pop(source, None)
+        if entry is not None:
+            self._entries_to_write.append(entry)
+
+    def _write_manifest_entries(self, min_entries: int = MANIFEST_WRITE_SIZE) -> None:
+        with self._lock:
+            if not self._entries_to_write or len(self._entries_to_write) < min_entries:
+                return
+            entries, self._entries_to_write = self._entries_to_write, []
+
+        try:
+            ingest_manifest.record_sources(self.collection_name, entries)
+        except Exception as e:
+            prnt.prRed(
+                f"Could not record {len(entries)} sources in the ingest manifest: {e}"
+            )
+            with self._lock:
+                for entry in entries:
+                    self._succeeded_sources.remove(entry["source"])
+                    self._failed_sources.add(entry["source"])
+
+    def _find_stored_hashes(self, hashes: set) -> dict:
+        """content hash -> {id: metadata} of the stored chunks that have it"""
+        hashes = list(hashes)
+        stored = {}
+        for i in range(0, len(hashes), HASH_LOOKUP_SIZE):
+            results = self.collection.get(
+                where={"content_hash": {"$in": hashes[i : i + HASH_LOOKUP_SIZE]}},
+                include=["metadatas"],
+            )
+            for chunk_id, metadata in zip(results["ids"], results["metadatas"]):
+                stored.setdefault(metadata["content_hash"], {})[chunk_id] = metadata
+
+        return stored
+
+    def _update_metadatas(self) -> None:
+        """Store the new metadata of unchanged chunks (e.g. their new position)"""
+        chunks = self._metadata_updates
+        for i in range(0, len(chunks), HASH_LOOKUP_SIZE):
+            batch = chunks[i : i + HASH_LOOKUP_SIZE]
+            ids = [c.metadata["id"] for c in batch]
+            metadatas = [c.metadata for c in batch]
+            self.collection.update(ids=ids, metadatas=metadatas)
+            lexical_index.upsert_chunks(
+                self.collection_name, ids, [c.page_content for c in batch], metadatas
+            )
+            quantized_index.update_sources(self.collection_name, ids, metadatas)
+
+    def _release_replaced_chunks(self) -> None:
+        """
+        Let go of the chunks that replaced sources no longer have, in bulk: they're
+        deleted, or handed over to a source whose duplicate points to them
+        """
+        num_deleted, num_handed_over = release_chunks(
+            self.collection, self.collection_name, self._released
+        )
+        self.num_deleted += num_deleted
+        self.num_handed_over += num_handed_over
+
+    def _store_displaced_chunks(self) -> None:
+        """
+        Store the texts that were overwritten while duplicates pointed to them (see
+        _find_displaced) again, as '<id>-h<content hash>'. Like in release_chunks, the
+        first duplicate source owns the copy. The duplicate sources' manifest entries
+        point to it instead of the overwritten chunk.
+        """
+        ids = sorted(self._displaced)
+        results = self.collection.get(ids=ids, include=["metadatas"])
+        current_hashes = {
+            chunk_id: metadata.get("content_hash")
+            for chunk_id, metadata in zip(results["ids"], results["metadatas"])
+        }
+
+        moved = {}  # overwritten chunk id -> id of the copy
+        new_ids, documents, metadatas, embeddings = [], [], [], []
+        for chunk_id in ids:
+            document, metadata, embedding = self._displaced[chunk_id]
+            if current_hashes.get(chunk_id) == metadata["content_hash"]:
+                # the batch that would have overwritten it failed
+                continue
+            sources = sorted(filter(None, metadata["duplicate_sources"].split("\n")))
+            new_id = f"{chunk_id}-h{metadata['content_hash'][:16]}"
+            moved[chunk_id] = new_id
+            new_ids.append(new_id)
+            documents.append(document)
+            embeddings.append(embedding)
+            metadatas.append(
+                {
+                    **metadata,
+                    "id": new_id,
+                    "source": sources[0],
+                    "duplicate_sources": "\n".join(sources[1:]),
+                }
+            )
+        if not new_ids:
+            return
+
+        self.collection.upsert(
+            ids=new_ids,
+            embeddings=quantized_index.get_chroma_embeddings(
+                self.vector_settings, embeddings
+            ),
+            documents=documents,
+            metadatas=metadatas,
+        )
+        lexical_index.upsert_chunks(self.collection_name, new_ids, documents, metadatas)
+        if self.vector_settings["quantization"] == "int8":
+            quantized_index.upsert_vectors(
+                self.collection_name, new_ids, embeddings, metadatas
+            )
+        self.num_handed_over += len(new_ids)
+
+        sources = set()
+        for metadata in metadatas:
+            sources.add(metadata["source"])
+            sources.update(filter(None, metadata["duplicate_sources"].split("\n")))
+        entries = ingest_manifest.get_entries(self.collection_name, list(sources))
+        ingest_manifest.update_duplicate_of(
+            self.collection_name,
+            {
+                source: [moved.get(i, i) for i in entry["duplicate_of"]]
+                for source, entry in entries.items()
+            },
+        )
+
+    def _record_duplicate_sources(self) -> None:
+        """Add the sources of the skipped duplicates to the metadata of the stored chunks"""
+        ids = list(self._duplicate_sources)
+        for i in range(0, len(ids), HASH_LOOKUP_SIZE):
+            batch_ids = ids[i : i + HASH_LOOKUP_SIZE]
+            results = self.collection.get(ids=batch_ids, include=["metadatas"])
+            updated_ids, updated_metadatas = [], []
+            for chunk_id, metadata in zip(results["ids"], results["metadatas"]):
+                sources = metadata.get("duplicate_sources", "").split("\n")
+                sources = set(filter(None, sources)) | self._duplicate_sources[chunk_id]
+                sources.discard(metadata.get("source"))
+                if sources:
+                    updated_ids.append(chunk_id)
+                    updated_metadatas.append(
+                        {"duplicate_sources": "\n".join(sorted(sources))}
+                    )
+            if updated_ids:
+                self.collection.update(ids=updated_ids, metadatas=updated_metadatas)
+
+    @property
+    def collection(self):
+        """The collection is created when it's first written to"""
+        with self._lock:
+            if self._collection is None:
+                self._collection = registry.get_collection(
+                    collection_name=self.collection_name,
+                    embedding_function=self.embedding_function,
+                    create=True,
+                )
+                self.vector_settings = registry.get_vector_settings(self._collection)
+            return self._collection
+
+    def _submit_batch(self) -> None:
+        batch = self._batch
+        self._batch, self._batch_tokens = [], 0
+        self._batch_slots.acquire()
+        self._futures.append(self._executor.submit(self._embed_and_store, batch))
+
+    def _embed(self, batch: list) -> tuple[list, int]:
+        """
+        Embeddings of the chunks in the batch, and how many came from the cache. Only
+        the chunks that aren't cached are sent to the provider.
+        """
+        model = cfg.EMBEDDINGS_MODEL
+        hashes = [chunk.metadata["content_hash"] for _, chunk, _ in batch]
+        cached = self.cache.get_many(model, self.dimensions, hashes)
+        missing = [i for i, h in enumerate(hashes) if h not in cached]
+        if not missing:
+            return [cached[h] for h in hashes], len(batch)
+
+        tokens = sum(batch[i][2] for i in missing)
+        self.rate_limiter.acquire(tokens)
+        new_embeddings = self.embedding_function(
+            [batch[i][1].page_content for i in missing]
+        )
+        new_embeddings = [
+            e.tolist() if hasattr(e, "tolist") else list(e) for e in new_embeddings
+        ]
+        with self._lock:
+            self.num_requests += 1
+            self.num_tokens += tokens
+        self.cache.put_many(
+            model, self.dimensions, [hashes[i] for i in missing], new_embeddings
+        )
+
+        embeddings = [cached.get(h) for h in hashes]
+        for i, embedding in zip(missing, new_embeddings):
+            embeddings[i] = embedding
+        return embeddings, len(batch) - len(missing)
+
+    def _embed_and_store(self, batch: list) -> None:
+        try:
+            self._embed_and_store_batch(batch)
+        finally:
+            self._batch_slots.release()
+
+    def _embed_and_store_batch(self, batch: list) -> None:
+        documents = [chunk.page_content for _, chunk, _ in batch]
+        metadatas = [chunk.metadata for _, chunk, _ in batch]
+        ids = [chunk.metadata["id"] for _, chunk, _ in batch]
+        collection = self.collection
+
+        error = None
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                # on a retry, the embeddings of a failed upsert come from the cache
+                embeddings, num_cached = self._embed(batch)
+                # the cache keeps the full embeddings, the collection may keep fewer
+                # dimensions of them
+                embeddings = registry.shorten_embeddings(
+                    embeddings, self.vector_settings["dimensions"]
+                )
+                with self._upsert_lock:
+                    collection.upsert(
+                        ids=ids,
+                        embeddings=quantized_index.get_chroma_embeddings(
+                            self.vector_settings, embeddings
+                        ),
+                        documents=documents,
+                        metadatas=metadatas,
+                    )
+                    lexical_index.upsert_chunks(
+                        self.collection_name, ids, documents, metadatas
+                    )
+                    if self.vector_settings["quantization"] == "int8":
+                        quantized_index.upsert_vectors(
+                            self.collection_name, ids, embeddings, metadatas
+                        )
+                error = None
+                break
+            except Exception as e:
+                error = e
+                if attempt < MAX_ATTEMPTS - 1:
+                    # mostly rate limits and timeouts, back off and retry
+                    prnt.prRed(f"Embedding batch failed ({e}), retrying")
+                    time.sleep(2**attempt)
+
+        with self._lock:
+            if error is not None:
+                prnt.prRed(f"Embedding batch of {len(batch)} chunks failed: {error}")
+            else:
+                self.num_chunks += len(batch)
+                self.num_cached += num_cached
+
+            for source, _, _ in batch:
+                if error is not None:
+                    self._failed_sources.add(source)
+                    self._manifest_entries.pop(source, None)
+                    self._replaced.pop(source, None)
+                self._pending_chunks[source] -= 1
+                if self._pending_chunks[source] == 0:
+                    del self._pending_chunks[source]
+                    if source not in self._failed_sources:
+                        self._source_succeeded(source)
+        self._write_manifest_entries()
+
+    def close(self) -> dict:
+        """Send the last batch, wait for all of them, and report"""
+        if self._batch:
+            self._submit_batch()
+        for future in self._futures:
+            future.result()
+        self._executor.shutdown()
+        self._write_manifest_entries(min_entries=1)
+
+        if self._displaced:
+            try:
+                self._store_displaced_chunks()
+            except Exception as e:
+                prnt.prRed(f"Could not keep the overwritten chunks of duplicates: {e}")
+        if self._duplicate_sources:
+            try:
+                self._record_duplicate_sources()
+            except Exception as e:
+                prnt.prRed(f"Could not record the sources of duplicate chunks: {e}")
+        if self._metadata_updates:
+            try:
+                self._update_metadatas()
+            except Exception as e:
+                prnt.prRed(f"Could not update the metadata of unchanged chunks: {e}")
+        if self._released:
+            try:
+                self._release_replaced_chunks()
+            except Exception as e:
+                prnt.prRed(f"Could not delete the old chunks of replaced sources: {e}")
+
+        if (
+            self.num_chunks
+            or self._duplicate_sources
+            or self._metadata_updates
+            or self._released
+            or self._displaced
+        ):
+            registry.invalidate(self.collection_name)
+            answer_cache.bump_collection_version(self.collection_name)
+
+        elapsed = time.time() - self._start
+        results = {
+            "succeeded": list(self._succeeded_sources),
+            "failed": sorted(self._failed_sources),
+            "num_chunks": self.num_chunks,
+            "num_cached": self.num_cached,
+            "num_tokens": self.num_tokens,
+            "num_requests": self.num_requests,
+            "num_duplicates": self.num_duplicates,
+            "num_unchanged": self.num_unchanged,
+            "num_deleted": self.num_deleted,
+            "num_handed_over": self.num_handed_over,
+            "seconds": elapsed,
+        }
+        prnt.prLightPurple(
+            f"Embedded {self.num_chunks} chunks of {len(self._succeeded_sources)} sources "
+            f"({self.num_cached} from the cache, {self.num_tokens} tokens) "
+            f"in {self.num_requests} requests, {elapsed:.1f}s"
+        )
+        if self.num_duplicates or self.num_unchanged or self.num_deleted:
+            prnt.prLightPurple(
+                f"Skipped {self.num_duplicates} duplicate and "
+                f"{self.num_unchanged} unchanged chunks, "
+                f"deleted {self.num_deleted} chunks of replaced sources "
+                f"({self.num_handed_over} more handed over to their duplicates)"
+            )
+        if self._failed_sources:
+            prnt.prRed(f"Failed sources: {sorted(self._failed_sources)}")
+
+        return results
@@ -0,0 +1,280 @@
+"""
+Ingest manifest: what has been embedded in each collection. One SQLite file per
+collection records, for every source (file name, url or abstract), its content hash,
+file mtime/size, the ids of its chunks, the ids of the stored chunks its duplicate
+chunks point to, the embedding model and when it was embedded.
+
+It replaces the embedded_sources.csv files, which were read whole and rewritten on
+every add, and could lose entries when two pipelines wrote them at once. Lookups and
+writes here are single indexed statements in transactions.
+
+To import the embedded_sources.csv of a collection embedded before the manifest existed:
+python3 rag/ingest_manifest.py '{"collection_name": "leopard_news", "csv_file": "results/leopard_news/embedded_sources.csv"}'
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+import src.config as cfg
+
+# max parameters per IN (...) lookup, SQLite limits the number of query parameters
+LOOKUP_SIZE = 500
+
+_lock = threading.Lock()
+_connections = {}  # manifest file -> sqlite3.Connection
+
+COLUMNS = (
+    "source, content_hash, mtime, size, chunk_ids, num_chunks, embedding_model, "
+    "embedded_at, duplicate_of"
+)
+
+
+def get_manifest_path(collection_name: str) -> str:
+    return os.path.join(cfg.INGEST_MANIFEST_DIR, f"{collection_name}.sqlite3")
+
+
+def exists(collection_name: str) -> bool:
+    return os.path.exists(get_manifest_path(collection_name))
+
+
+def _connect(collection_name: str) -> sqlite3.Connection:
+    path = os.path.abspath(get_manifest_path(collection_name))
+
+    with _lock:
+        conn = _connections.get(path)
+        if conn is not None:
+            return conn
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # several pipelines may write at once, wait for each other's transactions
+        conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS sources (
+                source TEXT PRIMARY KEY,
+                content_hash TEXT,
+                mtime REAL,
+                size INTEGER,
+                chunk_ids TEXT NOT NULL,
+                num_chunks INTEGER NOT NULL,
+                embedding_model TEXT,
+                embedded_at REAL NOT NULL,
+                duplicate_of TEXT
+            )"""
+        )
+        # manifests written before duplicate_of was recorded
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sources)")}
+        if "duplicate_of" not in columns:
+            conn.execute("ALTER TABLE sources ADD COLUMN duplicate_of TEXT")
+        conn.commit()
+        _connections[path] = conn
+
+    return conn
+
+
+def _to_entry(row) -> dict:
+    (
+        source,
+        content_hash,
+        mtime,
+        size,
+        chunk_ids,
+        num_chunks,
+        model,
+        embedded_at,
+        duplicate_of,
+    ) = row
+    return {
+        "source": source,
+        "content_hash": content_hash,
+        "mtime": mtime,
+        "size": size,
+        "chunk_ids": json.loads(chunk_ids),
+        "num_chunks": num_chunks,
+        "embedding_model": model,
+        "embedded_at": embedded_at,
+        "duplicate_of": json.loads(duplicate_of or "[]"),
+    }
+
+
+def is_embedded(collection_name: str, source: str) -> bool:
+    if not exists(collection_name):
+        return False
+
+    conn = _connect(collection_name)
+    with _lock:
+        row = conn.execute(
+            "SELECT 1 FROM sources WHERE source = ?", (source,)
+        ).fetchone()
+    return row is not None
+
+
+def embedded_among(collection_name: str, sources: list) -> set:
+    """The sources in the list that are embedded, in a few lookups"""
+    if not sources or not exists(collection_name):
+        return set()
+
+    conn = _connect(collection_name)
+    sources = list(set(sources))
+    embedded = set()
+    with _lock:
+        for i in range(0, len(sources), LOOKUP_SIZE):
+            batch = sources[i : i + LOOKUP_SIZE]
+            rows = conn.execute(
+                f"SELECT source FROM sources WHERE source IN ({','.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+            embedded.update(r[0] for r in rows)
+    return embedded
+
+
+def get_entry(collection_name: str, source: str) -> dict:
+    """The manifest entry of a source, or None if it isn't embedded"""
+    if not exists(collection_name):
+        return None
+
+    conn = _connect(collection_name)
+    with _lock:
+        row = conn.execute(
+            f"SELECT {COLUMNS} FROM sources WHERE source = ?", (source,)
+        ).fetchone()
+    return _to_entry(row) if row else None
+
+
+def get_entries(collection_name: str, sources: list) -> dict:
+    """source -> manifest entry, for the sources in the list that are embedded"""
+    if not sources or not exists(collection_name):
+        return {}
+
+    conn = _connect(collection_name)
+    sources = list(set(sources))
+    entries = {}
+    with _lock:
+        for i in range(0, len(sources), LOOKUP_SIZE):
+            batch = sources[i : i + LOOKUP_SIZE]
+            rows = conn.execute(
+                f"SELECT {COLUMNS} FROM sources "
+                f"WHERE source IN ({','.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+            entries.update((row[0], _to_entry(row)) for row in rows)
+    return entries
+
+
+def get_sources(collection_name: str) -> set:
+    if not exists(collection_name):
+        return set()
+
+    conn = _connect(collection_name)
+    with _lock:
+        return {r[0] for r in conn.execute("SELECT source FROM sources")}
+
+
+def count(collection_name: str) -> int:
+    if not exists(collection_name):
+        return 0
+
+    conn = _connect(collection_name)
+    with _lock:
+        return conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+
+
+def record_sources(collection_name: str, entries: list[dict]) -> None:
+    """
+    Add or replace the entries of embedded sources, in one transaction. An entry has a
+    'source' and 'chunk_ids', and optionally 'content_hash', 'mtime', 'size',
+    'embedding_model' (default: cfg.EMBEDDINGS_MODEL) and 'duplicate_of' (the ids of
+    the stored chunks the source's duplicate chunks point to).
+    """
+    now = time.time()
+    rows = [
+        (
+            e["source"],
+            e.get("content_hash"),
+            e.get("mtime"),
+            e.get("size"),
+            json.dumps(e.get("chunk_ids", [])),
+            len(e.get("chunk_ids", [])),
+            e.get("embedding_model", cfg.EMBEDDINGS_MODEL),
+            now,
+            json.dumps(sorted(e.get("duplicate_of", []))),
+        )
+        for e in entries
+    ]
+
+    conn = _connect(collection_name)
+    with _lock:
+        with conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO sources ({COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+
+def update_duplicate_of(collection_name: str, duplicate_of: dict) -> None:
+    """Replace the 'duplicate_of' of sources (source -> chunk ids) in their entries"""
+    rows = [(json.dumps(sorted(ids)), source) for source, ids in duplicate_of.items()]
+    conn = _connect(collection_name)
+    with _lock:
+        with conn:
+            conn.executemany(
+                "UPDATE sources SET duplicate_of = ? WHERE source = ?", rows
+            )
+
+
+def remove_sources(collection_name: str, sources: list[str]) -> None:
+    if not exists(collection_name):
+        return
+
+    conn = _connect(collection_name)
+    with _lock:
+        with conn:
+            conn.executemany(
+                "DELETE FROM sources WHERE source = ?", [(s,) for s in sources]
+            )
+
+
+def drop_collection(collection_name: str) -> None:
+    path = os.path.abspath(get_manifest_path(collection_name))
+
+    with _lock:
+        conn = _connections.pop(path, None)
+        if conn is not None:
+            conn.close()
+
+    for suffix in ["", "-wal", "-shm"]:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def import_embedded_sources_csv(collection_name: str, csv_file: str) -> int:
+    """
+    Record the sources listed in an old embedded_sources.csv (column 'Sources') that
+    aren't in the manifest yet. Their chunk ids aren't known, so they're left empty.
+    """
+    import csv
+
+    with open(csv_file, newline="", encoding="utf-8") as f:
+        sources = [row["Sources"] for row in csv.DictReader(f) if row.get("Sources")]
+
+    new_sources = set(sources) - embedded_among(collection_name, sources)
+    record_sources(
+        collection_name,
+        [{"source": s, "embedding_model": None} for s in sorted(new_sources)],
+    )
+    prnt.prLightPurple(
+        f"Imported {len(new_sources)} sources of {csv_file} into the manifest of {collection_name}"
+    )
+    return len(new_sources)
+
+
+if __name__ == "__main__":
+    inputs = json.loads(sys.argv[1])
+    import_embedded_sources_csv(inputs["collection_name"], inputs["csv_file"])
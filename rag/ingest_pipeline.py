@@ -0,0 +1,167 @@
+"""
+A bounded producer-consumer pipeline for ingestion: every stage is a pool of threads
+that take items from the stage's queue and put what they make of them on the next
+stage's queue. Queues hold at most a few items, so a stage that is ahead blocks until
+the one after it catches up (backpressure), and memory stays bounded however many
+sources are ingested.
+
+Every stage records how many items went in and out, how busy its threads were, how
+long they waited on a full downstream queue, and how deep its queue was.
+"""
+
+import os
+import sys
+import time
+import queue
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+
+_DONE = object()  # end of a queue, one per worker reading it
+
+
+class Stage:
+    """
+    fn(item) returns (or yields) the items passed on to the next stage, possibly none
+    or several. Exceptions are printed and counted, and the item is dropped.
+    """
+
+    def __init__(
+        self, name: str, fn, num_workers: int = 1, queue_size: int = 16
+    ) -> None:
+        self.name = name
+        self.fn = fn
+        self.num_workers = max(1, num_workers)
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self._lock = threading.Lock()
+        self.items_in = 0
+        self.items_out = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0  # waiting for room in the next queue
+        self.max_depth = 0
+        self._depth_total = 0
+
+    def _take(self):
+        item = self.queue.get()
+        depth = self.queue.qsize()
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+            self._depth_total += depth
+        return item
+
+    def _process(self, item, put) -> None:
+        """Run fn on the item, and put its outputs with put"""
+        start = time.perf_counter()
+        blocked = 0.0
+        num_out, failed = 0, 0
+        try:
+            for output in self.fn(item) or []:
+                put_start = time.perf_counter()
+                put(output)
+                blocked += time.perf_counter() - put_start
+                num_out += 1
+        except Exception as e:
+            prnt.prRed(f"The {self.name} stage failed on an item: {e}")
+            failed = 1
+
+        with self._lock:
+            self.items_in += 1
+            self.items_out += num_out
+            self.failed += failed
+            self.busy_seconds += time.perf_counter() - start - blocked
+            self.blocked_seconds += blocked
+
+    def get_metrics(self, elapsed: float) -> dict:
+        return {
+            "workers": self.num_workers,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "failed": self.failed,
+            "items_per_second": self.items_in / elapsed if elapsed else 0.0,
+            # share of the workers' time spent working, and waiting on the next stage
+            "busy": (
+                self.busy_seconds / (elapsed * self.num_workers) if elapsed else 0.0
+            ),
+            "blocked": (
+                self.blocked_seconds / (elapsed * self.num_workers) if elapsed else 0.0
+            ),
+            "mean_queue_depth": self._depth_total / max(1, self.items_in),
+            "max_queue_depth": self.max_depth,
+        }
+
+
+def run_pipeline(items, stages: list, consumer: Stage) -> dict:
+    """
+    Feed the items through the stages, each a pool of threads, and run the consumer
+    stage (one worker, whose fn returns nothing) in this thread on what the last stage
+    outputs. Returns the metrics of every stage by name, once all the items have gone
+    through.
+    """
+    consumer.num_workers = 1
+    all_stages = stages + [consumer]
+    remaining = {stage.name: stage.num_workers for stage in stages}
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def feed():
+        first = all_stages[0]
+        for item in items:
+            first.queue.put(item)
+        for _ in range(first.num_workers):
+            first.queue.put(_DONE)
+
+    def work(stage: Stage, next_stage: Stage):
+        while True:
+            item = stage._take()
+            if item is _DONE:
+                break
+            stage._process(item, next_stage.queue.put)
+
+        # the last worker of a stage to finish ends the next stage's queue
+        with lock:
+            remaining[stage.name] -= 1
+            last = remaining[stage.name] == 0
+        if last:
+            for _ in range(next_stage.num_workers):
+                next_stage.queue.put(_DONE)
+
+    threads = [threading.Thread(target=feed, name="ingest-feed", daemon=True)]
+    for stage, next_stage in zip(stages, all_stages[1:]):
+        threads += [
+            threading.Thread(
+                target=work,
+                args=(stage, next_stage),
+                name=f"ingest-{stage.name}-{i}",
+                daemon=True,
+            )
+            for i in range(stage.num_workers)
+        ]
+    for thread in threads:
+        thread.start()
+
+    while True:
+        item = consumer._take()
+        if item is _DONE:
+            break
+        consumer._process(item, lambda output: None)
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start
+    return {stage.name: stage.get_metrics(elapsed) for stage in all_stages}
+
+
+def print_metrics(metrics: dict) -> None:
+    prnt.prLightPurple("Ingest pipeline stages:")
+    for name, m in metrics.items():
+        print(
+            f"  {name:<8} {m['workers']:>2} workers  {m['items_in']:>6} in  "
+            f"{m['items_out']:>6} out  {m['failed']} failed  "
+            f"{m['items_per_second']:.1f}/s  busy {m['busy']:.0%}  "
+            f"blocked {m['blocked']:.0%}  queue {m['mean_queue_depth']:.1f} avg, "
+            f"{m['max_queue_depth']} max"
+        )
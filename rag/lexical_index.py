@@ -0,0 +1,192 @@
+"""
+Local BM25 (SQLite FTS5) index of the chunks of each Chroma collection.
+It is kept in sync by rag/maintain_vectordb.py, and lets us retrieve chunks by exact
+names (places, protected areas, species) without an embedding API call.
+
+To build the index of a collection that was embedded before this index existed:
+python3 rag/lexical_index.py '{"collection_name": "leopard_news"}'
+"""
+
+import os
+import re
+import sys
+import json
+import sqlite3
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+import src.config as cfg
+import rag.chroma_registry as registry
+
+STOPWORDS = set(
+    """a an and are as at be by do does for from has have how in is it its of on or
+    that the their there these this to was were what when where which who why with
+    about any can did give me tell""".split()
+)
+
+_lock = threading.Lock()
+_connections = {}  # index file -> sqlite3.Connection
+
+
+def get_index_path(collection_name: str) -> str:
+    return os.path.join(cfg.LEXICAL_INDEX_DIR, f"{collection_name}.sqlite3")
+
+
+def _connect(collection_name: str) -> sqlite3.Connection:
+    path = os.path.abspath(get_index_path(collection_name))
+
+    with _lock:
+        conn = _connections.get(path)
+        if conn is not None:
+            return conn
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # chunk_store holds the rows, the FTS5 table indexes its content (external content table)
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunk_store (
+                rowid INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                source TEXT,
+                content TEXT NOT NULL,
+                metadata TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunk_store_source ON chunk_store (source);
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunk_fts USING fts5(
+                content, content='chunk_store', content_rowid='rowid',
+                tokenize='porter unicode61'
+            );
+            CREATE TRIGGER IF NOT EXISTS chunk_store_ai AFTER INSERT ON chunk_store BEGIN
+                INSERT INTO chunk_fts(rowid, content) VALUES (new.rowid, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunk_store_ad AFTER DELETE ON chunk_store BEGIN
+                INSERT INTO chunk_fts(chunk_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+            END;
+            """
+        )
+        conn.commit()
+        _connections[path] = conn
+
+    return conn
+
+
+def upsert_chunks(
+    collection_name: str, ids: list[str], documents: list[str], metadatas: list[dict]
+) -> None:
+    conn = _connect(collection_name)
+    rows = [
+        (id_, (metadata or {}).get("source"), document, json.dumps(metadata or {}))
+        for id_, document, metadata in zip(ids, documents, metadatas)
+    ]
+
+    with _lock:
+        with conn:
+            conn.executemany("DELETE FROM chunk_store WHERE id = ?", [(r[0],) for r in rows])
+            conn.executemany(
+                "INSERT INTO chunk_store (id, source, content, metadata) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+
+def delete_sources(collection_name: str, sources: list[str]) -> None:
+    conn = _connect(collection_name)
+
+    with _lock:
+        with conn:
+            conn.executemany(
+                "DELETE FROM chunk_store WHERE source = ?", [(s,) for s in sources]
+            )
+
+
+def delete_ids(collection_name: str, ids: list[str]) -> None:
+    conn = _connect(collection_name)
+
+    with _lock:
+        with conn:
+            conn.executemany("DELETE FROM chunk_store WHERE id = ?", [(i,) for i in ids])
+
+
+def drop_collection(collection_name: str) -> None:
+    path = os.path.abspath(get_index_path(collection_name))
+
+    with _lock:
+        conn = _connections.pop(path, None)
+        if conn is not None:
+            conn.close()
+
+    for suffix in ["", "-wal", "-shm"]:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def to_fts_query(query: str) -> str:
+    """Turn a natural-language question into an FTS5 OR-query of its (non-stopword) terms"""
+    terms = [t for t in re.findall(r"\w+", query.lower()) if t not in STOPWORDS]
+    # quoting makes every term a literal, so words like 'NOT' or 'NEAR' aren't operators
+    return " OR ".join(f'"{t}"' for t in dict.fromkeys(terms))
+
+
+def search(collection_name: str, query: str, k: int = 15) -> list[dict]:
+    """
+    BM25 search of a collection's chunks. Returns at most k dicts with the chunk 'id',
+    'content', 'metadata' and 'score' (higher is better), best first.
+    """
+    fts_query = to_fts_query(query)
+    if not fts_query or not os.path.exists(get_index_path(collection_name)):
+        return []
+
+    conn = _connect(collection_name)
+    with _lock:
+        rows = conn.execute(
+            """SELECT s.id, s.content, s.metadata, bm25(chunk_fts) AS rank
+            FROM chunk_fts JOIN chunk_store s ON s.rowid = chunk_fts.rowid
+            WHERE chunk_fts MATCH ? ORDER BY rank LIMIT ?""",
+            (fts_query, k),
+        ).fetchall()
+
+    # SQLite's bm25() is lower-is-better
+    return [
+        {"id": id_, "content": content, "metadata": json.loads(metadata), "score": -rank}
+        for id_, content, metadata, rank in rows
+    ]
+
+
+def count(collection_name: str) -> int:
+    if not os.path.exists(get_index_path(collection_name)):
+        return 0
+
+    conn = _connect(collection_name)
+    with _lock:
+        return conn.execute("SELECT COUNT(*) FROM chunk_store").fetchone()[0]
+
+
+def rebuild_from_chroma(collection_name: str, page_size: int = 1000) -> int:
+    """(Re)build the lexical index of a collection from the chunks stored in Chroma"""
+    collection = registry.get_client().get_collection(
+        name=collection_name, embedding_function=None
+    )
+    drop_collection(collection_name)
+
+    num_indexed = 0
+    offset = 0
+    while True:
+        page = collection.get(
+            limit=page_size, offset=offset, include=["documents", "metadatas"]
+        )
+        if not page["ids"]:
+            break
+
+        upsert_chunks(collection_name, page["ids"], page["documents"], page["metadatas"])
+        num_indexed += len(page["ids"])
+        offset += page_size
+
+    prnt.prLightPurple(f"Indexed {num_indexed} chunks of {collection_name}")
+    return num_indexed
+
+
+if __name__ == "__main__":
+    inputs = json.loads(sys.argv[1])
+    rebuild_from_chroma(inputs["collection_name"])
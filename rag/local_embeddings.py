@@ -0,0 +1,187 @@
+"""
+Local CPU embeddings: a sentence-transformers model (PyTorch or ONNX) loaded from
+LOCAL_EMBEDDINGS_DIR or the Hugging Face cache, behind the 'local' provider in
+cfg.PROVIDERS. Nothing goes over the network, so queries are embedded in milliseconds
+and ingests aren't held back by API rate limits.
+
+All the callers of a model share one LocalEmbedder. Its worker thread merges the texts
+of concurrent calls (the query path, the ingest scheduler's threads) into batches of up
+to LOCAL_EMBEDDINGS_MAX_BATCH, waiting at most LOCAL_EMBEDDINGS_MAX_WAIT_MS for more to
+arrive, and every batch runs on LOCAL_EMBEDDINGS_THREADS cores.
+
+Models truncate texts longer than their max_seq_length (256 tokens for
+all-MiniLM-L6-v2), so pick one whose limit fits the chunk size.
+
+Needs sentence-transformers (and optimum[onnxruntime] for LOCAL_EMBEDDINGS_BACKEND =
+"onnx"), which is only imported when the model is loaded.
+"""
+
+import os
+import sys
+import time
+import queue
+import threading
+
+from langchain_core.embeddings import Embeddings
+from chromadb.api.types import Documents, EmbeddingFunction
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+import src.config as cfg
+
+_embedders = {}  # model -> LocalEmbedder
+_embedders_lock = threading.Lock()
+
+
+class _Request:
+    def __init__(self, texts: list[str]) -> None:
+        self.texts = texts
+        self.embeddings = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class LocalEmbedder:
+    """
+    A sentence-transformers model on the CPU, loaded on first use. embed() can be called
+    from any thread: the texts of concurrent calls are embedded together.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        backend: str = None,
+        num_threads: int = None,
+        max_batch_size: int = None,
+        max_wait_ms: float = None,
+    ) -> None:
+        self.model_name = model
+        self.backend = backend or cfg.LOCAL_EMBEDDINGS_BACKEND
+        self.num_threads = num_threads or cfg.LOCAL_EMBEDDINGS_THREADS or os.cpu_count()
+        self.max_batch_size = max_batch_size or cfg.LOCAL_EMBEDDINGS_MAX_BATCH
+        self.max_wait = (
+            max_wait_ms if max_wait_ms is not None else cfg.LOCAL_EMBEDDINGS_MAX_WAIT_MS
+        ) / 1000
+
+        self._model = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self.num_batches = 0
+
+    def get_model_path(self) -> str:
+        """The model's folder in LOCAL_EMBEDDINGS_DIR if it's there, else its name"""
+        path = os.path.join(cfg.LOCAL_EMBEDDINGS_DIR, self.model_name)
+        return path if os.path.isdir(path) else self.model_name
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                self._model = self._load_model()
+        return self._model
+
+    def _load_model(self):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        torch.set_num_threads(self.num_threads)
+        start = time.time()
+        kwargs = {"backend": self.backend} if self.backend != "torch" else {}
+        model = SentenceTransformer(self.get_model_path(), device="cpu", **kwargs)
+        prnt.prLightPurple(
+            f"Loaded the embedding model {self.model_name} ({self.backend}, "
+            f"{self.num_threads} threads) in {time.time() - start:.1f}s"
+        )
+        return model
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+
+        request = _Request(list(texts))
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="local-embeddings", daemon=True
+                )
+                self._worker.start()
+        self._queue.put(request)
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.embeddings
+
+    def _next_requests(self) -> list:
+        """Blocks for a request, then takes the ones that arrive within max_wait"""
+        requests = [self._queue.get()]
+        num_texts = len(requests[0].texts)
+        deadline = time.monotonic() + self.max_wait
+        while num_texts < self.max_batch_size:
+            try:
+                request = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            requests.append(request)
+            num_texts += len(request.texts)
+        return requests
+
+    def _run(self) -> None:
+        while True:
+            requests = self._next_requests()
+            texts = [text for request in requests for text in request.texts]
+            try:
+                # encode() sorts the texts by length, so each batch pads little
+                embeddings = self.model.encode(
+                    texts,
+                    batch_size=self.max_batch_size,
+                    normalize_embeddings=True,
+                    convert_to_numpy=True,
+                ).tolist()
+                self.num_batches += 1
+                start = 0
+                for request in requests:
+                    request.embeddings = embeddings[start : start + len(request.texts)]
+                    start += len(request.texts)
+            except Exception as e:
+                for request in requests:
+                    request.error = e
+
+            for request in requests:
+                request.done.set()
+
+
+def get_local_embedder(model: str) -> LocalEmbedder:
+    """The LangChain and Chroma wrappers of a model share one embedder"""
+    with _embedders_lock:
+        if model not in _embedders:
+            _embedders[model] = LocalEmbedder(model)
+        return _embedders[model]
+
+
+class LocalEmbeddings(Embeddings):
+    """LangChain embeddings backed by a LocalEmbedder"""
+
+    def __init__(self, embedder: LocalEmbedder) -> None:
+        self.embedder = embedder
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embedder.embed(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embedder.embed([text])[0]
+
+
+class LocalEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Chroma embedding function backed by a LocalEmbedder"""
+
+    def __init__(self, embedder: LocalEmbedder) -> None:
+        self.embedder = embedder
+
+    def __call__(self, input: Documents):
+        return self.embedder.embed(list(input))
@@ -3,30 +3,16 @@
 import os
 import sys
 
-from langchain_community.document_loaders import (
-    TextLoader,
-    WebBaseLoader,
-    # BSHTMLLoader,
-    # UnstructuredHTMLLoader,
-    # UnstructuredURLLoader,
-    Docx2txtLoader,
-    PyPDFLoader,
-)
-
+# The document loaders (langchain_community) are imported where they're used: they're
+# slow to import and most runs need at most one of them.
 # from langchain_unstructured import UnstructuredLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.docstore.document import Document
-
-from llama_parse import LlamaParse
+from langchain_core.documents import Document
 
 # from llama_index.core import SimpleDirectoryReader
 # from pandasai import SmartDataframe
 from uuid import uuid4
 from dotenv import load_dotenv, find_dotenv
-import chromadb
-import chromadb.utils.embedding_functions as chroma_ef
 import pandas as pd
 import re
 import requests
@@ -34,37 +20,48 @@ from bs4 import BeautifulSoup
 
 # from markdownify import markdownify
 import json
+import zlib
+import threading
 import pprint
 
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 import utils.print_utils as prnt
 import src.config as cfg
+import rag.chroma_registry as registry
+import rag.answer_cache as answer_cache
+import rag.lexical_index as lexical_index
+import rag.quantized_index as quantized_index
+import rag.source_parsing as source_parsing
+import rag.ingest_pipeline as ingest_pipeline
+import rag.ingest_manifest as ingest_manifest
+from rag.embedding_cache import content_hash
+from rag.embedding_scheduler import EmbeddingScheduler, release_chunks
 # import src.rag_query as rag
 
 """### Setup"""
 
 _ = load_dotenv(find_dotenv())
 
-openai_api_key = os.getenv("OPENAI_API_KEY")
-
-llama_parser = LlamaParse(
-    api_key=os.getenv("LLAMA_CLOUD_API_KEY"), result_type="markdown"
-)
-
-openai_embeddings = OpenAIEmbeddings(
-    model="text-embedding-3-small", api_key=openai_api_key
-)
-openai_ef = chroma_ef.OpenAIEmbeddingFunction(
-    api_key=openai_api_key, model_name="text-embedding-3-small"
-)
 
 curr_dir = os.path.dirname(__file__)
 DOCS_DIR = os.path.join(curr_dir, "..", "results", "leopard_scholar_1years", "pdf")
 RAG_DIR = os.path.join(curr_dir, "..", "rag")
 
-DEFAULT_PERSIST_DIR = str(os.path.join(curr_dir, "..", "test_db"))
-chromadb_client = chromadb.PersistentClient(path=DEFAULT_PERSIST_DIR)
+DEFAULT_PERSIST_DIR = str(cfg.VECTORDB_DIR)
+
+# the columns of a parsed-news CSV that are embedded, and how many rows are read at once
+CSV_COLUMNS = ["url", "content", "title", "date_serpapi", "source"]
+CSV_ROWS_PER_BATCH = 500
+# sources deleted per `$in` filter, SQLite limits the number of query parameters
+DELETE_BATCH_SIZE = 500
+# the load threads of an ingest share the set of CSV urls they've seen
+_seen_urls_lock = threading.Lock()
+
+# content-defined chunking: a chunk ends after a word whose hash (with the word before
+# it) is 0 modulo this, once the chunk is CDC_MIN_CHARS long
+CDC_MIN_CHARS = 500
+CDC_BOUNDARY_MODULUS = 128
 
 """### Loading"""
 
@@ -94,66 +91,12 @@ def load_single_source(
             prnt.prRed(f"Exception while loading {source}: {e}")
             return None
 
-    elif source.endswith(".txt"):
-        loader = TextLoader(filepath, encoding="utf-8")
-        try:
-            data = loader.load()
-        except Exception as e:
-            prnt.prRed(f"Exception while loading {source}: {e}")
+    elif source_parsing.can_parse(source):
+        pages, error = source_parsing.parse_file(source, filepath)
+        if error is not None:
+            prnt.prRed(f"Exception while loading {source}: {error}")
             return None
-
-        for idx, d in enumerate(data):
-            d.metadata["type"] = "text_file"
-            d.metadata["id"] = f"{source}_page-{idx}"
-            # for key, val in addnl_metadata.items():
-            #     d.metadata[key] = val
-
-    elif source.endswith(".xlsx") or source.endswith(".xls"):
-        sheet_tabs = None
-        prnt.prLightPurple(f"Loading Excel File: {source}")
-
-        try:
-            sheet_tabs = llama_parser.load_data(filepath)
-        except Exception as e:
-            prnt.prRed(f"Exception while loading {source}: {e}")
-            return None
-
-        prnt.prLightPurple(f"Sheet tabs length and type: {type(sheet_tabs)}")
-        # prnt.prLightPurple(f"\n{type(sheet_tabs[0])}\n{sheet_tabs[1]}")
-        print(f"\n{sheet_tabs[0].text}\n")
-        filename = source.split("/")[-1]
-        data = convert_sheet_tabs_to_langchain_docs(filename, sheet_tabs)
-        prnt.prLightPurple(f"Got {len(data)} LangChain docs.")
-
-    elif source.endswith(".docx"):
-        loader = Docx2txtLoader(filepath)
-        prnt.prLightPurple(f"Loading docx File: {source}")
-        try:
-            data = loader.load()
-        except Exception as e:
-            prnt.prRed(f"Exception while loading {source}: {e}")
-            return None
-
-        for idx, d in enumerate(data):
-            # print(d.page_content)
-            d.metadata["type"] = "docx_file"
-            d.metadata["id"] = f"{source}_page-{idx}"
-            # for key, val in addnl_metadata.items():
-            #     d.metadata[key] = val
-    elif source.endswith(".pdf"):
-        loader = PyPDFLoader(filepath)
-        try:
-            data = loader.load()
-        except Exception as e:
-            prnt.prRed(f"Exception while loading {source}: {e}")
-            return None
-
-        for idx, d in enumerate(data):
-            d.metadata["source"] = source
-            d.metadata["type"] = "pdf_file"
-            d.metadata["id"] = f"{source}_page-{idx}"
-            # for key, val in addnl_metadata.items():
-            #     d.metadata[key] = val
+        data = pages_to_docs(pages)
 
     # prnt.prLightPurple(f"\nLoaded:\nType: {type(data)}, Length: {len(data)}\nFirst page type: {type(data[0])}\nFirst page metadata: {data[0].metadata}")
 
@@ -165,6 +108,14 @@ def load_single_source(
     return data
 
 
+def pages_to_docs(pages: list, addnl_metadata: dict = {}) -> list:
+    """LangChain documents out of the (text, metadata) pages of source_parsing"""
+    return [
+        Document(page_content=text, metadata={**metadata, **addnl_metadata})
+        for text, metadata in pages
+    ]
+
+
 """### Add/Update Vector DB"""
 
 
@@ -194,93 +145,263 @@ def load_csv_row(
     return data
 
 
+def describe_source(data: list, filepath: str = None) -> dict:
+    """The ingest manifest fields of a loaded source: its text's hash, its file's mtime and size"""
+    info = {"content_hash": content_hash("\n".join(d.page_content for d in data))}
+    if filepath and os.path.exists(filepath):
+        stat = os.stat(filepath)
+        info.update(mtime=stat.st_mtime, size=stat.st_size)
+    return info
+
+
+def needs_embedding(
+    collection_name: str, source_name: str, filepath: str, update: bool
+) -> bool:
+    """
+    Whether a source has to be (re-)embedded: it isn't in the ingest manifest, or update
+    is set and its file's mtime or size changed since it was embedded
+    """
+    entry = ingest_manifest.get_entry(collection_name, source_name)
+    if entry is None:
+        return True
+    if not update:
+        return False
+    if filepath is None or entry["mtime"] is None or not os.path.exists(filepath):
+        return True
+    stat = os.stat(filepath)
+    return (stat.st_mtime, stat.st_size) != (entry["mtime"], entry["size"])
+
+
+def is_unchanged(collection_name: str, source_name: str, source_info: dict) -> bool:
+    """Whether a loaded source has the same text as when it was embedded"""
+    entry = ingest_manifest.get_entry(collection_name, source_name)
+    return entry is not None and entry["content_hash"] == source_info["content_hash"]
+
+
 def add_or_update_vectordb(
     data_to_add: list,
     collection_name: str,
-    embedded_sources: set,
     update: bool = False,
     addnl_metadata: dict = {},
     dir_name: str = None,
-):
+) -> list:
+    """
+    Embed the sources into the collection, skipping the ones that are already in its
+    ingest manifest. With update, the sources whose content changed are re-embedded:
+    only their new chunks are embedded and their removed chunks deleted.
+    Returns the sources that were embedded.
+
+    The sources go through a pipeline (rag/ingest_pipeline.py): INGEST_LOAD_WORKERS
+    threads load them (local files are parsed in a process pool, or in the thread if
+    there's only one), INGEST_CHUNK_WORKERS threads chunk them, and the embedding
+    scheduler embeds and upserts the chunks while the next sources are loaded.
+    """
     prnt.prPurple(f"\nAdding to vector db with update = {update}\n")
 
-    for source in data_to_add:
-        data = None
-        if source.endswith(".csv"):
-            df = pd.read_csv(os.path.join(dir_name, source))
-
-            for index, row in df.iterrows():
-                row_dict = row.to_dict()
-
-                url = row_dict["url"]
-                if url in embedded_sources:
-                    prnt.prLightPurple(f"Already embedded. Skipping: {url}")
-                    continue
-
-                prnt.prLightPurple(f"Loading row {index}")
-                data = load_csv_row(row_dict=row_dict, addnl_metadata=addnl_metadata)
-
-                if not data:
-                    prnt.prRed(f"Couldn't load {url}")
-                    continue
-
-                status = chunk_and_embed(url, data, collection_name)
-                if status == "success":
-                    embedded_sources.update({url})
-        elif "Abstract: " in source:
-            # an abstract has to be embedded
-            data = None
-
-            try:
-                # create langchain doc out of text
-                data = [Document(page_content=addnl_metadata["abstract"], metadata={})]
-                for idx, d in enumerate(data):
-                    d.metadata["source"] = source
-                    d.metadata["type"] = "plain_text"
-                    d.metadata["id"] = f"{source}_page-{idx}"
-                    # additional metadata fields
-                    for key, val in addnl_metadata.items():
-                        d.metadata[key] = val
-            except Exception as e:
-                prnt.prRed(f"Exception while trying to load an abstract: {e}")
+    # the chunks of all the sources are embedded in shared batches, and a source is
+    # recorded as embedded once the scheduler has stored all its chunks
+    scheduler = EmbeddingScheduler(collection_name)
+    seen_urls = set()
+
+    num_files = sum(source_parsing.can_parse(source) for source in data_to_add)
+    with source_parsing.ParsePool(num_files=num_files) as parse_pool:
+        stages = [
+            ingest_pipeline.Stage(
+                "load",
+                lambda source: load_source(
+                    source,
+                    collection_name,
+                    update=update,
+                    addnl_metadata=addnl_metadata,
+                    dir_name=dir_name,
+                    parse_pool=parse_pool,
+                    seen_urls=seen_urls,
+                ),
+                num_workers=cfg.INGEST_LOAD_WORKERS,
+                queue_size=cfg.INGEST_QUEUE_SIZE,
+            ),
+            ingest_pipeline.Stage(
+                "chunk",
+                chunk_loaded_sources,
+                num_workers=cfg.INGEST_CHUNK_WORKERS,
+                queue_size=cfg.INGEST_QUEUE_SIZE,
+            ),
+        ]
+        # scheduler.add blocks while the scheduler has as many batches as it can take
+        embed = ingest_pipeline.Stage(
+            "embed", lambda item: scheduler.add(*item), queue_size=cfg.INGEST_QUEUE_SIZE
+        )
+        stage_metrics = ingest_pipeline.run_pipeline(data_to_add, stages, embed)
 
-            if not data:
-                prnt.prRed(f"Couldn't load {url}")
-                continue
+    results = scheduler.close()
+    ingest_pipeline.print_metrics(stage_metrics)
 
-            status = chunk_and_embed(source, data, collection_name)
-            if status == "success":
-                embedded_sources.update({source})
+    return results["succeeded"]
 
+
+def load_abstract(source: str, addnl_metadata: dict) -> list:
+    """An abstract (addnl_metadata['abstract']) as a LangChain document"""
+    data = None
+
+    try:
+        # create langchain doc out of text
+        data = [Document(page_content=addnl_metadata["abstract"], metadata={})]
+        for idx, d in enumerate(data):
+            d.metadata["source"] = source
+            d.metadata["type"] = "plain_text"
+            d.metadata["id"] = f"{source}_page-{idx}"
+            # additional metadata fields
+            for key, val in addnl_metadata.items():
+                d.metadata[key] = val
+    except Exception as e:
+        prnt.prRed(f"Exception while trying to load an abstract: {e}")
+
+    return data
+
+
+def load_source(
+    source: str,
+    collection_name: str,
+    update: bool = False,
+    addnl_metadata: dict = {},
+    dir_name: str = None,
+    parse_pool: source_parsing.ParsePool = None,
+    seen_urls: set = None,
+):
+    """
+    The load stage of add_or_update_vectordb. Yields groups of loaded sources that need
+    embedding, as lists of (source name, documents, source_info, replace): one group for
+    a file, url or abstract, one per batch of rows for a CSV.
+    """
+    if source.endswith(".csv"):
+        yield from load_csv_rows(
+            os.path.join(dir_name, source),
+            collection_name,
+            addnl_metadata=addnl_metadata,
+            update=update,
+            seen_urls=seen_urls,
+        )
+        return
+
+    is_abstract = "Abstract: " in source
+    if is_abstract:
+        source_name, filepath = source, None
+    else:
+        source_name = source if source.startswith("http") else source.split("/")[-1]
+        filepath = os.path.join(dir_name or DOCS_DIR, source)
+    is_parsed = source_parsing.can_parse(source) and not is_abstract
+
+    if not needs_embedding(
+        collection_name, source_name, filepath if is_parsed else None, update
+    ):
+        prnt.prLightPurple(f"Already embedded. Skipping: {source_name}")
+        return
+
+    if is_abstract:
+        data = load_abstract(source, addnl_metadata)
+    elif is_parsed:
+        if parse_pool is not None:
+            pages, error = parse_pool.parse(source, filepath)
         else:
-            source_name = source if source.startswith("http") else source.split("/")[-1]
+            pages, error = source_parsing.parse_file(source, filepath)
+        print(f"\nParsed '{source}'")
+        if error is not None:
+            prnt.prRed(f"Exception while loading {source}: {error}")
+        data = pages_to_docs(pages, addnl_metadata) if pages else None
+    else:
+        data = load_single_source(source, filepath, addnl_metadata)
+
+    if not data:
+        prnt.prRed(f"Couldn't load {source}")
+        return
+
+    source_info = describe_source(data, filepath)
+    if update and is_unchanged(collection_name, source_name, source_info):
+        prnt.prLightPurple(f"Unchanged. Skipping: {source_name}")
+        return
+
+    yield [(source_name, data, source_info, update)]
 
-            # filename = source.split("/")[-1]
-            if (not update) and (source_name in embedded_sources):
-                prnt.prLightPurple(f"Already embedded. Skipping: {source_name}")
-                continue
 
-            filepath = None
-            if dir_name:
-                filepath = os.path.join(dir_name, source)
-            data = load_single_source(source, filepath, addnl_metadata)
+def read_csv_in_batches(filepath: str, rows_per_batch: int = CSV_ROWS_PER_BATCH):
+    """Yields the rows of a parsed-news CSV as lists of dicts, rows_per_batch at a time"""
+    with pd.read_csv(
+        filepath, chunksize=rows_per_batch, usecols=lambda c: c in CSV_COLUMNS
+    ) as reader:
+        for df in reader:
+            yield df.to_dict("records")
+
+
+def load_csv_rows(
+    filepath: str,
+    collection_name: str,
+    addnl_metadata: dict = {},
+    update: bool = False,
+    seen_urls: set = None,
+):
+    """
+    Yields the rows (one source per url) of a parsed-news CSV that need embedding, in
+    groups like load_source, one per batch of rows. The CSV is streamed, so memory
+    stays flat however big it is. With update, embedded rows whose text changed replace
+    their old chunks. seen_urls holds the urls already loaded in this ingest, rows with
+    any of them are skipped.
+    """
+    seen_urls = set() if seen_urls is None else seen_urls
+    num_rows, num_skipped = 0, 0
+    for rows in read_csv_in_batches(filepath):
+        embedded = ingest_manifest.embedded_among(
+            collection_name, [row_dict["url"] for row_dict in rows]
+        )
+        group = []
+        for row_dict in rows:
+            url = row_dict["url"]
+            with _seen_urls_lock:
+                seen = url in seen_urls
+                seen_urls.add(url)
+            if seen or (url in embedded and not update):
+                num_skipped += 1
+                continue
 
+            data = load_csv_row(row_dict=row_dict, addnl_metadata=addnl_metadata)
             if not data:
-                prnt.prRed(f"Couldn't load {source}")
+                prnt.prRed(f"Couldn't load {url}")
+                continue
+            source_info = describe_source(data)
+            if url in embedded and is_unchanged(collection_name, url, source_info):
+                num_skipped += 1
                 continue
 
-            status = chunk_and_embed(source, data, collection_name)
-            if status == "success":
-                embedded_sources.update({source_name})
+            group.append((url, data, source_info, url in embedded))
 
-    return embedded_sources
+        num_rows += len(rows)
+        prnt.prLightPurple(f"Loaded {num_rows} rows of {filepath}")
+        if group:
+            yield group
+
+    prnt.prLightPurple(
+        f"Skipped {num_skipped} rows that were already embedded as they are"
+    )
 
 
 """### Chunking"""
 
 
-def chunk_and_embed(source, data, collection_name: str) -> str:
-    chunks = create_chunks(data)
+def chunk_and_embed(
+    source,
+    data,
+    collection_name: str,
+    scheduler: EmbeddingScheduler = None,
+    source_name: str = None,
+    source_info: dict = None,
+    replace: bool = False,
+) -> str:
+    """
+    Chunk the loaded data of a source and embed the chunks. With a scheduler, the chunks
+    are queued in it under source_name (default: source) and "queued" is returned;
+    source_info goes into the source's ingest manifest entry, and with replace the
+    chunks replace the ones the source already has in the collection.
+    """
+    chunks = split_into_chunks(data)
 
     # chunks = create_chunks(docs)
     # print(f"Example chunk content: {chunks[0].page_content}\n")
@@ -295,10 +416,15 @@ def chunk_and_embed(source, data, collection_name: str) -> str:
     else:
         print(f"Got {len(chunks)} chunks for '{source}'")
 
-    for idx, c in enumerate(chunks):
-        c.metadata["id"] += f"_chunk-{idx}"
+    assign_chunk_ids(chunks)
     # chunks = add_chunk_headings(source, chunks)
 
+    if scheduler is not None:
+        scheduler.add(
+            source_name or source, chunks, source_info=source_info, replace=replace
+        )
+        return "queued"
+
     status = embed_and_store_chroma(chunks=chunks, collection_name=collection_name)
     if status != "success":
         prnt.prRed(f"Embedding of source {source} failed")
@@ -307,6 +433,134 @@ def chunk_and_embed(source, data, collection_name: str) -> str:
     return "success"
 
 
+def chunk_loaded_sources(group: list):
+    """
+    The chunk stage of add_or_update_vectordb: the documents of a group of loaded
+    sources (see load_source) are chunked in one call. Yields (source name, chunks,
+    source_info, replace) for every source.
+    """
+    chunks_by_source = chunk_sources([d for _, data, _, _ in group for d in data])
+
+    for source_name, data, source_info, replace in group:
+        # the documents' 'source' is the url, path or file name the loader gave them
+        chunks = chunks_by_source.get(data[0].metadata.get("source"))
+        if not chunks:
+            prnt.prRed(f"Error: No chunks created for {source_name}.")
+            continue
+        if len(group) == 1:
+            print(f"Got {len(chunks)} chunks for '{source_name}'")
+
+        yield source_name, chunks, source_info, replace
+
+
+def chunk_sources(docs: list) -> dict:
+    """
+    Chunk the documents of many sources in one call. Returns source -> its chunks, with
+    ids numbered per source like chunk_and_embed does.
+    """
+    chunks_by_source = {}
+    if not docs:
+        return chunks_by_source
+
+    for chunk in split_into_chunks(docs):
+        chunks_by_source.setdefault(chunk.metadata["source"], []).append(chunk)
+    for chunks in chunks_by_source.values():
+        assign_chunk_ids(chunks)
+
+    return chunks_by_source
+
+
+def split_into_chunks(docs: list, chunk_size: int = 1500) -> list:
+    """
+    create_stable_chunks or create_chunks, depending on cfg.CHUNKING. The row windows
+    of spreadsheets are already chunk-sized and stay whole, with their header row.
+    """
+    if cfg.CHUNKING == "content_defined":
+        chunker = create_stable_chunks
+    else:
+        chunker = create_chunks
+
+    chunks, to_split = [], []
+    for d in docs:
+        is_window = d.metadata.get("type") == "spreadsheet"
+        if is_window and len(d.page_content) <= chunk_size:
+            # the documents before it are split first, to keep the chunks in order
+            if to_split:
+                chunks += chunker(to_split, chunk_size=chunk_size)
+                to_split = []
+            chunks.append(
+                Document(page_content=d.page_content, metadata=dict(d.metadata))
+            )
+        else:
+            to_split.append(d)
+    if to_split:
+        chunks += chunker(to_split, chunk_size=chunk_size)
+
+    return chunks
+
+
+def assign_chunk_ids(chunks: list) -> None:
+    """
+    Give the chunks of one source their ids: '<page id>_chunk-<i>', with i the chunk's
+    position in the source, or with content-defined chunking '<page id>_chunk-h<hash>',
+    so that a chunk keeps its id when the text around it changes. The position is in
+    metadata['chunk_index'] either way.
+    """
+    seen_ids = set()
+    for idx, c in enumerate(chunks):
+        c.metadata["chunk_index"] = idx
+        if cfg.CHUNKING == "content_defined":
+            base_id = f"{c.metadata['id']}_chunk-h{content_hash(c.page_content)[:16]}"
+            chunk_id, repeat = base_id, 1
+            while chunk_id in seen_ids:
+                # the same text more than once on a page
+                repeat += 1
+                chunk_id = f"{base_id}-{repeat}"
+        else:
+            chunk_id = f"{c.metadata['id']}_chunk-{idx}"
+        c.metadata["id"] = chunk_id
+        seen_ids.add(chunk_id)
+
+
+def create_stable_chunks(
+    docs: list, chunk_size: int = 1500, min_chunk_size: int = CDC_MIN_CHARS
+) -> list:
+    """
+    Split the loaded text documents into content-defined chunks: the chunk boundaries
+    are picked by hashing the words, so they only depend on the text around them.
+    Editing a paragraph changes the chunks it's in, while create_chunks would shift
+    the boundaries of every chunk after it. The chunks don't overlap.
+    """
+    print(f"\n{'-' * 30}- CHUNKING {'-' * 30}")
+    chunks = []
+    for doc in docs:
+        current, size, previous_word = [], 0, ""
+
+        def end_chunk():
+            text = "".join(current).strip()
+            if text:
+                chunks.append(Document(page_content=text, metadata=dict(doc.metadata)))
+            current.clear()
+
+        for token in re.findall(r"\S+\s*", doc.page_content):
+            if current and size + len(token) > chunk_size:
+                end_chunk()
+                size = 0
+            current.append(token)
+            size += len(token)
+
+            word = token.rstrip()
+            boundary_hash = zlib.crc32(f"{previous_word} {word}".encode("utf-8"))
+            previous_word = word
+            if size >= min_chunk_size and boundary_hash % CDC_BOUNDARY_MODULUS == 0:
+                end_chunk()
+                size = 0
+        end_chunk()
+
+    prnt.prLightPurple(f"{len(docs)} docs have been split into {len(chunks)} chunks.")
+    return chunks
+
+
 def create_chunks(docs: list, chunk_size: int = 1500, chunk_overlap: int = 200):
     """Split the loaded text documents into smaller chunks"""
 
@@ -329,19 +583,17 @@ def embed_and_store_langchain(chunks: list, collection_name: str):
     """
     print(f"\n{'-' * 10}- EMBEDDING & STORING THE CHUNKS IN VECTOR DB {'-' * 10}")
 
-    global chromadb_client
-
-    vectordb = Chroma(
-        client=chromadb_client,
-        collection_name=collection_name,
-        embedding_function=openai_embeddings,
+    vectordb = registry.get_vectorstore(
+        collection_name=collection_name, embedding_function=cfg.get_embeddings()
     )
+    collection = registry.get_collection(collection_name, embedding_function=None)
+    settings = registry.get_vector_settings(collection)
 
     # uuids = [str(uuid4()) for _ in range(len(chunks))]
 
     # ids_added = vectordb.add_documents(documents=chunks, ids=uuids)
 
-    batch_size = 5461  # Maximum allowed batch size
+    batch_size = registry.get_client().get_max_batch_size()
     total_chunks = len(chunks)
     print(f"Total Chunks: {total_chunks}")
 
@@ -351,12 +603,44 @@ def embed_and_store_langchain(chunks: list, collection_name: str):
 
         uuids = [str(uuid4()) for _ in range(len(batch_chunks))]
 
-        ids_added = vectordb.add_documents(documents=batch_chunks, ids=uuids)
+        documents = [c.page_content for c in batch_chunks]
+        metadatas = [c.metadata for c in batch_chunks]
+
+        if settings["store"] == "quantized_index":
+            # Chroma only gets placeholders, the vectors go to the int8 index
+            embeddings = registry.shorten_embeddings(
+                cfg.get_embeddings().embed_documents(documents), settings["dimensions"]
+            )
+            collection.add(
+                ids=uuids,
+                embeddings=quantized_index.get_chroma_embeddings(settings, embeddings),
+                documents=documents,
+                metadatas=metadatas,
+            )
+            quantized_index.upsert_vectors(
+                collection_name, uuids, embeddings, metadatas
+            )
+            ids_added = uuids
+        else:
+            ids_added = vectordb.add_documents(documents=batch_chunks, ids=uuids)
+            if settings["quantization"] == "int8":
+                stored = collection.get(ids=uuids, include=["embeddings", "metadatas"])
+                quantized_index.upsert_vectors(
+                    collection_name,
+                    stored["ids"],
+                    stored["embeddings"],
+                    stored["metadatas"],
+                )
+        lexical_index.upsert_chunks(
+            collection_name, ids=uuids, documents=documents, metadatas=metadatas
+        )
 
         print(
             f"Batch {i // batch_size + 1}: Added {len(ids_added)} documents to the database."
         )
 
+    registry.invalidate(collection_name)
+    answer_cache.bump_collection_version(collection_name)
     print(f"After Count: {len(ids_added)}")
 
 
@@ -370,27 +654,17 @@ def embed_and_store_chroma(
     """
     print(f"\n{'-' * 10}- EMBEDDING & STORING THE CHUNKS IN VECTOR DB {'-' * 10}")
 
-    global chromadb_client
+    # batched to fit the embedding provider's and Chroma's limits
+    scheduler = EmbeddingScheduler(collection_name, record_in_manifest=False)
+    print(f"Before Count: {scheduler.collection.count()}")
 
-    # chromadb_client = chromadb.PersistentClient(path=persist_directory)
+    scheduler.add(collection_name, chunks)
+    results = scheduler.close()
+    print(f"After Count: {scheduler.collection.count()}")
 
-    collection = chromadb_client.get_or_create_collection(
-        name=collection_name, embedding_function=openai_ef
-    )
-    print(f"Before Count: {collection.count()}")
-
-    documents = [c.page_content for c in chunks]
-    metadatas = [c.metadata for c in chunks]
-    # ids = [str(uuid4()) for _ in range(len(chunks))]
-    ids = [c.metadata["id"] for c in chunks]
-
-    try:
-        collection.upsert(documents=documents, metadatas=metadatas, ids=ids)
-        print(f"After Count: {collection.count()}")
-    except Exception as e:
-        prnt.prRed(f"Upsert to collection failed due to: {e}")
-        print(f"After Count: {collection.count()}")
-        return e
+    if results["failed"]:
+        prnt.prRed("Upsert to collection failed")
+        return Exception(f"Embedding of {len(chunks)} chunks failed")
 
     return "success"
 
@@ -398,34 +672,94 @@ def embed_and_store_chroma(
 """### Delete Embeddings"""
 
 
-def delete_embeddings(
-    embedded_sources: set, data_to_delete: list, collection_name: str
-):
-    global chromadb_client
-
+def delete_embeddings(data_to_delete: list, collection_name: str) -> list:
+    """
+    Delete the chunks of the sources from the collection, DELETE_BATCH_SIZE sources per
+    `$in` filter; returns the sources found and deleted. A chunk that other sources'
+    duplicates point to (duplicate_sources) is kept and handed over to one of them.
+    """
     prnt.prPurple("\nDeleting from vector db")
 
-    collection = chromadb_client.get_or_create_collection(
-        name=collection_name, embedding_function=openai_ef
+    collection = registry.get_collection(
+        collection_name=collection_name,
+        embedding_function=cfg.get_chroma_embedding_function(),
+        create=True,
     )
-    prnt.prLightPurple(f"Before Count: {collection.count()}")
-
-    for source in data_to_delete:
-        source_name = source if source.startswith("http") else source.split("/")[-1]
-        print(f"Trying to delete {source_name}")
+    count_before = collection.count()
+    prnt.prLightPurple(f"Before Count: {count_before}")
 
+    source_names = list(
+        dict.fromkeys(
+            source if source.startswith("http") else source.split("/")[-1]
+            for source in data_to_delete
+        )
+    )
+    deleted = []
+    for i in range(0, len(source_names), DELETE_BATCH_SIZE):
+        batch = source_names[i : i + DELETE_BATCH_SIZE]
         try:
-            collection.delete(where={"source": source_name})
-            print(f"Deleted. New Count: {collection.count()}")
-            embedded_sources.remove(source_name)
+            found = delete_source_chunks(collection, collection_name, batch)
+            ingest_manifest.remove_sources(collection_name, found)
+            deleted += found
+            not_found = sorted(set(batch) - set(found))
+            if not_found:
+                prnt.prRed(f"No chunks found for {len(not_found)} sources: {not_found}")
         except Exception as e:
             prnt.prRed(f"Delete operation failed due to: {e}")
-            print(f"New Count: {collection.count()}")
-            # return e
 
-    prnt.prLightPurple(f"\nAfter Count: {collection.count()}")
+    registry.invalidate(collection_name)
+    answer_cache.bump_collection_version(collection_name)
+    count_after = collection.count()
+    prnt.prLightPurple(
+        f"\nDeleted {count_before - count_after} chunks of {len(deleted)} sources. "
+        f"After Count: {count_after}"
+    )
+
+    return deleted
+
+
+def delete_source_chunks(collection, collection_name: str, sources: list) -> list:
+    """
+    Delete the chunks of the sources from the collection and its side indexes, and
+    take the sources out of the duplicate_sources of the chunks their duplicates point
+    to. A chunk that other sources' duplicates point to is handed over to one of them
+    (see release_chunks). Returns the sources found: the ones with chunks stored under
+    their name, or a manifest entry none of whose chunks are stored (e.g. all its
+    chunks were duplicates). Others, like chunks stored under a file's path, are left.
+    """
+    results = collection.get(where={"source": {"$in": sources}}, include=["metadatas"])
+    found = {metadata["source"] for metadata in results["metadatas"]}
+    entries = ingest_manifest.get_entries(collection_name, sources)
+    unmatched_ids = sorted(
+        {
+            chunk_id
+            for source, entry in entries.items()
+            if source not in found
+            for chunk_id in entry["chunk_ids"]
+        }
+    )
+    stored_ids = set()
+    for i in range(0, len(unmatched_ids), DELETE_BATCH_SIZE):
+        batch = unmatched_ids[i : i + DELETE_BATCH_SIZE]
+        stored_ids.update(collection.get(ids=batch, include=[])["ids"])
+    for source, entry in entries.items():
+        if stored_ids.isdisjoint(entry["chunk_ids"]):
+            found.add(source)
+    found = [source for source in sources if source in found]
+
+    chunk_ids = set(results["ids"])
+    for source in found:
+        if source in entries:
+            chunk_ids.update(entries[source]["duplicate_of"])
+    num_deleted, num_handed_over = release_chunks(
+        collection, collection_name, dict.fromkeys(chunk_ids, set(found))
+    )
+    print(
+        f"Deleted {num_deleted} chunks of {len(found)} sources, "
+        f"handed over {num_handed_over}"
+    )
 
-    return embedded_sources
+    return found
 
 
 """### Misc"""
@@ -508,29 +842,6 @@ def load_url_markdown(url):
     return [doc]
 
 
-def convert_sheet_tabs_to_langchain_docs(filename, sheet_tabs):
-    prnt.prPurple(f"Converting sheet tabs to docs for: {filename}")
-    data = []
-
-    for idx, tab in enumerate(sheet_tabs):
-        matches = re.match(r"#([^\n]+)", tab.text)
-        tab_title = matches.group(1).strip() if matches else f"{filename}_tab{idx}"
-        print(tab_title)
-        data.append(
-            Document(
-                page_content=tab.text,
-                metadata={
-                    "source": filename,
-                    "title": tab_title,
-                    "type": "spreadsheet",
-                    "id": f"{filename}_{idx}",
-                },
-            )
-        )
-
-    return data
-
-
 # def update_metadata(data_to_update: list, collection_name: str):
 #     global chromadb_client
 
@@ -568,7 +879,7 @@ def test_loading_chunking(sources: list):
             print(f"\nContent: {d.page_content}\n")
             break
 
-        chunks = create_chunks(data)
+        chunks = split_into_chunks(data)
         if not chunks:
             print("Some error while chunking")
             continue
@@ -584,26 +895,15 @@ def test_loading_chunking(sources: list):
         break  # if you want to test only one source
 
 
-def add_update_docs(
-    data_to_add: list,
-    collection_name: str,
-    addnl_metadata: dict = {},
-    dir_name: str = None,
-    update: bool = False,
-):
-    """
-    source_type: could be 'scholar', 'google_news', etc.
-    """
-    # collection_name = "grassland_biodiversity_india_Jan2025_Jan2025_news"
-    print(f"Adding docs to collection: {collection_name}")
+def get_legacy_embedded_sources_csv(collection_name: str) -> str:
+    """Where add_update_docs kept a collection's embedded_sources.csv before the manifest"""
     parts = collection_name.split("_")
-    embedded_sources_filepath = None
     if parts and parts[-1] == "news":
-        embedded_sources_filepath = os.path.join(
+        dirname = os.path.join(
             cfg.RESULTS_DIR, "_".join(parts[:-3]), parts[-1], "_".join(parts[-2:-4:-1])
         )
     elif parts and parts[-1] == "scholar":
-        embedded_sources_filepath = os.path.join(
+        dirname = os.path.join(
             cfg.RESULTS_DIR,
             "_".join(parts[:-3]),  # topic
             parts[-1],  # news or scholar
@@ -611,51 +911,56 @@ def add_update_docs(
         )
     else:
         # the collection is for a weblink
-        embedded_sources_filepath = os.path.join(cfg.RESULTS_DIR, collection_name)
+        dirname = os.path.join(cfg.RESULTS_DIR, collection_name)
+
+    return os.path.join(dirname, "embedded_sources.csv")
+
+
+def add_update_docs(
+    data_to_add: list,
+    collection_name: str,
+    addnl_metadata: dict = {},
+    dir_name: str = None,
+    update: bool = False,
+):
+    """
+    source_type: could be 'scholar', 'google_news', etc.
+    """
+    print(f"Adding docs to collection: {collection_name}")
 
-    print(f"embedded_sources_filepath: {embedded_sources_filepath}")
+    if not ingest_manifest.exists(collection_name):
+        # a collection embedded before the ingest manifest existed
+        legacy_csv = get_legacy_embedded_sources_csv(collection_name)
+        if os.path.exists(legacy_csv):
+            ingest_manifest.import_embedded_sources_csv(collection_name, legacy_csv)
 
-    embedded_sources_df = pd.read_csv(
-        os.path.join(embedded_sources_filepath, "embedded_sources.csv")
-        # os.path.join(RAG_DIR, collection_name + "_embedded_sources.csv")
+    prnt.prPurple(
+        f"Num embedded sources at the start: {ingest_manifest.count(collection_name)}"
     )
-    embedded_sources = set(embedded_sources_df["Sources"].to_list())
-    prnt.prPurple(f"Num embedded sources at the start: {len(embedded_sources)}")
 
-    embedded_sources = add_or_update_vectordb(
+    add_or_update_vectordb(
         data_to_add=data_to_add,
         collection_name=collection_name,
-        embedded_sources=embedded_sources,
         update=update,
         addnl_metadata=addnl_metadata,
         dir_name=dir_name,
     )
 
-    # embedded_sources = delete_embeddings(embedded_sources, data_to_delete=urls1)
-
-    embedded_sources_df = pd.DataFrame(list(embedded_sources), columns=["Sources"])
-    embedded_sources_df.to_csv(
-        os.path.join(embedded_sources_filepath, "embedded_sources.csv"),
-        # os.path.join(RAG_DIR, collection_name + "_embedded_sources.csv"),
-        index=False,
+    prnt.prPurple(
+        f"\nNum embedded sources at the end: {ingest_manifest.count(collection_name)}"
     )
 
-    prnt.prPurple(f"\nNum embedded sources at the end: {len(embedded_sources)}")
-
 
 def delete_docs(data_to_delete: list, collection_name: str):
-    df = pd.read_csv(os.path.join(DOCS_DIR, "embedded_sources.csv"))
-    embedded_sources = set(df["Sources"].to_list())
-    prnt.prPurple(f"Num embedded sources at the start: {len(embedded_sources)}")
-
-    embedded_sources = delete_embeddings(
-        embedded_sources, data_to_delete, collection_name=collection_name
+    prnt.prPurple(
+        f"Num embedded sources at the start: {ingest_manifest.count(collection_name)}"
     )
 
-    df = pd.DataFrame(list(embedded_sources), columns=["Sources"])
-    df.to_csv(os.path.join(DOCS_DIR, "embedded_sources.csv"), index=False)
+    delete_embeddings(data_to_delete, collection_name=collection_name)
 
-    prnt.prPurple(f"\nNum embedded sources at the end: {len(embedded_sources)}")
+    prnt.prPurple(
+        f"\nNum embedded sources at the end: {ingest_manifest.count(collection_name)}"
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+def maximal_marginal_relevance(
+    query_embedding,
+    candidate_embeddings,
+    k: int = 5,
+    lambda_mult: float = 0.5,
+) -> list[int]:
+    """
+    Vectorized maximal marginal relevance over a pool of candidate embeddings.
+    Returns the indices of the selected candidates, in the order they were selected
+    (i.e. most relevant first).
+
+    All the pairwise similarities are computed with one matrix product, and the
+    similarity of every candidate to the selected set is updated incrementally, so
+    selecting k out of n candidates costs O(n^2 d + k n) instead of O(k^2 n d).
+    lambda_mult: 1 means pure relevance, 0 means maximum diversity.
+    """
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    if k <= 0 or candidates.ndim != 2 or len(candidates) == 0:
+        return []
+
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+
+    # cosine similarity = dot product of unit vectors
+    candidates = candidates / np.clip(
+        np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12, None
+    )
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    similarity_to_query = candidates @ query
+    pairwise_similarity = candidates @ candidates.T
+
+    first = int(np.argmax(similarity_to_query))
+    selected = [first]
+    available = np.ones(len(candidates), dtype=bool)
+    available[first] = False
+    max_similarity_to_selected = pairwise_similarity[first].copy()
+
+    while len(selected) < min(k, len(candidates)):
+        scores = (
+            lambda_mult * similarity_to_query
+            - (1 - lambda_mult) * max_similarity_to_selected
+        )
+        scores[~available] = -np.inf
+
+        idx = int(np.argmax(scores))
+        selected.append(idx)
+        available[idx] = False
+        np.maximum(
+            max_similarity_to_selected,
+            pairwise_similarity[idx],
+            out=max_similarity_to_selected,
+        )
+
+    return selected
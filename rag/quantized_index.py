@@ -0,0 +1,403 @@
+"""
+The vectors of the collections stored with "quantization": "int8"
+(EMBEDDING_QUANTIZATION / COLLECTION_VECTOR_SETTINGS in src/config.py), one SQLite file
+per collection. It is kept in sync by the ingest like the lexical index.
+
+Every vector is scaled so its largest component is 127, and rounded: a quarter of the
+bytes of the float32 vector. A search scans the int8 matrix (kept in memory, reloaded
+when the index has been written to) for the best INT8_RESCORE_FACTOR * n candidates,
+and rescores them with their float32 vectors, which stay on disk in the same file and
+are read for the candidates only. Chroma keeps the documents and metadatas of these
+collections ("store": "quantized_index"), with a placeholder vector per chunk, so
+its HNSW index is tiny and isn't loaded by the chat.
+
+To move the vectors of an existing collection into its int8 index (Chroma's copy of
+them is then dropped, see rebuild_from_chroma):
+python3 rag/quantized_index.py '{"collection_name": "leopard_news"}'
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+import src.config as cfg
+import rag.chroma_registry as registry
+import rag.answer_cache as answer_cache
+
+# rows of the int8 matrix converted to float32 at once during a scan
+SCAN_BLOCK_ROWS = 65_536
+SQL_BATCH_SIZE = 500
+# Chroma needs a vector per chunk, the collections whose vectors are kept here get this
+# one-dimensional one
+PLACEHOLDER_EMBEDDING = [1.0]
+
+_lock = threading.Lock()
+_connections = {}  # index file -> sqlite3.Connection
+_writes = {}  # index file -> writes through this process's connection
+_matrices = {}  # index file -> (version, ids, int8 matrix, scales)
+
+
+def get_index_path(collection_name: str) -> str:
+    return os.path.join(cfg.QUANTIZED_INDEX_DIR, f"{collection_name}.sqlite3")
+
+
+def _connect(collection_name: str) -> sqlite3.Connection:
+    path = os.path.abspath(get_index_path(collection_name))
+
+    with _lock:
+        conn = _connections.get(path)
+        if conn is not None:
+            return conn
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS vectors (
+                id TEXT PRIMARY KEY,
+                source TEXT,
+                scale REAL NOT NULL,
+                vector BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_vectors_source ON vectors (source);
+            -- the float32 vectors, in their own table so loading the int8 matrix
+            -- doesn't read them
+            CREATE TABLE IF NOT EXISTS embeddings (
+                id TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL
+            );
+            """
+        )
+        conn.commit()
+        _connections[path] = conn
+
+    return conn
+
+
+def quantize(embeddings) -> tuple:
+    """Returns the int8 vectors and the float32 scale of each (vector ~ int8 * scale)"""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127)
+    return quantized.astype(np.int8), scales
+
+
+def _write(collection_name: str, statements: list[tuple[str, list]]) -> None:
+    """Run each (statement, rows) with executemany, in one transaction"""
+    conn = _connect(collection_name)
+    path = os.path.abspath(get_index_path(collection_name))
+
+    with _lock:
+        with conn:
+            for statement, rows in statements:
+                conn.executemany(statement, rows)
+        _writes[path] = _writes.get(path, 0) + 1
+
+
+def get_chroma_embeddings(vector_settings: dict, embeddings) -> list:
+    """
+    The vectors to store in Chroma for these embeddings: placeholders if the collection
+    keeps its vectors here (registry.get_vector_settings(collection)["store"])
+    """
+    if vector_settings["store"] == "quantized_index":
+        return [PLACEHOLDER_EMBEDDING] * len(embeddings)
+    return embeddings
+
+
+def upsert_vectors(
+    collection_name: str, ids: list[str], embeddings, metadatas: list[dict]
+) -> None:
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    quantized, scales = quantize(vectors)
+    rows = [
+        (id_, (metadata or {}).get("source"), float(scale), vector.tobytes())
+        for id_, metadata, scale, vector in zip(ids, metadatas, scales, quantized)
+    ]
+    _write(
+        collection_name,
+        [
+            ("INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?)", rows),
+            (
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                [(id_, vector.tobytes()) for id_, vector in zip(ids, vectors)],
+            ),
+        ],
+    )
+
+
+def get_embeddings(collection_name: str, ids: list[str]) -> dict:
+    """id -> float32 vector, of the given ids that are stored with one"""
+    if not ids or not os.path.exists(get_index_path(collection_name)):
+        return {}
+
+    conn = _connect(collection_name)
+    embeddings = {}
+    for i in range(0, len(ids), SQL_BATCH_SIZE):
+        batch = ids[i : i + SQL_BATCH_SIZE]
+        with _lock:
+            rows = conn.execute(
+                "SELECT id, embedding FROM embeddings WHERE id IN "
+                f"({','.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+        embeddings.update(
+            (id_, np.frombuffer(blob, dtype=np.float32)) for id_, blob in rows
+        )
+    return embeddings
+
+
+def update_sources(
+    collection_name: str, ids: list[str], metadatas: list[dict]
+) -> None:
+    """Store the new 'source' of the vectors (e.g. of a chunk that was handed over)"""
+    if os.path.exists(get_index_path(collection_name)):
+        rows = [((m or {}).get("source"), id_) for id_, m in zip(ids, metadatas)]
+        _write(collection_name, [("UPDATE vectors SET source = ? WHERE id = ?", rows)])
+
+
+def delete_sources(collection_name: str, sources: list[str]) -> None:
+    if os.path.exists(get_index_path(collection_name)):
+        rows = [(s,) for s in sources]
+        _write(
+            collection_name,
+            [
+                (
+                    "DELETE FROM embeddings WHERE id IN "
+                    "(SELECT id FROM vectors WHERE source = ?)",
+                    rows,
+                ),
+                ("DELETE FROM vectors WHERE source = ?", rows),
+            ],
+        )
+
+
+def delete_ids(collection_name: str, ids: list[str]) -> None:
+    if os.path.exists(get_index_path(collection_name)):
+        rows = [(i,) for i in ids]
+        _write(
+            collection_name,
+            [
+                ("DELETE FROM embeddings WHERE id = ?", rows),
+                ("DELETE FROM vectors WHERE id = ?", rows),
+            ],
+        )
+
+
+def drop_collection(collection_name: str) -> None:
+    path = os.path.abspath(get_index_path(collection_name))
+
+    with _lock:
+        conn = _connections.pop(path, None)
+        if conn is not None:
+            conn.close()
+        _matrices.pop(path, None)
+
+    for suffix in ["", "-wal", "-shm"]:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def count(collection_name: str) -> int:
+    if not os.path.exists(get_index_path(collection_name)):
+        return 0
+
+    conn = _connect(collection_name)
+    with _lock:
+        return conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+
+def load(collection_name: str) -> tuple:
+    """
+    The index as (ids, int8 matrix, scales), read once and kept until the index is
+    written to, by this process or another one (SQLite's data_version)
+    """
+    conn = _connect(collection_name)
+    path = os.path.abspath(get_index_path(collection_name))
+
+    with _lock:
+        version = (conn.execute("PRAGMA data_version").fetchone()[0], _writes.get(path))
+        cached = _matrices.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1:]
+        rows = conn.execute("SELECT id, scale, vector FROM vectors").fetchall()
+
+    ids = [row[0] for row in rows]
+    scales = np.array([row[1] for row in rows], dtype=np.float32)
+    matrix = np.frombuffer(b"".join(row[2] for row in rows), dtype=np.int8)
+    matrix = matrix.reshape(len(rows), -1) if rows else matrix.reshape(0, 0)
+    del rows
+
+    with _lock:
+        _matrices[path] = (version, ids, matrix, scales)
+    return ids, matrix, scales
+
+
+def search(
+    collection_name: str, query_embedding, k: int, allowed_ids: list = None
+) -> list[str]:
+    """
+    The ids of the k vectors with the highest approximate dot product, best first,
+    among allowed_ids if given
+    """
+    ids, matrix, scales = load(collection_name)
+    if allowed_ids is not None:
+        allowed = set(allowed_ids)
+        rows = np.array([i for i, id_ in enumerate(ids) if id_ in allowed], dtype=int)
+        ids, matrix, scales = [ids[i] for i in rows], matrix[rows], scales[rows]
+    if not ids or k <= 0:
+        return []
+
+    query = np.asarray(query_embedding, dtype=np.float32)
+    scores = np.empty(len(ids), dtype=np.float32)
+    for start in range(0, len(ids), SCAN_BLOCK_ROWS):
+        block = matrix[start : start + SCAN_BLOCK_ROWS]
+        scores[start : start + len(block)] = block.astype(np.float32) @ query
+    scores *= scales
+
+    k = min(k, len(ids))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return [ids[i] for i in top[np.argsort(-scores[top])]]
+
+
+def query(
+    collection, collection_name: str, query_embedding, n_results: int, where=None
+) -> dict:
+    """
+    Nearest-neighbour search through the int8 index, with the best
+    INT8_RESCORE_FACTOR * n_results candidates rescored with their float32 vectors.
+    Returns the n_results best in the format of collection.query (one query, with
+    documents, metadatas, embeddings and Chroma's default squared L2 distances).
+    If the int8 index has fewer vectors than a collection that still keeps its vectors
+    in Chroma (the index isn't built yet, or its build was interrupted), Chroma's index
+    is searched instead.
+    """
+    num_indexed = (
+        len(load(collection_name)[0])
+        if os.path.exists(get_index_path(collection_name))
+        else 0
+    )
+    num_chunks = collection.count()
+    in_chroma = registry.get_vector_settings(collection)["store"] != "quantized_index"
+    if num_indexed < num_chunks and in_chroma:
+        prnt.prRed(
+            f"The int8 index of {collection_name} has {num_indexed} of its "
+            f"{num_chunks} vectors, searching Chroma's index (rebuild it with "
+            f"rag/quantized_index.py)"
+        )
+        return collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            where=where,
+            include=["documents", "metadatas", "embeddings", "distances"],
+        )
+    if num_indexed < num_chunks:
+        prnt.prRed(
+            f"The int8 index of {collection_name} has {num_indexed} of its "
+            f"{num_chunks} vectors, the others can't be found"
+        )
+
+    keys = ["ids", "documents", "metadatas", "embeddings", "distances"]
+    allowed_ids = collection.get(where=where, include=[])["ids"] if where else None
+    candidate_ids = search(
+        collection_name,
+        query_embedding,
+        n_results * cfg.INT8_RESCORE_FACTOR,
+        allowed_ids=allowed_ids,
+    )
+    if not candidate_ids:
+        return {key: [[]] for key in keys}
+
+    # documents and metadatas only: Chroma loads its HNSW index to return embeddings
+    results = collection.get(ids=candidate_ids, include=["documents", "metadatas"])
+    stored = get_embeddings(collection_name, results["ids"])
+    missing = [id_ for id_ in results["ids"] if id_ not in stored]
+    if missing and in_chroma:
+        # indexes written before the float32 vectors were kept here
+        chroma = collection.get(ids=missing, include=["embeddings"])
+        stored.update(zip(chroma["ids"], chroma["embeddings"]))
+    found = [i for i, id_ in enumerate(results["ids"]) if id_ in stored]
+    if not found:
+        return {key: [[]] for key in keys}
+
+    embeddings = np.asarray(
+        [stored[results["ids"][i]] for i in found], dtype=np.float32
+    )
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    distances = ((embeddings - query_vector) ** 2).sum(axis=1)
+
+    best = np.argsort(distances)[:n_results]
+    return {
+        "ids": [[results["ids"][found[i]] for i in best]],
+        "documents": [[results["documents"][found[i]] for i in best]],
+        "metadatas": [[results["metadatas"][found[i]] for i in best]],
+        "embeddings": [[embeddings[i] for i in best]],
+        "distances": [[float(distances[i]) for i in best]],
+    }
+
+
+def rebuild_from_chroma(collection_name: str, page_size: int = 1000) -> int:
+    """
+    Move the vectors of a collection from Chroma into its int8 index: they're copied
+    into the index, the collection is marked as quantized so the chat searches the
+    index, then it's rebuilt with placeholder vectors (rebuild_collection), which
+    shrinks Chroma's HNSW index to almost nothing. If it's run again after an
+    interruption, the vectors already moved aren't copied again.
+    """
+    # rag.chromadb_utils imports this module
+    import rag.chromadb_utils as chromadb_utils
+
+    collection = registry.get_client().get_collection(
+        name=collection_name, embedding_function=None
+    )
+
+    if registry.get_vector_settings(collection)["store"] != "quantized_index":
+        drop_collection(collection_name)
+        offset = 0
+        while True:
+            page = collection.get(
+                limit=page_size, offset=offset, include=["embeddings", "metadatas"]
+            )
+            if not len(page["ids"]):
+                break
+
+            upsert_vectors(
+                collection_name, page["ids"], page["embeddings"], page["metadatas"]
+            )
+            offset += page_size
+
+        # Chroma doesn't allow the hnsw settings to be passed again
+        metadata = {
+            key: val
+            for key, val in (collection.metadata or {}).items()
+            if not key.startswith("hnsw:")
+        }
+        collection.modify(
+            metadata={
+                **metadata,
+                "embedding_quantization": "int8",
+                "embedding_store": "quantized_index",
+            }
+        )
+        registry.invalidate(collection_name)
+        answer_cache.bump_collection_version(collection_name)
+
+    sample = collection.get(limit=1, include=["embeddings"])["embeddings"]
+    if len(sample) and len(sample[0]) != len(PLACEHOLDER_EMBEDDING):
+        chromadb_utils.rebuild_collection(collection_name)
+
+    num_indexed = count(collection_name)
+    prnt.prLightPurple(f"Indexed {num_indexed} int8 vectors of {collection_name}")
+    return num_indexed
+
+
+if __name__ == "__main__":
+    inputs = json.loads(sys.argv[1])
+    rebuild_from_chroma(inputs["collection_name"])
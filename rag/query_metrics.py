@@ -0,0 +1,274 @@
+"""
+Per-stage latency metrics of the query path (opening collections, query embedding,
+vector/BM25 search, MMR, context packing, prompt assembly, the LLM call).
+
+Every stage timed with `timed(...)` is recorded in a process-wide histogram, which can be
+read with `summary()` (p50/p95/p99), written to a Prometheus text file with
+`write_metrics_file()`, or served at http://localhost:<port>/metrics with
+`start_metrics_server(port)`. Inside `with trace_request() as trace:` the stages of that
+one request are also collected in `trace`.
+"""
+
+import os
+import sys
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+import src.config as cfg
+
+# upper bounds of the Prometheus histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# recent samples kept per stage to compute the percentiles
+MAX_SAMPLES = 10_000
+METRICS_FILE = "query_metrics.prom"
+
+
+class StageHistogram:
+    def __init__(self) -> None:
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=MAX_SAMPLES)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.sum += seconds
+        self.samples.append(seconds)
+        for i, upper_bound in enumerate(BUCKETS):
+            if seconds <= upper_bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def percentile(self, pct: float) -> float:
+        """Nearest-rank percentile of the recent samples, pct in [0, 100]"""
+        if not self.samples:
+            return 0.0
+
+        ordered = sorted(self.samples)
+        rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+        return ordered[rank]
+
+
+class Trace:
+    """The timed stages of one request, in the order they started"""
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.total = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(
+        self, stage: str, started: float, seconds: float, detail: str = None
+    ) -> None:
+        span = {"stage": stage, "start": started - self.start, "seconds": seconds}
+        if detail:
+            span["detail"] = detail
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self) -> None:
+        self.total = time.perf_counter() - self.start
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start"])
+        total = self.total
+        if total is None:
+            total = time.perf_counter() - self.start
+        return {
+            "total_seconds": round(total, 4),
+            "stages": [
+                {**s, "start": round(s["start"], 4), "seconds": round(s["seconds"], 4)}
+                for s in spans
+            ],
+        }
+
+
+_lock = threading.Lock()
+_histograms = {}  # stage -> StageHistogram
+_current_trace = contextvars.ContextVar("query_trace", default=None)
+_last_file_write = 0.0
+
+
+def observe(
+    stage: str, seconds: float, started: float = None, detail: str = None
+) -> None:
+    """Record how long a stage took. `started` is its time.perf_counter() at the start"""
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = StageHistogram()
+        histogram.observe(seconds)
+
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(
+            stage,
+            started if started is not None else time.perf_counter() - seconds,
+            seconds,
+            detail,
+        )
+
+
+@contextmanager
+def timed(stage: str, detail: str = None):
+    """
+    with timed("embed_query"):
+        ...
+    detail (e.g. the collection name) only shows up in traces, not in the histograms
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started, started, detail)
+
+
+@contextmanager
+def trace_request():
+    """Collect the stages timed inside the block (in this thread) in a Trace"""
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+        _current_trace.reset(token)
+
+
+def submit(executor, fn, *args):
+    """
+    executor.submit that keeps the current trace, so that stages timed in the worker
+    thread show up in the trace of the request that submitted them
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def summary() -> dict:
+    """stage -> count, mean, p50, p95, p99 (in seconds)"""
+    with _lock:
+        return {
+            stage: {
+                "count": h.count,
+                "mean": h.sum / h.count if h.count else 0.0,
+                "p50": h.percentile(50),
+                "p95": h.percentile(95),
+                "p99": h.percentile(99),
+            }
+            for stage, h in sorted(_histograms.items())
+        }
+
+
+def print_summary() -> None:
+    prnt.prYellow("\nQuery path latency per stage (seconds)")
+    for stage, s in summary().items():
+        print(
+            f"{stage:<20} n={s['count']:<6} mean={s['mean']:.3f}  p50={s['p50']:.3f}  "
+            f"p95={s['p95']:.3f}  p99={s['p99']:.3f}"
+        )
+
+
+def to_prometheus_text() -> str:
+    """All the histograms and their percentiles in the Prometheus text exposition format"""
+    lines = [
+        "# HELP rag_query_stage_seconds Latency of the stages of the RAG query path.",
+        "# TYPE rag_query_stage_seconds histogram",
+    ]
+    with _lock:
+        histograms = sorted(_histograms.items())
+        for stage, h in histograms:
+            cumulative = 0
+            for upper_bound, bucket_count in zip(BUCKETS, h.bucket_counts):
+                cumulative += bucket_count
+                lines.append(
+                    f'rag_query_stage_seconds_bucket{{stage="{stage}",le="{upper_bound}"}} {cumulative}'
+                )
+            lines += [
+                f'rag_query_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}',
+                f'rag_query_stage_seconds_sum{{stage="{stage}"}} {h.sum:.6f}',
+                f'rag_query_stage_seconds_count{{stage="{stage}"}} {h.count}',
+            ]
+
+        lines += [
+            "# HELP rag_query_stage_seconds_recent Percentiles of the recent latencies of each stage.",
+            "# TYPE rag_query_stage_seconds_recent gauge",
+        ]
+        for stage, h in histograms:
+            for quantile, pct in [("0.5", 50), ("0.95", 95), ("0.99", 99)]:
+                lines.append(
+                    f'rag_query_stage_seconds_recent{{stage="{stage}",quantile="{quantile}"}} {h.percentile(pct):.6f}'
+                )
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path: str = None) -> str:
+    """Write the metrics to a Prometheus text file (e.g. for node_exporter's textfile collector)"""
+    path = path or os.path.join(cfg.CACHE_DIR, METRICS_FILE)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    # write-then-rename, so a scraper never reads a half-written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(to_prometheus_text())
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def maybe_write_metrics_file(min_interval: float = 10.0) -> None:
+    """write_metrics_file, at most once every min_interval seconds"""
+    global _last_file_write
+
+    with _lock:
+        now = time.time()
+        if now - _last_file_write < min_interval:
+            return
+        _last_file_write = now
+
+    try:
+        write_metrics_file()
+    except OSError as e:
+        prnt.prRed(f"Could not write the query metrics file: {e}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+
+        body = to_prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve the metrics at http://host:port/metrics from a daemon thread (once per process)"""
+    global _server
+
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(
+                target=_server.serve_forever, name="query-metrics", daemon=True
+            ).start()
+            prnt.prLightPurple(f"Serving query metrics at http://{host}:{port}/metrics")
+
+    return _server
@@ -0,0 +1,167 @@
+"""
+Parsing of local files (PDF, docx, text, spreadsheets) into page texts, in a pool of
+worker processes. Spreadsheets are split into row windows (rag/spreadsheet_parsing.py).
+
+Parsing PDFs is CPU-bound, so a folder of hundreds of them is parsed on all cores
+instead of one. Workers return the pages as compact (text, metadata) tuples rather
+than pickled LangChain documents. parse_files yields the results in the order the
+files were given; ParsePool parses files for the load threads of the ingest pipeline.
+
+Kept free of heavy imports: every worker process imports this module.
+"""
+
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import src.config as cfg
+from rag.spreadsheet_parsing import parse_spreadsheet
+
+# extension -> document type recorded in the metadata
+PARSED_TYPES = {
+    ".txt": "text_file",
+    ".docx": "docx_file",
+    ".pdf": "pdf_file",
+    ".xlsx": "spreadsheet",
+    ".xls": "spreadsheet",
+}
+
+
+def can_parse(source: str) -> bool:
+    return not source.startswith("http") and source.endswith(tuple(PARSED_TYPES))
+
+
+def parse_file(source: str, filepath: str) -> tuple:
+    """
+    Returns (pages, error): pages is a list of (text, metadata), or None if the file
+    couldn't be parsed, in which case error says why
+    """
+    try:
+        if source.endswith((".xlsx", ".xls")):
+            return parse_spreadsheet(source, filepath), None
+        elif source.endswith(".txt"):
+            from langchain_community.document_loaders import TextLoader
+
+            loader = TextLoader(filepath, encoding="utf-8")
+        elif source.endswith(".docx"):
+            from langchain_community.document_loaders import Docx2txtLoader
+
+            loader = Docx2txtLoader(filepath)
+        else:
+            from langchain_community.document_loaders import PyPDFLoader
+
+            loader = PyPDFLoader(filepath)
+        docs = loader.load()
+    except Exception as e:
+        return None, str(e)
+
+    doc_type = PARSED_TYPES[os.path.splitext(source)[1]]
+    # the loaders' 'source' is the file's path, chunks are stored by the file's name
+    filename = source.split("/")[-1]
+    pages = []
+    for idx, d in enumerate(docs):
+        metadata = dict(d.metadata)
+        metadata["source"] = filename
+        metadata["type"] = doc_type
+        metadata["id"] = f"{source}_page-{idx}"
+        pages.append((d.page_content, metadata))
+
+    return pages, None
+
+
+def make_executor(max_workers: int) -> ProcessPoolExecutor:
+    """
+    A process pool whose workers are replaced after cfg.PARSE_TASKS_PER_WORKER files,
+    to give back the memory the parsers hold on to
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers, max_tasks_per_child=cfg.PARSE_TASKS_PER_WORKER
+    )
+
+
+class ParsePool:
+    """
+    Worker processes that parse files for any number of threads: parse() blocks the
+    calling thread until its file is parsed. If a worker dies (e.g. out of memory), the
+    files it was parsing fail and the pool is restarted for the next ones. Like
+    parse_files, there are at most as many workers as num_files, and with one the files
+    are parsed in the calling thread: starting a worker costs more than most files.
+    Use as a context manager.
+    """
+
+    def __init__(self, max_workers: int = None, num_files: int = None) -> None:
+        self.max_workers = max_workers or cfg.PARSE_WORKERS or os.cpu_count()
+        if num_files is not None:
+            self.max_workers = min(self.max_workers, num_files)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = make_executor(self.max_workers)
+            return self._executor
+
+    def parse(self, source: str, filepath: str) -> tuple:
+        """(pages, error), see parse_file"""
+        if self.max_workers <= 1:
+            return parse_file(source, filepath)
+
+        executor = self._get_executor()
+        try:
+            return executor.submit(parse_file, source, filepath).result()
+        except BrokenProcessPool as e:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            return None, str(e)
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+def parse_files(files: list, max_workers: int = None):
+    """
+    Yields (source, pages, error) for every (source, filepath) in files, in order (see
+    parse_file). Up to two files per worker are parsed ahead of the consumer, so the
+    parsed pages waiting in memory stay bounded.
+    """
+    max_workers = min(max_workers or cfg.PARSE_WORKERS or os.cpu_count(), len(files))
+    if max_workers <= 1:
+        for source, filepath in files:
+            yield (source, *parse_file(source, filepath))
+        return
+
+    with make_executor(max_workers) as executor:
+        pending = deque()
+        files = iter(files)
+        for source, filepath in files:
+            pending.append((source, executor.submit(parse_file, source, filepath)))
+            if len(pending) >= 2 * max_workers:
+                break
+
+        while pending:
+            source, future = pending.popleft()
+            next_file = next(files, None)
+            if next_file is not None:
+                pending.append((next_file[0], executor.submit(parse_file, *next_file)))
+            try:
+                pages, error = future.result()
+            except Exception as e:
+                # the worker died (e.g. out of memory)
+                pages, error = None, str(e)
+            yield source, pages, error
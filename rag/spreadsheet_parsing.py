@@ -0,0 +1,269 @@
+"""
+Local parsing of spreadsheets (.xlsx with openpyxl, .xls with xlrd) into row windows:
+runs of consecutive rows of a sheet, as a markdown table under the sheet's name and
+header row. A window fits in one chunk, so every chunk keeps the header of its rows; a
+row too long for a window is split into pieces that each get the header.
+
+Rows are streamed (openpyxl's read-only mode, xlrd's on-demand sheets), and so are the
+windows, so a workbook is never held in memory as cell objects. Like content-defined
+chunks, a window ends after a row whose hash is 0 modulo WINDOW_BOUNDARY_MODULUS once
+it's WINDOW_MIN_CHARS long: inserting rows only changes the windows they're in, and the
+update of a spreadsheet re-embeds little.
+
+The windows of a file are cached in CACHE_DIR/spreadsheets by the hash of its bytes, one
+JSON line per window, so an unchanged workbook (or the same one added to another
+collection) isn't parsed again. The least recently used files are deleted when the
+cache outgrows SPREADSHEET_CACHE_MAX_MB.
+"""
+
+import os
+import sys
+import json
+import zlib
+import hashlib
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import src.config as cfg
+
+CACHE_SUBDIR = "spreadsheets"
+# part of the cache key, bump it when the windows change
+PARSER_VERSION = 2
+# the cache is pruned down to this fraction of SPREADSHEET_CACHE_MAX_MB
+CACHE_EVICT_TO_FRACTION = 0.9
+
+# the chunk size, and the content-defined window boundaries (see create_stable_chunks)
+WINDOW_MAX_CHARS = 1500
+WINDOW_MIN_CHARS = 500
+WINDOW_BOUNDARY_MODULUS = 8
+
+
+def file_hash(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def format_cell(value) -> str:
+    """A cell's value as text that fits in a markdown table cell"""
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime) and value.time() == datetime.time():
+        value = value.date()
+    if isinstance(value, (datetime.date, datetime.time)):
+        text = value.isoformat()
+    elif isinstance(value, float) and value.is_integer():
+        text = str(int(value))
+    else:
+        text = str(value)
+    return " ".join(text.split()).replace("|", "\\|")
+
+
+def _xls_rows(book, sheet):
+    import xlrd
+
+    for row_idx in range(sheet.nrows):
+        yield [
+            (
+                xlrd.xldate_as_datetime(cell.value, book.datemode)
+                if cell.ctype == xlrd.XL_CELL_DATE
+                else cell.value
+            )
+            for cell in sheet.row(row_idx)
+        ]
+
+
+def iter_sheets(filepath: str):
+    """Yields (sheet name, iterator over its rows as lists of values)"""
+    if filepath.endswith(".xls"):
+        import xlrd
+
+        book = xlrd.open_workbook(filepath, on_demand=True)
+        try:
+            for sheet_name in book.sheet_names():
+                yield sheet_name, _xls_rows(book, book.sheet_by_name(sheet_name))
+                book.unload_sheet(sheet_name)
+        finally:
+            book.release_resources()
+    else:
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            for worksheet in workbook.worksheets:
+                yield worksheet.title, worksheet.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+
+
+def split_line(line: str, max_chars: int) -> list[str]:
+    """Pieces of a line of at most max_chars, cut between words where possible"""
+    pieces = []
+    while len(line) > max_chars:
+        cut = line.rfind(" ", 0, max_chars + 1)
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(line[:cut])
+        line = line[cut:].lstrip()
+    if line:
+        pieces.append(line)
+    return pieces
+
+
+def make_windows(sheet_name: str, rows):
+    """
+    Yields the row windows of a sheet: its first non-empty row is the header, empty
+    rows are skipped. A window is a dict with 'sheet', 'window' (its position in the
+    sheet), 'rows' (first-last, as numbered in the sheet) and 'text'.
+    """
+    header_text, lines, size, first_row, last_row = None, [], 0, None, None
+    num_windows = 0
+
+    def make_window(text, rows):
+        nonlocal num_windows
+        num_windows += 1
+        return {
+            "sheet": sheet_name,
+            "window": num_windows - 1,
+            "rows": rows,
+            "text": header_text + text,
+        }
+
+    for row_number, row in enumerate(rows, start=1):
+        cells = [format_cell(value) for value in row]
+        while cells and not cells[-1]:
+            cells.pop()
+        if not cells:
+            continue
+
+        if header_text is None:
+            names = [name or f"column {i + 1}" for i, name in enumerate(cells)]
+            header_text = (
+                f"Sheet: {sheet_name}\n\n| {' | '.join(names)} |\n"
+                f"|{' --- |' * len(names)}\n"
+            )
+            num_columns = len(names)
+            continue
+
+        cells += [""] * (num_columns - len(cells))
+        line = f"| {' | '.join(cells)} |"
+        if lines and size + len(line) > WINDOW_MAX_CHARS:
+            yield make_window("\n".join(lines), f"{first_row}-{last_row}")
+            lines = []
+        if len(header_text) + len(line) > WINDOW_MAX_CHARS:
+            # a row that doesn't fit in a window of its own, or a header that leaves
+            # little room (the chunker splits those windows further)
+            max_chars = max(WINDOW_MAX_CHARS - len(header_text), WINDOW_MIN_CHARS)
+            for piece in split_line(line, max_chars):
+                yield make_window(piece, f"{row_number}-{row_number}")
+            continue
+
+        if not lines:
+            first_row, size = row_number, len(header_text)
+        lines.append(line)
+        size += len(line) + 1
+        last_row = row_number
+
+        boundary_hash = zlib.crc32(line.encode("utf-8"))
+        if size >= WINDOW_MIN_CHARS and boundary_hash % WINDOW_BOUNDARY_MODULUS == 0:
+            yield make_window("\n".join(lines), f"{first_row}-{last_row}")
+            lines = []
+    if lines:
+        yield make_window("\n".join(lines), f"{first_row}-{last_row}")
+
+
+def get_cache_dir() -> str:
+    return os.path.join(cfg.CACHE_DIR, CACHE_SUBDIR)
+
+
+def prune_cache(max_mb: float = None) -> int:
+    """
+    If the cached windows take more than max_mb (default SPREADSHEET_CACHE_MAX_MB),
+    delete the least recently used files until they take CACHE_EVICT_TO_FRACTION of
+    it; returns how many were deleted
+    """
+    cache_dir = get_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    max_bytes = (max_mb or cfg.SPREADSHEET_CACHE_MAX_MB) * 1024 * 1024
+    files = []  # (last used, bytes, path)
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    size = sum(file_size for _, file_size, _ in files)
+    if size <= max_bytes:
+        return 0
+
+    num_deleted = 0
+    for _, file_size, path in sorted(files):
+        if size <= max_bytes * CACHE_EVICT_TO_FRACTION:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # pruned by another worker
+            pass
+        size -= file_size
+        num_deleted += 1
+    return num_deleted
+
+
+def load_windows(filepath: str):
+    """
+    Yields the row windows of all the sheets of a workbook, read from the cache if
+    they're there, and written to it as they're made otherwise
+    """
+    key = (
+        f"{file_hash(filepath)}_v{PARSER_VERSION}_{WINDOW_MAX_CHARS}_"
+        f"{WINDOW_MIN_CHARS}_{WINDOW_BOUNDARY_MODULUS}"
+    )
+    cache_file = os.path.join(get_cache_dir(), f"{key}.jsonl")
+    try:
+        f = open(cache_file, encoding="utf-8")
+    except FileNotFoundError:
+        pass
+    else:
+        with f:
+            # its modification time is when it was last used, for prune_cache
+            os.utime(cache_file)
+            for line in f:
+                yield json.loads(line)
+        return
+
+    # written whole then renamed, parse workers may write the same file at once
+    os.makedirs(get_cache_dir(), exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for sheet_name, rows in iter_sheets(filepath):
+                for window in make_windows(sheet_name, rows):
+                    f.write(json.dumps(window) + "\n")
+                    yield window
+        os.replace(tmp_file, cache_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    prune_cache()
+
+
+def parse_spreadsheet(source: str, filepath: str) -> list:
+    """The (text, metadata) pages of a spreadsheet, one per row window"""
+    filename = source.split("/")[-1]
+    return [
+        (
+            window["text"],
+            {
+                "source": filename,
+                "title": window["sheet"],
+                "sheet": window["sheet"],
+                "rows": window["rows"],
+                "type": "spreadsheet",
+                "id": f"{filename}_{window['sheet']}_window-{window['window']}",
+            },
+        )
+        for window in load_windows(filepath)
+    ]
@@ -0,0 +1,76 @@
+"""
+Answer a file of questions against a set of collections, concurrently.
+
+Usage:
+python3 src/batch_answer.py '{"questions_file": "rag/leopard_questions.csv", "collection_names": ["leopards_research_articles"], "max_concurrency": 8}'
+
+- questions_file: a CSV with a 'Question' column, or a JSONL file with a 'question' key per line.
+- Instead of collection_names, 'data_source' and 'collection_name_prefix' can be given, like for src/rag_query.py.
+- output_file (optional): defaults to '<questions_file without extension>_answers.<csv|jsonl>'.
+  Progress is checkpointed next to it in '<output_file>.checkpoint.jsonl'; rerun the same command to resume.
+"""
+
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import pandas as pd
+import utils.print_utils as prnt
+import src.rag_query as rag
+
+
+def load_questions(questions_file: str) -> list[str]:
+    if questions_file.endswith(".jsonl"):
+        with open(questions_file, "r", encoding="utf-8") as f:
+            return [json.loads(line)["question"] for line in f if line.strip()]
+
+    return pd.read_csv(questions_file)["Question"].to_list()
+
+
+def save_answers(questions: list[str], answers: list[str], output_file: str) -> None:
+    if output_file.endswith(".jsonl"):
+        with open(output_file, "w", encoding="utf-8") as f:
+            for question, answer in zip(questions, answers):
+                f.write(json.dumps({"question": question, "answer": answer}) + "\n")
+    else:
+        pd.DataFrame({"Question": questions, "Answers": answers}).to_csv(
+            output_file, index=False
+        )
+
+    print(f"Saved {len(answers)} answers to {output_file}")
+
+
+if __name__ == "__main__":
+    print("Arguments received:", sys.argv[1])
+    inputs = json.loads(sys.argv[1])
+
+    questions_file = inputs["questions_file"]
+    collection_names = inputs.get("collection_names") or rag.get_collection_names(
+        inputs["data_source"], inputs["collection_name_prefix"]
+    )
+    extension = ".jsonl" if questions_file.endswith(".jsonl") else ".csv"
+    output_file = inputs.get(
+        "output_file", os.path.splitext(questions_file)[0] + "_answers" + extension
+    )
+
+    questions = load_questions(questions_file)
+    prnt.prPurple(f"Loaded {len(questions)} questions, collections: {collection_names}")
+
+    start = time.time()
+    answers = rag.rag_langchain_batch(
+        queries=questions,
+        collection_names=collection_names,
+        max_concurrency=inputs.get("max_concurrency", 5),
+        checkpoint_path=output_file + ".checkpoint.jsonl",
+    )
+    save_answers(questions, answers, output_file)
+
+    num_missing = sum(1 for answer in answers if answer is None)
+    if num_missing:
+        prnt.prRed(f"{num_missing} questions have no answer yet, rerun to retry them.")
+
+    print(f"Total time taken: {time.time() - start} seconds")
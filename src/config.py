@@ -1,6 +1,6 @@
 # config.py
 import os
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+import threading
 from dotenv import load_dotenv
 
 _ = load_dotenv()
@@ -8,6 +8,12 @@ _ = load_dotenv()
 curr_dir = os.path.dirname(__file__)
 RESULTS_DIR = os.path.join(curr_dir, "..", "results")
 RAG_DIR = os.path.join(curr_dir, "..", "rag")
+VECTORDB_DIR = os.path.join(curr_dir, "..", "test_db")
+CACHE_DIR = os.path.join(curr_dir, "..", "cache")
+LEXICAL_INDEX_DIR = os.path.join(curr_dir, "..", "lexical_index")
+INGEST_MANIFEST_DIR = os.path.join(curr_dir, "..", "ingest_manifest")
+LOCAL_EMBEDDINGS_DIR = os.path.join(curr_dir, "..", "embedding_models")
+QUANTIZED_INDEX_DIR = os.path.join(curr_dir, "..", "quantized_index")
 
 google_news_inputs = {
     "keyphrase": "leopard india",
@@ -31,6 +37,121 @@ LLM_MODEL = "gpt-4o-mini"  # change this value to use a different LLM model
 
 EMBEDDINGS_PROVIDER = "openai"
 EMBEDDINGS_MODEL = "text-embedding-3-small"
+# To embed on the CPU instead (rag/local_embeddings.py), e.g.:
+# EMBEDDINGS_PROVIDER = "local"
+# EMBEDDINGS_MODEL = "all-MiniLM-L6-v2"  # a folder in LOCAL_EMBEDDINGS_DIR, or a HF name
+# A collection has to be embedded and queried with the same model.
+
+# Local embeddings: "torch" or "onnx" (needs optimum[onnxruntime]), the cores they run on
+# (None: all), and how many texts of concurrent calls are embedded together, waiting at
+# most LOCAL_EMBEDDINGS_MAX_WAIT_MS for a batch to fill
+LOCAL_EMBEDDINGS_BACKEND = "torch"
+LOCAL_EMBEDDINGS_THREADS = None
+LOCAL_EMBEDDINGS_MAX_BATCH = 64
+LOCAL_EMBEDDINGS_MAX_WAIT_MS = 5
+
+# How a collection stores its vectors, fixed when it's created (kept in its Chroma
+# metadata): "dimensions" keeps only the first N dimensions of the embeddings (None: all
+# of them; text-embedding-3 models are trained to be shortened like this, most local
+# models aren't), and "quantization": "int8" keeps the vectors in an int8 index
+# (rag/quantized_index.py) instead of Chroma's HNSW index: the chat scans the int8
+# vectors and rescores the best INT8_RESCORE_FACTOR * fetch_k candidates with their
+# float32 vectors, read from disk.
+# EMBEDDING_DIMENSIONS and EMBEDDING_QUANTIZATION apply to every new collection, and
+# COLLECTION_VECTOR_SETTINGS overrides them per collection, e.g.
+# {"leopard_news": {"dimensions": 512, "quantization": "int8"}}
+EMBEDDING_DIMENSIONS = None
+EMBEDDING_QUANTIZATION = None
+COLLECTION_VECTOR_SETTINGS = {}
+INT8_RESCORE_FACTOR = 4
+
+# How the chat retrieves chunks:
+# "mmr": vector search + MMR, "hybrid": vector + BM25 fused, "lexical": BM25 only (no embedding call)
+RETRIEVAL_MODE = "mmr"
+
+# Max tokens of retrieved text in a chat prompt (measured with the LLM's tokenizer)
+CONTEXT_TOKEN_BUDGET = 3000
+
+# Set to a port (e.g. 9108) to serve the query path's per-stage latencies at
+# http://localhost:<port>/metrics (Prometheus text format). They're always written to
+# cache/query_metrics.prom as well.
+METRICS_PORT = None
+
+# Ingestion: chunks of all the sources being added are batched into embedding requests
+# of at most this many tokens (and the provider's and Chroma's limits), and this many
+# requests are sent at once
+EMBEDDING_BATCH_TOKENS = 100_000
+EMBEDDING_MAX_CONCURRENCY = 4
+
+# How documents are split into chunks: "recursive" is LangChain's
+# RecursiveCharacterTextSplitter with overlapping chunks; "content_defined" picks the
+# chunk boundaries from the text itself, so re-adding an edited document (update=True)
+# only re-embeds the chunks around the edits. The chunk ids depend on it: a source
+# updated after switching gets new ids and is embedded again
+CHUNKING = "recursive"
+
+# Chunks whose normalized text is already in the collection (or earlier in the same
+# ingest) aren't embedded again: "reference" adds the duplicate's source to the stored
+# chunk's 'duplicate_sources' metadata, "skip" just drops the duplicate
+DUPLICATE_CHUNKS = "reference"
+
+# Chunk embeddings are cached in CACHE_DIR by (model, dimensions, text), so rebuilding
+# a collection or adding the same documents to another one doesn't embed them again
+CHUNK_EMBEDDING_CACHE_MAX_MB = 2048
+# The row windows of parsed spreadsheets are cached in CACHE_DIR/spreadsheets by the
+# hash of the file, the least recently used are deleted past this size
+SPREADSHEET_CACHE_MAX_MB = 512
+
+# Local PDF, docx and text files are parsed in this many worker processes (None: one
+# per core), each replaced after parsing this many files to keep its memory in check
+PARSE_WORKERS = None
+PARSE_TASKS_PER_WORKER = 20
+
+# add_update_docs loads sources in this many threads (parsing runs in the processes
+# above) and chunks them in this many, handing them on through queues of at most
+# INGEST_QUEUE_SIZE items, so loading waits when chunking or embedding falls behind
+INGEST_LOAD_WORKERS = 8
+INGEST_CHUNK_WORKERS = 2
+INGEST_QUEUE_SIZE = 16
+
+# Chroma's HNSW index only marks deleted chunks; rag/chromadb_utils.py's "rebuild"
+# rebuilds the indexes of collections where at least this fraction is deleted
+HNSW_REBUILD_DELETED_FRACTION = 0.3
+
+
+# Provider objects are built on first use (see get_provider_object): importing the
+# provider SDKs and creating clients is slow, and most entry points never need all of them.
+def _openai_llm(model: str):
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(temperature=0, model=model, api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def _openai_embeddings(model: str):
+    from langchain_openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(model=model, api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def _openai_chroma_embedding_function(model: str):
+    import chromadb.utils.embedding_functions as chroma_ef
+
+    return chroma_ef.OpenAIEmbeddingFunction(
+        api_key=os.getenv("OPENAI_API_KEY"), model_name=model
+    )
+
+
+def _local_embeddings(model: str):
+    from rag.local_embeddings import LocalEmbeddings, get_local_embedder
+
+    return LocalEmbeddings(get_local_embedder(model))
+
+
+def _local_chroma_embedding_function(model: str):
+    from rag.local_embeddings import LocalEmbeddingFunction, get_local_embedder
+
+    return LocalEmbeddingFunction(get_local_embedder(model))
+
 
 PROVIDERS = {
     "openai": {
@@ -39,15 +160,54 @@ PROVIDERS = {
         # "key": "OPENAI_API_KEY",
         "llm_models": ["gpt-4o-mini", "gpt-4o"],
         # "default_temperature": 0.7,
-        "langchain_llm": ChatOpenAI(
-            temperature=0, model="gpt-4o-mini", api_key=os.getenv("OPENAI_API_KEY")
-        ),
-        "langchain_embeddings": OpenAIEmbeddings(
-            model="text-embedding-3-small", api_key=os.getenv("OPENAI_API_KEY")
-        ),
-    }
+        # factories, called with the model name
+        "langchain_llm": _openai_llm,
+        "langchain_embeddings": _openai_embeddings,
+        "chroma_embedding_function": _openai_chroma_embedding_function,
+        # embedding API limits, used to size and pace the ingest batches
+        "embedding_max_inputs_per_request": 2048,
+        "embedding_max_tokens_per_request": 300_000,
+        "embedding_tokens_per_minute": 1_000_000,
+    },
+    "local": {
+        # embeddings only, on the CPU, without rate limits
+        "langchain_embeddings": _local_embeddings,
+        "chroma_embedding_function": _local_chroma_embedding_function,
+        # smaller ingest batches keep every thread of the scheduler busy
+        "embedding_max_inputs_per_request": 256,
+    },
 }
 
+_provider_objects = {}
+_provider_objects_lock = threading.Lock()
+
+
+def get_provider_object(provider: str, kind: str, model: str):
+    """Create a provider object with its factory in PROVIDERS on first use, and reuse it afterwards"""
+    key = (provider, kind, model)
+    with _provider_objects_lock:
+        if key not in _provider_objects:
+            _provider_objects[key] = PROVIDERS[provider][kind](model)
+
+    return _provider_objects[key]
+
+
+def get_llm():
+    return get_provider_object(LLM_PROVIDER, "langchain_llm", LLM_MODEL)
+
+
+def get_embeddings():
+    return get_provider_object(
+        EMBEDDINGS_PROVIDER, "langchain_embeddings", EMBEDDINGS_MODEL
+    )
+
+
+def get_chroma_embedding_function():
+    return get_provider_object(
+        EMBEDDINGS_PROVIDER, "chroma_embedding_function", EMBEDDINGS_MODEL
+    )
+
+
 SCHEMA_MAP = {
     "Times of India": {
         "name": "Article",
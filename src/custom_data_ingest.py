@@ -12,17 +12,28 @@ import src.config as cfg
 from src.scrape import get_all_pdf_links, download_pdfs
 
 from dotenv import load_dotenv
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 
 load_dotenv(override=True)
-service_account_info = json.loads(os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON"))
 
-creds = service_account.Credentials.from_service_account_info(
-    service_account_info, scopes=["https://www.googleapis.com/auth/drive.readonly"]
-)
-drive_service = build("drive", "v3", credentials=creds)
+_drive_service = None
+
+
+def get_drive_service():
+    """Build the Google Drive client on first use, only Drive data sources need it"""
+    global _drive_service
+
+    if _drive_service is None:
+        from google.oauth2 import service_account
+        from googleapiclient.discovery import build
+
+        service_account_info = json.loads(os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON"))
+        creds = service_account.Credentials.from_service_account_info(
+            service_account_info,
+            scopes=["https://www.googleapis.com/auth/drive.readonly"],
+        )
+        _drive_service = build("drive", "v3", credentials=creds)
+
+    return _drive_service
 
 curr_dir = os.path.dirname(__file__)
 RAG_DIR = os.path.join(curr_dir, "..", "rag")
@@ -53,6 +64,9 @@ def extract_folder_id(data_source):
 
 # List files in the folder
 def download_files_from_google_drive_folder(data_source, downloads_folder):
+    from googleapiclient.http import MediaIoBaseDownload
+
+    drive_service = get_drive_service()
     folder_id = extract_folder_id(data_source)
     results = (
         drive_service.files()
@@ -114,11 +128,6 @@ if __name__ == "__main__":
     # create the dir if it doesn't exist
     dut.create_dir_if_doesnt_exist(dirname)
 
-    if not os.path.exists(os.path.join(dirname, "embedded_sources.csv")):
-        dut.create_csv_with_headers(
-            dirname=dirname, filename="embedded_sources.csv", headers=["Sources"]
-        )
-
     # 5. Embed the documents in the vector DB
     data_source = inputs["data_source"]
     data_to_add = None
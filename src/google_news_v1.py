@@ -10,7 +10,6 @@ import src.config as cfg
 
 # from src.my_classes import NewsSearch
 from models.news_search import NewsSearch
-from src.rag_query import test_questions_on_the_go
 import json
 import time
 
@@ -0,0 +1,168 @@
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import utils.print_utils as prnt
+import src.config as cfg
+import src.rag_query as rag
+import rag.chroma_registry as registry
+import rag.answer_cache as answer_cache
+import rag.quantized_index as quantized_index
+import rag.query_metrics as metrics
+
+
+class QueryService:
+    """
+    Long-lived, in-process query worker.
+    Keeps the LLM/embedding clients, the Chroma client and the HNSW indexes of the
+    collections that have been queried warm, so that every chat message doesn't pay
+    for a fresh Python process, fresh imports and a fresh PersistentClient.
+    """
+
+    def __init__(self, use_answer_cache: bool = True) -> None:
+        self.use_answer_cache = use_answer_cache
+        self._lock = threading.Lock()
+        self._warm_collections = set()
+        # seconds from receiving a question to yielding the first token, most recent last
+        self.time_to_first_token = deque(maxlen=1000)
+
+    def warm_up(self, collection_names: list[str]) -> None:
+        """
+        Open the given collections and load their HNSW or int8 indexes into memory.
+        The HNSW index is loaded by a nearest-neighbour query with an embedding that is
+        already stored in the collection, so no embedding API call is made. It isn't
+        loaded for int8 collections, whose searches don't use it.
+        """
+        with self._lock:
+            to_warm = [c for c in collection_names if c not in self._warm_collections]
+            if not to_warm:
+                return
+
+            for collection_name in to_warm:
+                start = time.time()
+                try:
+                    collection = registry.get_collection(
+                        collection_name=collection_name,
+                        embedding_function=rag.query_ef,
+                    )
+                    settings = registry.get_vector_settings(collection)
+                    if settings["quantization"] == "int8":
+                        quantized_index.load(collection_name)
+                    else:
+                        sample = collection.get(limit=1, include=["embeddings"])
+                        if len(sample["embeddings"]) > 0:
+                            collection.query(
+                                query_embeddings=[sample["embeddings"][0]],
+                                n_results=1,
+                            )
+                except Exception as e:
+                    prnt.prRed(f"Could not warm up collection {collection_name}: {e}")
+                    continue
+
+                self._warm_collections.add(collection_name)
+                prnt.prLightPurple(
+                    f"Warmed up {collection_name} in {time.time() - start:.2f} seconds"
+                )
+
+    def forget(self, collection_name: str) -> None:
+        """Call this when a collection has been deleted or rebuilt"""
+        with self._lock:
+            self._warm_collections.discard(collection_name)
+
+    def stream(self, question: str, collection_names: list[str]):
+        """
+        Yield the answer token by token as the LLM generates it.
+        Answers are cached per question, collections (and their versions), retrieval
+        parameters, prompt and LLM, so a repeated question against unchanged collections
+        is served in one piece without running retrieval or the LLM again.
+        """
+        start = time.time()
+        started = time.perf_counter()
+
+        cache_key = None
+        if self.use_answer_cache:
+            with metrics.timed("answer_cache"):
+                cache_key = rag.get_answer_cache_key(question, collection_names)
+                answer = answer_cache.get_answer(cache_key)
+            if answer is not None:
+                prnt.prLightPurple("Serving the answer from the answer cache")
+                self.time_to_first_token.append(time.time() - start)
+                metrics.observe("request_cached", time.perf_counter() - started, started)
+                yield answer
+                return
+
+        with metrics.timed("warm_up"):
+            self.warm_up(collection_names)
+
+        tokens = []
+        for token in rag.stream_rag_answer(
+            query=question, collection_names=collection_names
+        ):
+            if not tokens:
+                ttft = time.time() - start
+                self.time_to_first_token.append(ttft)
+                metrics.observe("time_to_first_token", ttft, started)
+                prnt.prLightPurple(f"Time to first token: {ttft:.2f} seconds")
+            tokens.append(token)
+            yield token
+
+        prnt.prLightPurple(f"Full answer in {time.time() - start:.2f} seconds")
+        metrics.observe("request", time.perf_counter() - started, started)
+        metrics.maybe_write_metrics_file()
+        if cache_key:
+            answer_cache.put_answer(cache_key, "".join(tokens))
+
+    def stream_with_inputs(self, inputs: dict):
+        """
+        inputs: same dict that src/rag_query.py takes on the command line
+        ('question', 'data_source', 'collection_name_prefix')
+        """
+        collection_names = rag.get_collection_names(
+            inputs["data_source"], inputs["collection_name_prefix"]
+        )
+        if not collection_names:
+            yield "None"
+            return
+
+        yield from self.stream(inputs["question"], collection_names)
+
+    def ask(self, question: str, collection_names: list[str], trace: bool = False):
+        """
+        Returns the answer, or (answer, trace) with trace=True, where trace is a dict
+        with the total time and the time of every stage of this request
+        """
+        if not trace:
+            return "".join(self.stream(question, collection_names))
+
+        with metrics.trace_request() as request_trace:
+            answer = "".join(self.stream(question, collection_names))
+        return answer, request_trace.to_dict()
+
+    def ask_with_inputs(self, inputs: dict):
+        """Like ask, with the trace returned when inputs has 'trace': true"""
+        if not inputs.get("trace"):
+            return "".join(self.stream_with_inputs(inputs))
+
+        with metrics.trace_request() as request_trace:
+            answer = "".join(self.stream_with_inputs(inputs))
+        return answer, request_trace.to_dict()
+
+
+_query_service = None
+_query_service_lock = threading.Lock()
+
+
+def get_query_service() -> QueryService:
+    """Return the process-wide query service, creating it on first use"""
+    global _query_service
+
+    with _query_service_lock:
+        if _query_service is None:
+            _query_service = QueryService()
+            if cfg.METRICS_PORT:
+                metrics.start_metrics_server(cfg.METRICS_PORT)
+
+    return _query_service
@@ -1,41 +1,55 @@
 import os
 import sys
-from langchain_chroma import Chroma
 # from langchain_openai import ChatOpenAI,
 
 # from langchain_core.runnables import RunnableParallel, RunnablePassthrough
+from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-import chromadb
-import chromadb.utils.embedding_functions as chroma_ef
-import pandas as pd
 import re
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 import utils.print_utils as prnt
 import src.config as cfg
+import rag.chroma_registry as registry
+from rag.mmr import maximal_marginal_relevance
+from rag.embedding_cache import CachedQueryEmbeddings, CachedQueryEmbeddingFunction
+import rag.answer_cache as answer_cache
+import rag.lexical_index as lexical_index
+import rag.quantized_index as quantized_index
+import rag.query_metrics as metrics
+from rag.context_packing import pack_context
 
 from dotenv import load_dotenv, find_dotenv
 
 
 _ = load_dotenv(find_dotenv())
 
-llm = cfg.PROVIDERS[cfg.LLM_PROVIDER]["langchain_llm"]
-embeddings = cfg.PROVIDERS[cfg.EMBEDDINGS_PROVIDER]["langchain_embeddings"]
+# this module only embeds queries, so both embedding paths go through the query embedding cache.
+# The provider clients behind them (and the LLM, see cfg.get_llm) are created on first use.
+embeddings = CachedQueryEmbeddings(
+    model_name=cfg.EMBEDDINGS_MODEL, factory=cfg.get_embeddings
+)
 
-openai_api_key = os.getenv("OPENAI_API_KEY")
-openai_ef = chroma_ef.OpenAIEmbeddingFunction(
-    api_key=openai_api_key, model_name="text-embedding-3-small"
+query_ef = CachedQueryEmbeddingFunction(
+    model_name=cfg.EMBEDDINGS_MODEL, factory=cfg.get_chroma_embedding_function
 )
 
 curr_dir = os.path.dirname(__file__)
-DEFAULT_PERSIST_DIR = str(os.path.join(curr_dir, "..", "test_db"))
+DEFAULT_PERSIST_DIR = str(cfg.VECTORDB_DIR)
 # DEFAULT_PERSIST_DIR = str(os.path.join(curr_dir, "..", "chroma_db"))
 
-chromadb_client = chromadb.PersistentClient(path=DEFAULT_PERSIST_DIR)
 RAG_DIR = os.path.join(curr_dir, "..", "rag")
 
+# shared by all queries, so fanning out across collections doesn't spawn threads per question
+MAX_RETRIEVAL_WORKERS = 8
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=MAX_RETRIEVAL_WORKERS, thread_name_prefix="retrieval"
+)
+
 
 rag_pipeline_user_prompt = """
     "Answer the given question based on the given context. General instructions:
@@ -53,25 +67,27 @@ rag_pipeline_user_prompt = """
     Context: {context}
 """
 
+rag_pipeline_system_prompt = (
+    "You're a helpful assistant. Answer the user's question based on the given context."
+)
+
 rag_prompt = ChatPromptTemplate.from_messages(
     [
-        (
-            "system",
-            "You're a helpful assistant. Answer the user's question based on the given context.",
-        ),
+        ("system", rag_pipeline_system_prompt),
         ("human", rag_pipeline_user_prompt),
     ]
 )
 
+# retrieval parameters of rag_langchain_without_history, also part of the answer cache key
+RETRIEVAL_PARAMS = {"k": 5, "fetch_k": 15, "lambda_mult": 0.5}
+
 
 def load_vectordb(collection_name, embedding_function):
     try:
-        vectordb = Chroma(
-            client=chromadb_client,
-            persist_directory=DEFAULT_PERSIST_DIR,
-            collection_name=collection_name,
-            embedding_function=embedding_function,
-        )
+        with metrics.timed("open_collection", detail=collection_name):
+            vectordb = registry.get_vectorstore(
+                collection_name=collection_name, embedding_function=embedding_function
+            )
         return vectordb
     except Exception as e:
         prnt.prRed(f"Exception while trying to load collection {collection_name}: {e}")
@@ -88,7 +104,8 @@ def retrieve_docs(vectordb, query: str, debug: bool = False):
         search_type="mmr", search_kwargs={"k": 5, "fetch_k": 10}
     )
 
-    relevant_docs = retriever.invoke(query)
+    with metrics.timed("retrieval"):
+        relevant_docs = retriever.invoke(query)
 
     if debug:
         for i, doc in enumerate(relevant_docs):
@@ -119,7 +136,8 @@ def retrieve_docs_alt(
 
     retriever = vectordb.as_retriever(search_type="mmr", search_kwargs=search_params)
 
-    relevant_docs = retriever.invoke(query)
+    with metrics.timed("retrieval", detail=collection_name):
+        relevant_docs = retriever.invoke(query)
 
     if debug:
         for i, doc in enumerate(relevant_docs):
@@ -132,7 +150,7 @@ def retrieve_docs_alt(
 def rag_chroma_without_history(
     query: list[str],
     collection_name: str = "ckbh",
-    embedding_function=openai_ef,
+    embedding_function=query_ef,
 ):
     """
     Query a vector db to fetch the most relevant documents and answer a query based on those using an LLM.
@@ -140,19 +158,20 @@ def rag_chroma_without_history(
     """
     prnt.prPurple("Running RAG pipeline with Chroma methods")
 
-    global chromadb_client
-
-    collection = chromadb_client.get_collection(
-        name=collection_name, embedding_function=embedding_function
-    )
+    with metrics.timed("open_collection", detail=collection_name):
+        collection = registry.get_collection(
+            collection_name=collection_name, embedding_function=embedding_function
+        )
 
-    query_results = collection.query(
-        query_texts=[query],
-        n_results=10,
-        include=["documents", "metadatas", "distances"],
-        # where={"metadata_field": "is_equal_to_this"},
-        # where_document={"$contains":"search_string"}
-    )
+    # query_texts: embeds the query and runs the nearest-neighbour search
+    with metrics.timed("retrieval", detail=collection_name):
+        query_results = collection.query(
+            query_texts=[query],
+            n_results=10,
+            include=["documents", "metadatas", "distances"],
+            # where={"metadata_field": "is_equal_to_this"},
+            # where_document={"$contains":"search_string"}
+        )
 
     # prnt.prLightPurple(f"{type(query_results)}, {query_results.keys()}")
     # prnt.prLightPurple(f"Num of query results: {len(query_results)}")
@@ -181,8 +200,9 @@ def rag_chroma_without_history(
     # prnt.prLightPurple(f"\nContext:\n{context}")
 
     output_parser = StrOutputParser()
-    rag_chain = rag_prompt | llm | output_parser
-    rag_answer = rag_chain.invoke({"context": context, "question": query})
+    rag_chain = rag_prompt | cfg.get_llm() | output_parser
+    with metrics.timed("llm"):
+        rag_answer = rag_chain.invoke({"context": context, "question": query})
 
     # prnt.prLightPurple(f"\nQuestion: {query}")
     # print(f"RAG answer: {rag_answer}\n")
@@ -190,40 +210,263 @@ def rag_chroma_without_history(
     print(f"{rag_answer}\n")
 
 
-def rag_langchain_without_history(
+def fetch_candidates(
+    query_embedding: list[float],
+    collection_names: list[str],
+    fetch_k: int = 15,
+    metadata_filters: dict = None,
+) -> list[dict]:
+    """
+    Run a nearest-neighbour search with the given query embedding on all the collections
+    concurrently. Returns the union of the candidates, each as a dict with the LangChain
+    document, its stored embedding, its distance and the collection it came from.
+    The query embedding is shortened to each collection's dimensions, and collections
+    with an int8 index are searched through it.
+    """
+
+    def query_one(collection_name):
+        try:
+            # the query is already embedded, so the collection needs no embedding function
+            with metrics.timed("open_collection", detail=collection_name):
+                collection = registry.get_collection(
+                    collection_name=collection_name, embedding_function=None
+                )
+            settings = registry.get_vector_settings(collection)
+            embedding = registry.shorten_embeddings(
+                [query_embedding], settings["dimensions"]
+            )[0]
+            with metrics.timed("vector_search", detail=collection_name):
+                if settings["quantization"] == "int8":
+                    results = quantized_index.query(
+                        collection,
+                        collection_name,
+                        embedding,
+                        fetch_k,
+                        where=metadata_filters or None,
+                    )
+                else:
+                    results = collection.query(
+                        query_embeddings=[embedding],
+                        n_results=fetch_k,
+                        where=metadata_filters or None,
+                        include=["documents", "metadatas", "distances", "embeddings"],
+                    )
+        except Exception as e:
+            prnt.prRed(f"Exception while trying to query collection {collection_name}: {e}")
+            return []
+
+        return [
+            {
+                "document": Document(page_content=doc, metadata=metadata or {}, id=id_),
+                "embedding": embedding,
+                "distance": distance,
+                "collection": collection_name,
+            }
+            for id_, doc, metadata, embedding, distance in zip(
+                results["ids"][0],
+                results["documents"][0],
+                results["metadatas"][0],
+                results["embeddings"][0],
+                results["distances"][0],
+            )
+        ]
+
+    futures = [
+        metrics.submit(retrieval_executor, query_one, c) for c in collection_names
+    ]
+    candidates = []
+    for future in futures:
+        candidates.extend(future.result())
+
+    return candidates
+
+
+def retrieve_from_collections(
     query: str,
     collection_names: list[str],
     embedding_function=embeddings,
-) -> str:
+    k: int = 5,
+    fetch_k: int = 15,
+    lambda_mult: float = 0.5,
+) -> list:
     """
-    Query a vector db to fetch the most relevant documents and answer a query based on those using an LLM.
-    Use LangChain methods for retrieval.
+    Retrieve the most relevant documents for a query from several collections.
+    The query is embedded once, the nearest-neighbour searches of all the collections
+    run concurrently with that embedding, and a single MMR pass over the union of the
+    candidates picks the global top k. The candidates' stored embeddings are reused,
+    so MMR needs no extra embedding calls; if the collections keep different numbers
+    of dimensions, MMR compares the embeddings shortened to the fewest.
     """
+    if not collection_names:
+        return []
 
-    relevant_docs = []
-    for collection_name in collection_names:
-        vectordb = load_vectordb(
-            collection_name=collection_name, embedding_function=embedding_function
+    with metrics.timed("embed_query"):
+        query_embedding = embedding_function.embed_query(query)
+
+    candidates = fetch_candidates(
+        query_embedding=query_embedding,
+        collection_names=collection_names,
+        fetch_k=fetch_k,
+    )
+    if not candidates:
+        return []
+
+    with metrics.timed("mmr"):
+        dimensions = min(len(c["embedding"]) for c in candidates)
+        candidate_embeddings = [c["embedding"] for c in candidates]
+        if any(len(e) != dimensions for e in candidate_embeddings):
+            candidate_embeddings = registry.shorten_embeddings(
+                [list(e) for e in candidate_embeddings], dimensions
+            )
+        selected = maximal_marginal_relevance(
+            registry.shorten_embeddings([query_embedding], dimensions)[0],
+            candidate_embeddings,
+            k=k,
+            lambda_mult=lambda_mult,
         )
-        if not vectordb:
-            continue
 
-        search_params = {
-            "k": 5,
-            "fetch_k": 15,
-        }
+    return [candidates[i]["document"] for i in selected]
+
 
-        retriever = vectordb.as_retriever(
-            search_type="mmr", search_kwargs=search_params
+def reciprocal_rank_fusion(
+    ranked_lists: list[list], weights: list[float] = None, rrf_k: int = 60
+) -> list:
+    """
+    Fuse several rankings of hashable keys into one: every key scores
+    sum(weight / (rrf_k + rank)) over the lists it appears in. Best first.
+    """
+    weights = weights or [1.0] * len(ranked_lists)
+    scores = {}
+    for ranked, weight in zip(ranked_lists, weights):
+        for rank, key in enumerate(ranked):
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank + 1)
+
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def search_lexical_collection(
+    query: str, collection_name: str, fetch_k: int = 15
+) -> list:
+    """BM25 search of a collection's lexical index, as a ranked list of (collection name, chunk id, Document)"""
+    with metrics.timed("lexical_search", detail=collection_name):
+        hits = lexical_index.search(collection_name, query, k=fetch_k)
+
+    return [
+        (
+            collection_name,
+            hit["id"],
+            Document(page_content=hit["content"], metadata=hit["metadata"], id=hit["id"]),
         )
+        for hit in hits
+    ]
 
-        # relevant_docs = retrieve_docs(retriever=retriever, query=query, debug=True)
-        relevant_docs += retriever.invoke(query)
 
-    # for i, doc in enumerate(relevant_docs):
-    #     prnt.prLightPurple(f"{'-' * 10}\nDocument {i} ({doc.metadata})\n")
-    #     print(f"{doc.page_content}")
+def search_lexical(query: str, collection_names: list[str], fetch_k: int = 15) -> list:
+    """BM25 search of all the collections concurrently, one ranked list per collection"""
+    futures = [
+        metrics.submit(retrieval_executor, search_lexical_collection, query, c, fetch_k)
+        for c in collection_names
+    ]
+    return [f.result() for f in futures]
+
+
+def retrieve_lexical(
+    query: str, collection_names: list[str], k: int = 5, fetch_k: int = 15
+) -> list:
+    """
+    Fast path that needs no network round-trip: BM25 search of the local lexical
+    indexes, with the per-collection rankings fused into one.
+    """
+    ranked_lists = search_lexical(query, collection_names, fetch_k=fetch_k)
+    docs = {(c, id_): doc for ranked in ranked_lists for c, id_, doc in ranked}
+
+    fused = reciprocal_rank_fusion(
+        [[(c, id_) for c, id_, _ in ranked] for ranked in ranked_lists]
+    )
+    return [docs[key] for key in fused[:k]]
+
+
+def retrieve_hybrid(
+    query: str,
+    collection_names: list[str],
+    embedding_function=embeddings,
+    k: int = 5,
+    fetch_k: int = 15,
+    lexical_weight: float = 1.0,
+) -> list:
+    """
+    Vector search (one query embedding, all collections concurrently) and BM25 search
+    of the lexical indexes, fused with reciprocal rank fusion. Exact names that the
+    embeddings handle poorly are picked up by the lexical side.
+    """
+    if not collection_names:
+        return []
+
+    # the lexical searches run while the query is embedded and the vector searches run
+    lexical_futures = [
+        metrics.submit(retrieval_executor, search_lexical_collection, query, c, fetch_k)
+        for c in collection_names
+    ]
+    with metrics.timed("embed_query"):
+        query_embedding = embedding_function.embed_query(query)
+    vector_candidates = fetch_candidates(
+        query_embedding=query_embedding,
+        collection_names=collection_names,
+        fetch_k=fetch_k,
+    )
+    lexical_lists = [f.result() for f in lexical_futures]
+
+    # all the collections use the same embedding model, so distances are comparable
+    vector_candidates.sort(key=lambda c: c["distance"])
+    docs = {(c["collection"], c["document"].id): c["document"] for c in vector_candidates}
+    for ranked in lexical_lists:
+        for c, id_, doc in ranked:
+            docs.setdefault((c, id_), doc)
+
+    fused = reciprocal_rank_fusion(
+        [[(c["collection"], c["document"].id) for c in vector_candidates]]
+        + [[(c, id_) for c, id_, _ in ranked] for ranked in lexical_lists],
+        weights=[1.0] + [lexical_weight] * len(lexical_lists),
+    )
+    return [docs[key] for key in fused[:k]]
+
 
+def retrieve_relevant_docs(
+    query: str,
+    collection_names: list[str],
+    embedding_function=embeddings,
+    mode: str = None,
+) -> list:
+    """Retrieve with the configured RETRIEVAL_MODE ('mmr', 'hybrid' or 'lexical')"""
+    mode = mode or cfg.RETRIEVAL_MODE
+
+    with metrics.timed("retrieval", detail=mode):
+        if mode == "lexical":
+            return retrieve_lexical(
+                query,
+                collection_names,
+                k=RETRIEVAL_PARAMS["k"],
+                fetch_k=RETRIEVAL_PARAMS["fetch_k"],
+            )
+        elif mode == "hybrid":
+            return retrieve_hybrid(
+                query,
+                collection_names,
+                embedding_function=embedding_function,
+                k=RETRIEVAL_PARAMS["k"],
+                fetch_k=RETRIEVAL_PARAMS["fetch_k"],
+            )
+
+        return retrieve_from_collections(
+            query=query,
+            collection_names=collection_names,
+            embedding_function=embedding_function,
+            **RETRIEVAL_PARAMS,
+        )
+
+
+def build_rag_context(relevant_docs: list) -> str:
+    """Join the retrieved chunks and list their unique sources at the end"""
     unique_sources = ""
     if relevant_docs:
         unique_sources = "Sources:\n" + "\n".join(
@@ -231,18 +474,41 @@ def rag_langchain_without_history(
         )
         # prnt.prLightPurple(f"--------\n{unique_sources}\n--------")
 
-    context = (
+    return (
         "\n\n".join([doc.page_content for doc in relevant_docs]) + "\n" + unique_sources
     )
 
-    # retrieval = RunnableParallel(
-    #     {"context": retriever, "question": RunnablePassthrough()}
-    # )
+
+def rag_langchain_without_history(
+    query: str,
+    collection_names: list[str],
+    embedding_function=embeddings,
+) -> str:
+    """
+    Query a vector db to fetch the most relevant documents and answer a query based on those using an LLM.
+    Use LangChain methods for retrieval.
+    """
+
+    relevant_docs = retrieve_relevant_docs(
+        query=query,
+        collection_names=collection_names,
+        embedding_function=embedding_function,
+    )
+
+    # for i, doc in enumerate(relevant_docs):
+    #     prnt.prLightPurple(f"{'-' * 10}\nDocument {i} ({doc.metadata})\n")
+    #     print(f"{doc.page_content}")
+
+    with metrics.timed("context_packing"):
+        relevant_docs, _ = pack_context(relevant_docs)
+    with metrics.timed("prompt_build"):
+        context = build_rag_context(relevant_docs)
 
     output_parser = StrOutputParser()
     # rag_chain = retrieval | rag_prompt | llm | output_parser
-    rag_chain = rag_prompt | llm | output_parser
-    rag_answer = rag_chain.invoke({"question": query, "context": context})
+    rag_chain = rag_prompt | cfg.get_llm() | output_parser
+    with metrics.timed("llm"):
+        rag_answer = rag_chain.invoke({"question": query, "context": context})
     # rag_answers = rag_chain.batch(query, config={"max_concurrency": 5})
     # prnt.prLightPurple(f"\nQuestion: {query}")
     # prnt.prYellow("\nRAG answer from langchain:\n")
@@ -251,6 +517,37 @@ def rag_langchain_without_history(
     return rag_answer
 
 
+def stream_rag_answer(
+    query: str,
+    collection_names: list[str],
+    embedding_function=embeddings,
+):
+    """
+    Same as rag_langchain_without_history, but yields the answer token by token as
+    the LLM generates it, instead of returning it once it's complete.
+    """
+    relevant_docs = retrieve_relevant_docs(
+        query=query,
+        collection_names=collection_names,
+        embedding_function=embedding_function,
+    )
+    with metrics.timed("context_packing"):
+        relevant_docs, _ = pack_context(relevant_docs)
+    with metrics.timed("prompt_build"):
+        context = build_rag_context(relevant_docs)
+
+    rag_chain = rag_prompt | cfg.get_llm() | StrOutputParser()
+    started = time.perf_counter()
+    first_token = True
+    for token in rag_chain.stream({"question": query, "context": context}):
+        if first_token:
+            metrics.observe("llm_first_token", time.perf_counter() - started, started)
+            first_token = False
+        yield token
+    # includes the time the consumer spends between tokens (e.g. rendering them)
+    metrics.observe("llm", time.perf_counter() - started, started)
+
+
 def rag_for_field_extraction(
     context: str,
     fields: dict,
@@ -263,7 +560,7 @@ def rag_for_field_extraction(
 
     output_parser = StrOutputParser()
     # rag_chain = retrieval | rag_prompt | llm | output_parser
-    rag_chain = prompt | llm | output_parser
+    rag_chain = prompt | cfg.get_llm() | output_parser
     rag_answer = rag_chain.invoke({"context": context, "fields_of_interest": fields})
 
     return rag_answer
@@ -282,19 +579,138 @@ def test_questions_on_the_go(collection_name: str) -> None:
         # rag_chroma_without_history(question)
 
 
-def test_predefined_questions_list():
+def rag_langchain_batch(
+    queries: list[str],
+    collection_names: list[str],
+    max_concurrency: int = 5,
+    checkpoint_path: str = None,
+) -> list[str]:
+    """
+    Answer many questions against the same collections with at most max_concurrency
+    questions in flight at a time. Answers are returned in the order of the questions.
+
+    If checkpoint_path is given, every finished answer is appended to that JSONL file
+    as soon as it's ready, and answers already in it are reused, so an interrupted run
+    picks up where it stopped.
+    """
+    answers = [None] * len(queries)
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                done = json.loads(line)
+                if done["index"] < len(queries) and done["question"] == queries[done["index"]]:
+                    answers[done["index"]] = done["answer"]
+
+    pending = [i for i, answer in enumerate(answers) if answer is None]
+    prnt.prPurple(
+        f"Answering {len(pending)} questions ({len(queries) - len(pending)} already in the checkpoint) "
+        f"with max concurrency {max_concurrency}"
+    )
+
+    start = time.time()
+
+    def answer_one(index):
+        try:
+            return rag_langchain_without_history(
+                query=queries[index], collection_names=collection_names
+            )
+        except Exception as e:
+            prnt.prRed(f"Exception while answering question {index}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {executor.submit(answer_one, i): i for i in pending}
+        for num_done, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            answer = future.result()
+            if answer is None:
+                continue
+
+            answers[index] = answer
+            if checkpoint_path:
+                with open(checkpoint_path, "a", encoding="utf-8") as f:
+                    f.write(
+                        json.dumps(
+                            {"index": index, "question": queries[index], "answer": answer}
+                        )
+                        + "\n"
+                    )
+            print(f"Answered {num_done}/{len(pending)}")
+
+    elapsed = time.time() - start
+    num_answered = sum(1 for i in pending if answers[i] is not None)
+    if elapsed > 0:
+        prnt.prYellow(
+            f"Answered {num_answered} questions in {elapsed:.1f} seconds "
+            f"({num_answered / elapsed * 60:.1f} questions/min)"
+        )
+
+    return answers
+
+
+def test_predefined_questions_list(collection_names: list[str]):
+    import pandas as pd
+
     questions_df = pd.read_csv(
         os.path.join(RAG_DIR, "leopard_questions.csv")
     )  # , nrows=10)
-    questions_df["Answers"] = questions_df["Question"].apply(
-        rag_langchain_without_history
+    questions_df["Answers"] = rag_langchain_batch(
+        queries=questions_df["Question"].to_list(),
+        collection_names=collection_names,
+        checkpoint_path=os.path.join(RAG_DIR, "leopard_answers.checkpoint.jsonl"),
     )
     questions_df.to_csv(os.path.join(RAG_DIR, "leopard_answers.csv"), index=False)
 
 
+def get_answer_cache_key(query: str, collection_names: list[str]) -> str:
+    """Cache key of a rag_langchain_without_history answer in the current state of the collections"""
+    return answer_cache.make_answer_key(
+        question=query,
+        collection_names=collection_names,
+        retrieval_params={
+            "mode": cfg.RETRIEVAL_MODE,
+            "context_token_budget": cfg.CONTEXT_TOKEN_BUDGET,
+            **RETRIEVAL_PARAMS,
+        },
+        prompt_template=rag_pipeline_system_prompt + rag_pipeline_user_prompt,
+        llm_model=cfg.LLM_MODEL,
+    )
+
+
+def get_collection_names(data_source: str, collection_name_prefix: str) -> list[str]:
+    """Map the chat's data source type to the collections that should be queried"""
+    if data_source == "news_scholar":
+        return [
+            f"{collection_name_prefix}_news",
+            f"{collection_name_prefix}_research_articles",
+        ]
+    elif data_source == "link":
+        return [collection_name_prefix]
+
+    return []
+
+
+def answer_question(inputs: dict) -> str:
+    """
+    inputs: dict with the keys 'question', 'data_source' ('news_scholar' or 'link') and 'collection_name_prefix'
+    """
+    collection_names = get_collection_names(
+        inputs["data_source"], inputs["collection_name_prefix"]
+    )
+    if not collection_names:
+        return "None"
+
+    return rag_langchain_without_history(
+        query=inputs["question"], collection_names=collection_names
+    )
+
+
 if __name__ == "__main__":
     ### --- Answer all the questions in Questions.csv ---
-    # test_predefined_questions_list()
+    # test_predefined_questions_list(collection_names=["leopards_research_articles"])
 
     # --- Answer any question that is entered from the terminal ---
     # test_questions_on_the_go(collection_name="leopards_research_articles")
@@ -302,20 +718,11 @@ if __name__ == "__main__":
 
     # print("Arguments received:", sys.argv[1])
     inputs = json.loads(sys.argv[1])
-    answer = "None"
-
-    if inputs["data_source"] == "news_scholar":
-        answer = rag_langchain_without_history(
-            query=inputs["question"],
-            collection_names=[
-                f"{inputs['collection_name_prefix']}_news",
-                f"{inputs['collection_name_prefix']}_research_articles",
-            ],
-        )
-
-    elif inputs["data_source"] == "link":
-        answer = rag_langchain_without_history(
-            query=inputs["question"],
-            collection_names=[inputs["collection_name_prefix"]],
-        )
-    print(answer)
+    if not inputs.get("trace"):
+        print(answer_question(inputs))
+    else:
+        # per-stage timings of this question, printed after the answer
+        with metrics.trace_request() as trace:
+            answer = answer_question(inputs)
+        print(answer)
+        prnt.prLightPurple(json.dumps(trace.to_dict(), indent=2))
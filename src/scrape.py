@@ -15,7 +15,6 @@ from tqdm import tqdm
 _ = load_dotenv(find_dotenv())
 
 curr_dir = os.path.dirname(__file__)
-print(curr_dir)
 # ROOT_DIR = os.path.dirname(curr_dir)
 # print(f"ROOT DIR: {ROOT_DIR}")
 
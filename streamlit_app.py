@@ -8,7 +8,8 @@ import re
 import os
 from rag.chromadb_utils import (
     get_collections,
-    query_collection,
+    stream_collection_answer,
+    stream_question_answer,
     delete_collection,
     get_example_questions,
 )
@@ -228,18 +229,14 @@ def build_collection():
 
     # ---- Helper function to handle submission ----
     def submit_question(rag_inputs):
+        st.markdown(f"**You:** {user_input}")
+        st.markdown("**EcoBot:**")
         try:
-            result = subprocess.run(
-                ["python3", "src/rag_query.py", json.dumps(rag_inputs)],
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-            bot_reply = result.stdout.strip()
-        except subprocess.CalledProcessError as e:
-            bot_reply = (
-                f"Error: {e.stderr.strip() if e.stderr else 'Something went wrong.'}"
-            )
+            # render the answer token by token as the LLM generates it
+            bot_reply = st.write_stream(stream_question_answer(rag_inputs))
+        except Exception as e:
+            bot_reply = f"Error: {str(e) or 'Something went wrong.'}"
+            st.markdown(bot_reply)
 
         # Append to chat history
         st.session_state.chat_history.insert(0, ("EcoBot", bot_reply))
@@ -269,8 +266,8 @@ def build_collection():
                     }
                     submit_question(rag_inputs)
 
-                    # Display chat history
-                    for sender, message in st.session_state.chat_history:
+                    # Display chat history (the latest question and answer are already shown)
+                    for sender, message in st.session_state.chat_history[2:]:
                         st.markdown(f"**{sender}:** {message}")
     else:
         st.info(
@@ -342,6 +339,7 @@ def chat_with_collection():
     chat_container = st.container()
 
     user_input = st.chat_input("Type your query...")
+    question_to_answer = user_input
 
     # --- Show Example Questions ---
     example_questions = get_example_questions(selected_collection)
@@ -363,16 +361,7 @@ def chat_with_collection():
         with col2:
             if st.button("Send") and selected_example != dropdown_hint:
                 if selected_example:
-                    st.session_state.chat_history.append(
-                        # {"role": "user", "content": selected_example}
-                        ("You", selected_example)
-                    )
-                    response = query_collection(selected_collection, selected_example)
-                    st.session_state.chat_history.append(
-                        # {"role": "assistant", "content": response}
-                        ("EcoBot", response)
-                    )
-                    st.rerun()
+                    question_to_answer = selected_example
 
     # --- Chat Input ---
     # default_input = (
@@ -382,19 +371,6 @@ def chat_with_collection():
     #     "Type your message...", key="chat_input", value=default_input
     # )
 
-    if user_input:
-        st.session_state.chat_history.append(
-            # {"role": "user", "content": user_input}
-            ("You", user_input)
-        )
-
-        # Get assistant response from backend
-        response = query_collection(selected_collection, user_input)
-        st.session_state.chat_history.append(
-            # {"role": "assistant", "content": response}
-            ("EcoBot", response)
-        )
-
     # --- Display Chat ---
     for msg in st.session_state.chat_history:  # each msg is a tuple
         # if msg["role"] == "user":
@@ -405,6 +381,24 @@ def chat_with_collection():
             with chat_container.chat_message("assistant"):
                 st.markdown(msg[1])
 
+    if question_to_answer:
+        st.session_state.chat_history.append(
+            # {"role": "user", "content": question_to_answer}
+            ("You", question_to_answer)
+        )
+        with chat_container.chat_message("user"):
+            st.markdown(question_to_answer)
+
+        # Get assistant response from backend, rendered token by token as it arrives
+        with chat_container.chat_message("assistant"):
+            response = st.write_stream(
+                stream_collection_answer(selected_collection, question_to_answer)
+            )
+        st.session_state.chat_history.append(
+            # {"role": "assistant", "content": response}
+            ("EcoBot", response)
+        )
+
 
 def main():
     st.set_page_config(page_title="EcoSearch", layout="centered")
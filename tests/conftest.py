@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import src.config as cfg
+
+
+@pytest.fixture
+def data_dirs(tmp_path, monkeypatch):
+    """Point every on-disk store (Chroma, indexes, manifests, caches) to tmp_path"""
+    for name in [
+        "VECTORDB_DIR",
+        "CACHE_DIR",
+        "LEXICAL_INDEX_DIR",
+        "INGEST_MANIFEST_DIR",
+        "QUANTIZED_INDEX_DIR",
+    ]:
+        monkeypatch.setattr(cfg, name, str(tmp_path / name.lower()))
+    # set from cfg.VECTORDB_DIR when rag.chromadb_utils is imported
+    monkeypatch.setattr("rag.chromadb_utils.PERSIST_DIR", cfg.VECTORDB_DIR)
+    monkeypatch.setattr(
+        "rag.chromadb_utils.SQLITE_FILE",
+        os.path.join(cfg.VECTORDB_DIR, "chroma.sqlite3"),
+    )
+    return tmp_path
@@ -0,0 +1,40 @@
+import src.config as cfg
+import src.rag_query as rag
+import rag.answer_cache as answer_cache
+
+
+def test_collection_versions(data_dirs):
+    assert answer_cache.get_collection_versions(["a", "b"]) == {"a": 0, "b": 0}
+
+    answer_cache.bump_collection_version("a")
+    answer_cache.bump_collection_version("a")
+
+    assert answer_cache.get_collection_versions(["a", "b"]) == {"a": 2, "b": 0}
+
+
+def test_answer_cache_key(data_dirs, monkeypatch):
+    question, collections = "What do leopards eat?", ["news", "articles"]
+    key = rag.get_answer_cache_key(question, collections)
+
+    # case, whitespace and the order of the collections don't matter
+    same = rag.get_answer_cache_key("  what do LEOPARDS eat? ", ["articles", "news"])
+    assert same == key
+    assert rag.get_answer_cache_key("Where do leopards live?", collections) != key
+
+    # a write to any of the collections changes it
+    answer_cache.bump_collection_version("articles")
+    bumped = rag.get_answer_cache_key(question, collections)
+    assert bumped != key
+
+    # so do the retrieval settings and the LLM
+    monkeypatch.setattr(cfg, "RETRIEVAL_MODE", "lexical")
+    lexical = rag.get_answer_cache_key(question, collections)
+    assert lexical != bumped
+    monkeypatch.setattr(cfg, "LLM_MODEL", "another-model")
+    assert rag.get_answer_cache_key(question, collections) not in [bumped, lexical]
+
+
+def test_get_and_put_answer(data_dirs):
+    assert answer_cache.get_answer("key") is None
+    answer_cache.put_answer("key", "an answer")
+    assert answer_cache.get_answer("key") == "an answer"
@@ -0,0 +1,93 @@
+import random
+
+from langchain_core.documents import Document
+
+import src.config as cfg
+import rag.maintain_vectordb as maintain_vectordb
+from rag.maintain_vectordb import assign_chunk_ids, create_stable_chunks
+
+
+def make_text(num_words: int, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    words = ["leopard", "forest", "village", "camera", "trap", "night", "prey", "river"]
+    return " ".join(
+        f"{rnd.choice(words)}{rnd.randrange(1000)}" for _ in range(num_words)
+    )
+
+
+def make_doc(text: str, source: str = "https://a.com/x") -> Document:
+    return Document(
+        page_content=text, metadata={"source": source, "id": f"{source}_page-0"}
+    )
+
+
+def test_stable_chunks_cover_the_text_within_the_size():
+    text = make_text(3000)
+    chunks = create_stable_chunks([make_doc(text)], chunk_size=1500)
+
+    assert len(chunks) > 1
+    assert all(len(c.page_content) <= 1500 for c in chunks)
+    assert " ".join(c.page_content for c in chunks).split() == text.split()
+    assert all(c.metadata["source"] == "https://a.com/x" for c in chunks)
+
+
+def test_stable_chunks_only_change_around_an_edit():
+    words = make_text(3000).split()
+    before = [c.page_content for c in create_stable_chunks([make_doc(" ".join(words))])]
+    words[1500] = "edited"
+    after = [c.page_content for c in create_stable_chunks([make_doc(" ".join(words))])]
+
+    changed = set(before) ^ set(after)
+    # the edited chunk, maybe its neighbour, not every chunk after it
+    assert 0 < len(changed) <= 4
+    assert before[0] == after[0] and before[-1] == after[-1]
+
+
+def test_positional_chunk_ids(monkeypatch):
+    monkeypatch.setattr(cfg, "CHUNKING", "recursive")
+    chunks = [make_doc("one"), make_doc("two"), make_doc("one")]
+    assign_chunk_ids(chunks)
+
+    assert [c.metadata["id"] for c in chunks] == [
+        "https://a.com/x_page-0_chunk-0",
+        "https://a.com/x_page-0_chunk-1",
+        "https://a.com/x_page-0_chunk-2",
+    ]
+    assert [c.metadata["chunk_index"] for c in chunks] == [0, 1, 2]
+
+
+def test_content_defined_chunk_ids(monkeypatch):
+    monkeypatch.setattr(cfg, "CHUNKING", "content_defined")
+    chunks = [make_doc("one"), make_doc("two"), make_doc("One ")]
+    assign_chunk_ids(chunks)
+    ids = [c.metadata["id"] for c in chunks]
+
+    assert ids[0].startswith("https://a.com/x_page-0_chunk-h")
+    assert len(ids[0].rsplit("-h", 1)[1]) == 16
+    # the same normalized text twice on a page
+    assert ids[2] == ids[0] + "-2"
+    assert len(set(ids)) == 3
+
+    # the id doesn't depend on the position
+    moved = [make_doc("two")]
+    assign_chunk_ids(moved)
+    assert moved[0].metadata["id"] == ids[1]
+    assert moved[0].metadata["chunk_index"] == 0
+
+
+def test_spreadsheet_windows_stay_whole(monkeypatch):
+    monkeypatch.setattr(cfg, "CHUNKING", "content_defined")
+    window = Document(
+        page_content="name | count\nleopard | 3",
+        metadata={
+            "source": "s.xlsx",
+            "id": "s.xlsx_Sheet1_window-0",
+            "type": "spreadsheet",
+        },
+    )
+    docs = [make_doc(make_text(600), "s.xlsx"), window, make_doc("last", "s.xlsx")]
+
+    chunks = maintain_vectordb.split_into_chunks(docs, chunk_size=1500)
+
+    assert chunks[-2].page_content == window.page_content
+    assert chunks[-1].page_content == "last"
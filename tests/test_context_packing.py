@@ -0,0 +1,96 @@
+from langchain_core.documents import Document
+
+import rag.context_packing as context_packing
+from rag.context_packing import (
+    get_chunk_index,
+    get_id_stem,
+    merge_adjacent_chunks,
+    pack_context,
+    strip_overlap,
+)
+
+
+def make_doc(source: str, text: str, chunk_id: str, chunk_index: int = None):
+    metadata = {"source": source, "id": chunk_id}
+    if chunk_index is not None:
+        metadata["chunk_index"] = chunk_index
+    return Document(page_content=text, metadata=metadata, id=chunk_id)
+
+
+def test_get_chunk_index_from_metadata_or_id():
+    assert get_chunk_index(make_doc("s", "t", "s_page-0_chunk-7", 3)) == 3
+    assert get_chunk_index(make_doc("s", "t", "s_page-0_chunk-7")) == 7
+    assert get_chunk_index(make_doc("s", "t", "s_page-0_chunk-h0a1b2c3d")) is None
+
+
+def test_get_id_stem():
+    for chunk_id in [
+        "https://a.com/x_page-0_chunk-3",
+        "https://a.com/x_page-0_chunk-h0123456789abcdef",
+        "https://a.com/x_page-0_chunk-h0123456789abcdef-2",
+        "https://a.com/x_window-4_chunk-0",
+        "https://a.com/x_chunk-12",
+    ]:
+        assert get_id_stem(make_doc("s", "t", chunk_id)) == "https://a.com/x"
+
+
+def test_strip_overlap():
+    first = "a" * 50 + "the overlapping end of the first chunk"
+    second = "the overlapping end of the first chunk, then more text"
+    assert strip_overlap(first, second) == ", then more text"
+    # shorter than MIN_OVERLAP_CHARS: not an overlap
+    assert strip_overlap("ends with abc", "abc starts") == "abc starts"
+
+
+def test_merge_adjacent_chunks_merges_neighbours_and_keeps_best_rank():
+    docs = [
+        make_doc("s1", "and then the shared overlap, second part", "s1_chunk-1", 1),
+        make_doc("s2", "another source", "s2_chunk-1", 1),
+        make_doc("s1", "first part and then the shared overlap", "s1_chunk-0", 0),
+    ]
+
+    merged = merge_adjacent_chunks(docs)
+
+    assert [rank for rank, _ in merged] == [0, 1]
+    _, doc = merged[0]
+    assert doc.page_content == "first part and then the shared overlap, second part"
+    assert doc.metadata["merged_chunks"] == 2
+    assert doc.metadata["id"] == "s1_chunk-0"
+
+
+def test_merge_adjacent_chunks_drops_exact_duplicates_and_gaps_stay_apart():
+    docs = [
+        make_doc("s", "chunk zero", "s_page-0_chunk-0", 0),
+        make_doc("s", "chunk zero", "s_page-0_chunk-0", 0),
+        make_doc("s", "chunk two", "s_page-0_chunk-2", 2),
+    ]
+    merged = merge_adjacent_chunks(docs)
+    assert [doc.page_content for _, doc in merged] == ["chunk zero", "chunk two"]
+
+
+def test_merge_adjacent_chunks_keeps_handed_over_duplicates_apart():
+    # s2 owns a chunk of s1's text (handed over when s1 was deleted), with s1's index
+    docs = [
+        make_doc("s2", "text of s2", "s2_page-0_chunk-0", 0),
+        make_doc("s2", "text of s1", "s1_page-0_chunk-1", 1),
+    ]
+    merged = merge_adjacent_chunks(docs)
+    assert len(merged) == 2
+    assert all("merged_chunks" not in doc.metadata for _, doc in merged)
+
+
+def test_pack_context_skips_what_doesnt_fit(monkeypatch):
+    # estimate tokens (4 characters each) instead of loading the tokenizer
+    monkeypatch.setattr(context_packing, "_encodings", {"test-model": None})
+    docs = [
+        make_doc("a", "x" * 400, "a_page-0_chunk-0", 0),
+        make_doc("b", "y" * 4000, "b_page-0_chunk-0", 0),
+        make_doc("c", "z" * 40, "c_page-0_chunk-0", 0),
+    ]
+
+    packed, stats = pack_context(docs, token_budget=200, model="test-model")
+
+    assert [doc.metadata["source"] for doc in packed] == ["a", "c"]
+    assert stats["tokens_before"] == 1110
+    assert stats["tokens_after"] == 110
+    assert stats["tokens_saved"] == 1000
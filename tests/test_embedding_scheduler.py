@@ -0,0 +1,98 @@
+import csv
+
+import pytest
+
+import src.config as cfg
+import benchmarks.offline_fakes as fakes
+import rag.chroma_registry as registry
+import rag.context_packing as context_packing
+import rag.ingest_manifest as ingest_manifest
+import rag.lexical_index as lexical_index
+import rag.maintain_vectordb as maintain_vectordb
+
+TEXT = " ".join(f"word{i}" for i in range(300))
+
+
+@pytest.fixture
+def offline_embeddings(data_dirs, monkeypatch):
+    fakes.register_offline_provider(dim=32)
+    monkeypatch.setattr(cfg, "EMBEDDINGS_PROVIDER", fakes.OFFLINE_PROVIDER)
+    monkeypatch.setattr(cfg, "EMBEDDINGS_MODEL", fakes.OFFLINE_EMBEDDINGS_MODEL)
+    monkeypatch.setattr(
+        context_packing, "_encodings", {fakes.OFFLINE_EMBEDDINGS_MODEL: None}
+    )
+    return data_dirs
+
+
+def add_csv(data_dir, rows: dict, collection_name: str = "news") -> None:
+    with open(data_dir / "news.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=maintain_vectordb.CSV_COLUMNS)
+        writer.writeheader()
+        for url, content in rows.items():
+            writer.writerow(
+                {
+                    "url": url,
+                    "content": content,
+                    "title": "t",
+                    "date_serpapi": "d",
+                    "source": "s",
+                }
+            )
+    maintain_vectordb.add_update_docs(
+        ["news.csv"], collection_name, dir_name=str(data_dir)
+    )
+
+
+def get_chunks(collection_name: str = "news") -> dict:
+    collection = registry.get_client().get_collection(collection_name)
+    stored = collection.get(include=["metadatas"])
+    return dict(zip(stored["ids"], stored["metadatas"]))
+
+
+def test_duplicate_chunks_are_stored_once(offline_embeddings):
+    add_csv(offline_embeddings, {"https://u1": TEXT, "https://u2": TEXT})
+
+    chunks = get_chunks()
+    assert len(chunks) > 1
+    assert {m["source"] for m in chunks.values()} == {"https://u1"}
+    assert {m["duplicate_sources"] for m in chunks.values()} == {"https://u2"}
+
+    entries = ingest_manifest.get_entries("news", ["https://u1", "https://u2"])
+    assert entries["https://u1"]["chunk_ids"] == sorted(chunks)
+    assert entries["https://u2"]["chunk_ids"] == []
+    assert entries["https://u2"]["duplicate_of"] == sorted(chunks)
+
+    # adding them again embeds nothing
+    add_csv(offline_embeddings, {"https://u1": TEXT, "https://u2": TEXT})
+    assert get_chunks() == chunks
+
+
+def test_deleting_the_original_hands_its_chunks_over(offline_embeddings):
+    add_csv(offline_embeddings, {"https://u1": TEXT, "https://u2": TEXT})
+    ids = sorted(get_chunks())
+
+    maintain_vectordb.delete_docs(["https://u1"], "news")
+
+    chunks = get_chunks()
+    assert sorted(chunks) == ids
+    assert {m["source"] for m in chunks.values()} == {"https://u2"}
+    assert {m["duplicate_sources"] for m in chunks.values()} == {""}
+    assert ingest_manifest.get_sources("news") == {"https://u2"}
+    hits = lexical_index.search("news", "word1")
+    assert {hit["metadata"]["source"] for hit in hits} == {"https://u2"}
+
+    maintain_vectordb.delete_docs(["https://u2"], "news")
+    assert get_chunks() == {}
+    assert ingest_manifest.count("news") == 0
+
+
+def test_deleting_the_duplicate_keeps_the_chunks(offline_embeddings):
+    add_csv(offline_embeddings, {"https://u1": TEXT, "https://u2": TEXT})
+
+    maintain_vectordb.delete_docs(["https://u2"], "news")
+
+    chunks = get_chunks()
+    assert len(chunks) > 1
+    assert {m["source"] for m in chunks.values()} == {"https://u1"}
+    assert {m["duplicate_sources"] for m in chunks.values()} == {""}
+    assert ingest_manifest.get_sources("news") == {"https://u1"}
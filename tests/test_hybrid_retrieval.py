@@ -0,0 +1,74 @@
+import src.rag_query as rag
+import rag.lexical_index as lexical_index
+
+
+def test_reciprocal_rank_fusion():
+    fused = rag.reciprocal_rank_fusion([["a", "b"], ["b", "c"]])
+    # b is in both lists, a is ranked above c
+    assert fused == ["b", "a", "c"]
+
+
+def test_reciprocal_rank_fusion_weights():
+    assert rag.reciprocal_rank_fusion([["a"], ["b"]], weights=[1.0, 2.0]) == [
+        "b",
+        "a",
+    ]
+    assert rag.reciprocal_rank_fusion([]) == []
+
+
+def test_to_fts_query():
+    assert lexical_index.to_fts_query("What is the NEAR leopard, the leopard?") == (
+        '"near" OR "leopard"'
+    )
+    assert lexical_index.to_fts_query("what is the") == ""
+
+
+def add_chunks(collection_name: str, chunks: dict) -> None:
+    ids = list(chunks)
+    lexical_index.upsert_chunks(
+        collection_name,
+        ids=ids,
+        documents=[text for _, text in chunks.values()],
+        metadatas=[{"source": source} for source, _ in chunks.values()],
+    )
+
+
+def test_lexical_index_search_and_delete(data_dirs):
+    add_chunks(
+        "news",
+        {
+            "1": ("s1", "A leopard was seen near the village of Junnar"),
+            "2": ("s1", "Tigers and leopards in Maharashtra"),
+            "3": ("s2", "The monsoon arrived early this year"),
+        },
+    )
+
+    hits = lexical_index.search("news", "leopard Junnar")
+    # "leopards" matches too, the chunk with both words first
+    assert [hit["id"] for hit in hits] == ["1", "2"]
+    assert hits[0]["metadata"] == {"source": "s1"}
+    assert lexical_index.search("news", "monsoon")[0]["content"].startswith("The")
+
+    # upserting an id replaces its text
+    add_chunks("news", {"1": ("s1", "A jackal was seen")})
+    assert lexical_index.search("news", "Junnar") == []
+
+    lexical_index.delete_sources("news", ["s2"])
+    lexical_index.delete_ids("news", ["2"])
+    assert lexical_index.count("news") == 1
+    assert lexical_index.search("missing_collection", "leopard") == []
+
+
+def test_retrieve_lexical_fuses_collections(data_dirs):
+    add_chunks("news", {"n1": ("s1", "leopard attack in Junnar")})
+    add_chunks(
+        "articles",
+        {
+            "a1": ("s2", "leopard diet and prey"),
+            "a2": ("s3", "prey of the leopard in Junnar forests"),
+        },
+    )
+
+    docs = rag.retrieve_lexical("leopard Junnar", ["news", "articles"], k=2)
+
+    assert {doc.id for doc in docs} == {"n1", "a2"}
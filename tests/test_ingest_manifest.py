@@ -0,0 +1,102 @@
+import os
+import sqlite3
+
+import rag.ingest_manifest as ingest_manifest
+
+
+def test_record_and_get_entries(data_dirs, monkeypatch):
+    # lookups are split into several IN (...) statements
+    monkeypatch.setattr(ingest_manifest, "LOOKUP_SIZE", 2)
+    assert ingest_manifest.get_entry("news", "s1") is None
+    assert not ingest_manifest.exists("news")
+
+    ingest_manifest.record_sources(
+        "news",
+        [
+            {
+                "source": f"s{i}",
+                "chunk_ids": [f"s{i}_chunk-0", f"s{i}_chunk-1"],
+                "content_hash": f"hash{i}",
+                "mtime": 1.5,
+                "size": 10,
+                "embedding_model": "model",
+                "duplicate_of": ["b", "a"],
+            }
+            for i in range(5)
+        ],
+    )
+
+    entry = ingest_manifest.get_entry("news", "s1")
+    assert entry["chunk_ids"] == ["s1_chunk-0", "s1_chunk-1"]
+    assert entry["num_chunks"] == 2
+    assert entry["content_hash"] == "hash1"
+    assert (entry["mtime"], entry["size"]) == (1.5, 10)
+    assert entry["embedding_model"] == "model"
+    assert entry["duplicate_of"] == ["a", "b"]
+
+    assert set(ingest_manifest.get_entries("news", ["s0", "s3", "s4", "x"])) == {
+        "s0",
+        "s3",
+        "s4",
+    }
+    assert ingest_manifest.embedded_among("news", ["s2", "s4", "y"]) == {"s2", "s4"}
+    assert ingest_manifest.is_embedded("news", "s0")
+    assert ingest_manifest.count("news") == 5
+
+
+def test_replace_update_and_remove(data_dirs):
+    ingest_manifest.record_sources("news", [{"source": "s", "chunk_ids": ["c0"]}])
+    ingest_manifest.record_sources(
+        "news", [{"source": "s", "chunk_ids": ["c0", "c1"]}, {"source": "t"}]
+    )
+    assert ingest_manifest.get_entry("news", "s")["num_chunks"] == 2
+
+    ingest_manifest.update_duplicate_of("news", {"t": ["c1"]})
+    assert ingest_manifest.get_entry("news", "t")["duplicate_of"] == ["c1"]
+
+    ingest_manifest.remove_sources("news", ["s"])
+    assert ingest_manifest.get_sources("news") == {"t"}
+
+    ingest_manifest.drop_collection("news")
+    assert not ingest_manifest.exists("news")
+    assert ingest_manifest.count("news") == 0
+
+
+def test_manifest_without_duplicate_of_is_migrated(data_dirs):
+    path = ingest_manifest.get_manifest_path("old")
+    os.makedirs(os.path.dirname(path))
+    conn = sqlite3.connect(path)
+    conn.execute(
+        """CREATE TABLE sources (
+            source TEXT PRIMARY KEY,
+            content_hash TEXT,
+            mtime REAL,
+            size INTEGER,
+            chunk_ids TEXT NOT NULL,
+            num_chunks INTEGER NOT NULL,
+            embedding_model TEXT,
+            embedded_at REAL NOT NULL
+        )"""
+    )
+    conn.execute(
+        "INSERT INTO sources VALUES ('s', 'h', NULL, NULL, '[\"c0\"]', 1, 'm', 0)"
+    )
+    conn.commit()
+    conn.close()
+
+    assert ingest_manifest.get_entry("old", "s")["duplicate_of"] == []
+    ingest_manifest.update_duplicate_of("old", {"s": ["c9"]})
+    assert ingest_manifest.get_entry("old", "s")["duplicate_of"] == ["c9"]
+
+
+def test_import_embedded_sources_csv(data_dirs):
+    csv_file = data_dirs / "embedded_sources.csv"
+    csv_file.write_text("Sources\ns1\ns2\n\ns3\n", encoding="utf-8")
+    ingest_manifest.record_sources("news", [{"source": "s2", "chunk_ids": ["c0"]}])
+
+    assert ingest_manifest.import_embedded_sources_csv("news", str(csv_file)) == 2
+
+    assert ingest_manifest.get_sources("news") == {"s1", "s2", "s3"}
+    assert ingest_manifest.get_entry("news", "s1")["chunk_ids"] == []
+    # the entry it already had is kept
+    assert ingest_manifest.get_entry("news", "s2")["chunk_ids"] == ["c0"]
@@ -0,0 +1,46 @@
+import numpy as np
+
+from rag.mmr import maximal_marginal_relevance
+
+
+def test_pure_relevance_ranks_by_similarity():
+    query = [1.0, 0.0]
+    candidates = [[0.0, 1.0], [1.0, 0.1], [1.0, 0.5], [1.0, 0.0]]
+    assert maximal_marginal_relevance(query, candidates, k=3, lambda_mult=1.0) == [
+        3,
+        1,
+        2,
+    ]
+
+
+def test_diversity_skips_near_duplicates():
+    query = [1.0, 0.5]
+    candidates = [[1.0, 0.3], [0.3, 1.0], [1.0, 0.31]]
+    # by relevance alone, the near duplicate of the first pick comes second
+    assert maximal_marginal_relevance(query, candidates, k=2, lambda_mult=1.0) == [
+        2,
+        0,
+    ]
+    assert maximal_marginal_relevance(query, candidates, k=2, lambda_mult=0.5) == [
+        2,
+        1,
+    ]
+
+
+def test_scale_doesnt_matter():
+    rnd = np.random.default_rng(0)
+    query = rnd.normal(size=8)
+    candidates = rnd.normal(size=(20, 8))
+    scaled = candidates * rnd.uniform(0.1, 10, size=(20, 1))
+    assert maximal_marginal_relevance(query, candidates, k=5) == (
+        maximal_marginal_relevance(query * 3, scaled, k=5)
+    )
+
+
+def test_k_larger_than_pool_and_empty_pool():
+    assert sorted(maximal_marginal_relevance([1.0, 0.0], [[1, 0], [0, 1]], k=5)) == [
+        0,
+        1,
+    ]
+    assert maximal_marginal_relevance([1.0, 0.0], [], k=5) == []
+    assert maximal_marginal_relevance([1.0, 0.0], [[1, 0]], k=0) == []
@@ -0,0 +1,144 @@
+import numpy as np
+
+import rag.chroma_registry as registry
+import rag.quantized_index as quantized_index
+
+VECTORS = {
+    "a": [1.0, 0.0, 0.0],
+    "b": [0.8, 0.6, 0.0],
+    "c": [0.0, 1.0, 0.0],
+    "d": [0.0, 0.0, -2.0],
+}
+METADATAS = [{"source": "s1"}, {"source": "s1"}, {"source": "s2"}, {"source": "s3"}]
+
+
+def add_vectors(collection_name: str = "news") -> None:
+    quantized_index.upsert_vectors(
+        collection_name, list(VECTORS), list(VECTORS.values()), METADATAS
+    )
+
+
+def test_quantize_round_trip():
+    rnd = np.random.default_rng(0)
+    vectors = np.vstack([rnd.normal(size=(5, 64)), np.zeros((1, 64))])
+    quantized, scales = quantized_index.quantize(vectors)
+
+    assert quantized.dtype == np.int8 and scales.dtype == np.float32
+    assert np.abs(quantized).max() == 127
+    restored = quantized * scales[:, None]
+    assert np.abs(restored - vectors).max() <= scales.max() / 2 + 1e-6
+    # a zero vector doesn't divide by zero
+    assert scales[-1] == 1.0 and not quantized[-1].any()
+
+
+def test_search(data_dirs):
+    assert quantized_index.count("news") == 0
+    add_vectors()
+
+    assert quantized_index.count("news") == 4
+    assert quantized_index.search("news", [1.0, 0.2, 0.0], k=3) == ["a", "b", "c"]
+    assert quantized_index.search("news", [0.0, 0.0, 1.0], k=1) == ["a"]
+    allowed = quantized_index.search(
+        "news", [1.0, 0.2, 0.0], k=10, allowed_ids=["c", "b"]
+    )
+    assert allowed == ["b", "c"]
+    assert quantized_index.search("news", [1.0, 0.0, 0.0], k=2, allowed_ids=[]) == []
+    assert quantized_index.search("news", [1.0, 0.0, 0.0], k=0) == []
+
+
+def test_embeddings_sources_and_deletes(data_dirs):
+    assert quantized_index.get_embeddings("news", ["a"]) == {}
+    add_vectors()
+
+    embeddings = quantized_index.get_embeddings("news", ["b", "x", "d"])
+    assert set(embeddings) == {"b", "d"}
+    # the float32 vectors, not the int8 ones
+    assert embeddings["b"].dtype == np.float32
+    assert embeddings["b"].tolist() == np.float32(VECTORS["b"]).tolist()
+
+    # a handover moves "a" to s2, so deleting s1 keeps it
+    quantized_index.update_sources("news", ["a"], [{"source": "s2"}])
+    quantized_index.delete_sources("news", ["s1"])
+    assert quantized_index.count("news") == 3
+    assert set(quantized_index.get_embeddings("news", list(VECTORS))) == {"a", "c", "d"}
+
+    quantized_index.delete_ids("news", ["d"])
+    assert quantized_index.search("news", [0.0, 0.0, -1.0], k=5) == ["a", "c"]
+
+    quantized_index.drop_collection("news")
+    assert quantized_index.count("news") == 0
+
+
+def test_get_chroma_embeddings():
+    embeddings = [[0.1, 0.2], [0.3, 0.4]]
+    in_index = {"store": "quantized_index"}
+    assert quantized_index.get_chroma_embeddings(in_index, embeddings) == [
+        quantized_index.PLACEHOLDER_EMBEDDING
+    ] * 2
+    in_chroma = {"store": "chroma"}
+    assert quantized_index.get_chroma_embeddings(in_chroma, embeddings) is embeddings
+
+
+def create_collection(metadata: dict, embeddings: list):
+    collection = registry.get_client().create_collection(
+        "news", metadata=metadata, embedding_function=None
+    )
+    collection.add(
+        ids=list(VECTORS),
+        embeddings=embeddings,
+        documents=[f"document {id_}" for id_ in VECTORS],
+        metadatas=METADATAS,
+    )
+    return collection
+
+
+def test_query_the_index(data_dirs):
+    metadata = {
+        "embedding_quantization": "int8",
+        "embedding_store": "quantized_index",
+    }
+    placeholders = [quantized_index.PLACEHOLDER_EMBEDDING] * len(VECTORS)
+    collection = create_collection(metadata, placeholders)
+    add_vectors()
+
+    results = quantized_index.query(collection, "news", [0.9, 0.5, 0.0], n_results=2)
+    assert results["ids"] == [["b", "a"]]
+    assert results["documents"] == [["document b", "document a"]]
+    assert results["metadatas"][0][0] == {"source": "s1"}
+    assert results["embeddings"][0][0].tolist() == np.float32(VECTORS["b"]).tolist()
+    assert results["distances"][0][0] < results["distances"][0][1]
+
+    filtered = quantized_index.query(
+        collection, "news", [0.9, 0.5, 0.0], n_results=2, where={"source": "s2"}
+    )
+    assert filtered["ids"] == [["c"]]
+
+    empty = quantized_index.query(
+        collection, "news", [1.0, 0.0, 0.0], n_results=2, where={"source": "s9"}
+    )
+    assert empty["ids"] == [[]] and empty["distances"] == [[]]
+
+
+def test_query_falls_back_to_chroma_and_rebuild(data_dirs):
+    # an int8 collection from before the vectors were moved out of Chroma
+    collection = create_collection(
+        {"embedding_quantization": "int8"}, list(VECTORS.values())
+    )
+
+    results = quantized_index.query(collection, "news", [0.9, 0.5, 0.0], n_results=2)
+    assert results["ids"] == [["b", "a"]]
+
+    assert quantized_index.rebuild_from_chroma("news", page_size=3) == 4
+
+    # the rebuild swaps the collection, so it's opened again
+    collection = registry.get_client().get_collection("news", embedding_function=None)
+    assert registry.get_vector_settings(collection)["store"] == "quantized_index"
+    stored = collection.get(include=["embeddings", "documents"])
+    assert len(stored["ids"]) == 4
+    assert [len(e) for e in stored["embeddings"]] == [1] * 4
+    assert quantized_index.query(
+        collection, "news", [0.9, 0.5, 0.0], n_results=2
+    )["ids"] == [["b", "a"]]
+
+    # a second run has nothing left to move
+    assert quantized_index.rebuild_from_chroma("news") == 4
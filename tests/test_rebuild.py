@@ -0,0 +1,104 @@
+import struct
+
+import rag.answer_cache as answer_cache
+import rag.chroma_registry as registry
+import rag.chromadb_utils as chromadb_utils
+
+# small HNSW batches, so the index is written to disk after a few adds
+HNSW_METADATA = {"hnsw:batch_size": 10, "hnsw:sync_threshold": 10}
+
+
+def create_collection(name: str, num_chunks: int = 20):
+    collection = registry.get_client().create_collection(
+        name, metadata=HNSW_METADATA, embedding_function=None
+    )
+    collection.add(
+        ids=[f"c{i}" for i in range(num_chunks)],
+        embeddings=[[float(i), 1.0] for i in range(num_chunks)],
+        documents=[f"chunk {i}" for i in range(num_chunks)],
+        metadatas=[{"source": f"s{i % 2}"} for i in range(num_chunks)],
+    )
+    return collection
+
+
+def get_collection(name: str):
+    return registry.get_client().get_collection(name, embedding_function=None)
+
+
+def test_read_hnsw_element_count(tmp_path):
+    header_file = tmp_path / "header.bin"
+    header_file.write_bytes(struct.pack("<iQQQ", 1, 0, 100, 42) + b"rest")
+    assert chromadb_utils.read_hnsw_element_count(str(header_file)) == 42
+
+    for header in [
+        struct.pack("<iQQQ", 2, 0, 100, 42),
+        struct.pack("<iQQQ", 1, 0, 10, 42),
+        b"short",
+    ]:
+        header_file.write_bytes(header)
+        assert chromadb_utils.read_hnsw_element_count(str(header_file)) is None
+
+
+def test_rebuild_drops_the_deleted_elements(data_dirs):
+    collection = create_collection("news")
+    collection.delete(where={"source": "s1"})
+    stats = chromadb_utils.get_hnsw_stats("news")
+    assert (stats["elements"], stats["live"]) == (20, 10)
+    assert stats["deleted_fraction"] == 0.5
+
+    assert chromadb_utils.rebuild_fragmented_collections(0.6) == []
+    assert chromadb_utils.rebuild_fragmented_collections(0.5) == ["news"]
+
+    assert set(chromadb_utils.fetch_vector_segments()) == {"news"}
+    assert chromadb_utils.get_hnsw_stats("news")["elements"] == 10
+    rebuilt = get_collection("news").get(include=["embeddings", "metadatas"])
+    assert set(rebuilt["ids"]) == {f"c{i}" for i in range(0, 20, 2)}
+    assert {m["source"] for m in rebuilt["metadatas"]} == {"s0"}
+    # the stored embeddings are copied, not embedded again
+    embeddings = dict(zip(rebuilt["ids"], rebuilt["embeddings"]))
+    assert list(embeddings["c2"]) == [2.0, 1.0]
+    assert get_collection("news").metadata == HNSW_METADATA
+    assert answer_cache.get_collection_versions(["news"]) == {"news": 1}
+
+
+def test_finish_a_swap_interrupted_before_the_rename(data_dirs):
+    # the old collection was renamed, the rebuilt one wasn't yet
+    create_collection("news" + chromadb_utils.RETIRED_SUFFIX, num_chunks=20)
+    create_collection("news" + chromadb_utils.REBUILD_SUFFIX, num_chunks=10)
+
+    assert chromadb_utils.finish_interrupted_rebuild("news")
+
+    assert set(chromadb_utils.fetch_vector_segments()) == {"news"}
+    assert get_collection("news").count() == 10
+    assert not chromadb_utils.finish_interrupted_rebuild("news")
+
+
+def test_finish_a_swap_without_the_copy(data_dirs):
+    create_collection("news" + chromadb_utils.RETIRED_SUFFIX)
+
+    assert chromadb_utils.finish_interrupted_rebuild("news")
+
+    # the old collection is put back
+    assert set(chromadb_utils.fetch_vector_segments()) == {"news"}
+    assert get_collection("news").count() == 20
+
+
+def test_finish_a_swap_interrupted_before_the_delete(data_dirs):
+    create_collection("news", num_chunks=10)
+    create_collection("news" + chromadb_utils.RETIRED_SUFFIX)
+
+    assert not chromadb_utils.finish_interrupted_rebuild("news")
+
+    assert set(chromadb_utils.fetch_vector_segments()) == {"news"}
+    assert get_collection("news").count() == 10
+    assert not chromadb_utils.finish_interrupted_rebuild("missing")
+
+
+def test_an_interrupted_copy_starts_over(data_dirs):
+    create_collection("news")
+    create_collection("news" + chromadb_utils.REBUILD_SUFFIX, num_chunks=5)
+
+    chromadb_utils.rebuild_collection("news")
+
+    assert set(chromadb_utils.fetch_vector_segments()) == {"news"}
+    assert get_collection("news").count() == 20
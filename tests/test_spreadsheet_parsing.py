@@ -0,0 +1,109 @@
+import os
+import datetime
+
+import openpyxl
+
+import rag.spreadsheet_parsing as spreadsheet_parsing
+from rag.spreadsheet_parsing import format_cell, make_windows, split_line
+
+
+def make_rows(num_rows: int) -> list:
+    return [("name", "district", "count")] + [
+        (f"leopard {i}", f"district {i % 7}", i) for i in range(num_rows)
+    ]
+
+
+def test_format_cell():
+    assert format_cell(None) == ""
+    assert format_cell(3.0) == "3" and format_cell(2.5) == "2.5"
+    assert format_cell(datetime.datetime(2024, 5, 1)) == "2024-05-01"
+    assert format_cell(datetime.datetime(2024, 5, 1, 9, 30)) == "2024-05-01T09:30:00"
+    assert format_cell(" a |\n b ") == "a \\| b"
+
+
+def test_split_line():
+    assert split_line("aaa bbb ccc", 7) == ["aaa bbb", "ccc"]
+    assert split_line("aaaaaaaaaa", 4) == ["aaaa", "aaaa", "aa"]
+    assert split_line("", 4) == []
+
+
+def test_windows_keep_the_header():
+    rows = make_rows(300)
+    rows[5] = (None, None)
+    windows = list(make_windows("Sightings", rows))
+
+    assert len(windows) > 1
+    assert [w["window"] for w in windows] == list(range(len(windows)))
+    header = "Sheet: Sightings\n\n| name | district | count |\n| --- | --- | --- |\n"
+    for window in windows:
+        assert window["text"].startswith(header)
+        assert len(window["text"]) <= spreadsheet_parsing.WINDOW_MAX_CHARS
+    assert windows[0]["rows"].startswith("2-")
+    assert windows[-1]["rows"].endswith("-301")
+    # the empty row is skipped
+    lines = [line for w in windows for line in w["text"].split("\n")[4:]]
+    assert len(lines) == 299
+
+
+def test_long_rows_are_split_with_the_header():
+    rows = [("notes", None, "tag"), (" ".join(["word"] * 1000),), ("short", "", "x")]
+    windows = list(make_windows("Notes", rows))
+
+    assert windows[0]["text"].startswith("Sheet: Notes\n\n| notes | column 2 | tag |")
+    assert {w["rows"] for w in windows[:-1]} == {"2-2"}
+    assert len(windows) > 2
+    assert windows[-1]["text"].endswith("| short |  | x |")
+    # the row that was split is padded to the header's columns
+    assert windows[-2]["text"].endswith("word |  |  |")
+
+
+def test_inserting_rows_only_changes_their_windows():
+    rows = make_rows(1000)
+    before = [w["text"] for w in make_windows("Sheet", rows)]
+    rows.insert(500, ("new leopard", "new district", 1))
+    after = [w["text"] for w in make_windows("Sheet", rows)]
+
+    assert len(set(before) ^ set(after)) <= 4
+
+
+def write_workbook(path, rows) -> str:
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Sightings"
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+    return str(path)
+
+
+def test_load_windows_from_the_cache(data_dirs, monkeypatch):
+    filepath = write_workbook(data_dirs / "sightings.xlsx", make_rows(100))
+    pages = spreadsheet_parsing.parse_spreadsheet("a/b/sightings.xlsx", filepath)
+
+    assert pages[0][1]["id"] == "sightings.xlsx_Sightings_window-0"
+    assert pages[0][1]["source"] == "sightings.xlsx"
+    assert pages[0][1]["type"] == "spreadsheet"
+    assert len(os.listdir(spreadsheet_parsing.get_cache_dir())) == 1
+
+    def iter_sheets(filepath):
+        raise AssertionError("parsed again")
+
+    monkeypatch.setattr(spreadsheet_parsing, "iter_sheets", iter_sheets)
+    cached = spreadsheet_parsing.parse_spreadsheet("sightings.xlsx", filepath)
+    assert cached == pages
+
+
+def test_prune_cache(data_dirs):
+    assert spreadsheet_parsing.prune_cache(max_mb=1) == 0
+    cache_dir = spreadsheet_parsing.get_cache_dir()
+    os.makedirs(cache_dir)
+    for i in range(4):
+        path = os.path.join(cache_dir, f"{i}.jsonl")
+        with open(path, "wb") as f:
+            f.write(b"x" * 400_000)
+        os.utime(path, (i, i))
+
+    # 1.6 MB down to 0.9 MB: the two least recently used go
+    assert spreadsheet_parsing.prune_cache(max_mb=1) == 2
+    assert sorted(os.listdir(cache_dir)) == ["2.jsonl", "3.jsonl"]
+    assert spreadsheet_parsing.prune_cache(max_mb=1) == 0
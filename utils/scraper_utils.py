@@ -1,17 +1,16 @@
 import os
 import sys
 import json
-from typing import List, Set, Tuple, Dict
-
-from crawl4ai import (
-    AsyncWebCrawler,
-    BrowserConfig,
-    CacheMode,
-    CrawlerRunConfig,
-    LLMExtractionStrategy,
-    LLMConfig,
-    JsonCssExtractionStrategy,
-)
+from typing import List, Set, Tuple, Dict, TYPE_CHECKING
+
+# crawl4ai is slow to import, it's imported by the functions that use it
+if TYPE_CHECKING:
+    from crawl4ai import (
+        AsyncWebCrawler,
+        BrowserConfig,
+        LLMExtractionStrategy,
+        JsonCssExtractionStrategy,
+    )
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
@@ -27,13 +26,15 @@ from src.config import SCHEMA_MAP
 import utils.print_utils as prnt
 
 
-def get_browser_config() -> BrowserConfig:
+def get_browser_config() -> "BrowserConfig":
     """
     Returns the browser configuration for the crawler.
 
     Returns:
         BrowserConfig: The configuration settings for the browser.
     """
+    from crawl4ai import BrowserConfig
+
     # https://docs.crawl4ai.com/core/browser-crawler-config/
     return BrowserConfig(
         browser_type="chromium",  # Type of browser to simulate
@@ -42,13 +43,15 @@ def get_browser_config() -> BrowserConfig:
     )
 
 
-def get_llm_strategy() -> LLMExtractionStrategy:
+def get_llm_strategy() -> "LLMExtractionStrategy":
     """
     Returns the configuration for the language model extraction strategy.
 
     Returns:
         LLMExtractionStrategy: The settings for how to extract data using LLM.
     """
+    from crawl4ai import LLMExtractionStrategy, LLMConfig
+
     # https://docs.crawl4ai.com/api/strategies/#llmextractionstrategy
     return LLMExtractionStrategy(
         # provider="groq/deepseek-r1-distill-llama-70b",  # Name of the LLM provider
@@ -67,7 +70,9 @@ def get_llm_strategy() -> LLMExtractionStrategy:
     )
 
 
-def get_json_css_strategy(publication: str) -> JsonCssExtractionStrategy:
+def get_json_css_strategy(publication: str) -> "JsonCssExtractionStrategy":
+    from crawl4ai import JsonCssExtractionStrategy
+
     if publication in SCHEMA_MAP:
         return JsonCssExtractionStrategy(SCHEMA_MAP[publication], verbose=True)
 
@@ -76,7 +81,7 @@ def get_json_css_strategy(publication: str) -> JsonCssExtractionStrategy:
 
 
 async def fetch_and_process_page(
-    crawler: AsyncWebCrawler,
+    crawler: "AsyncWebCrawler",
     article_details: Dict,
     # llm_strategy: LLMExtractionStrategy,
     # json_css_strategy: JsonCssExtractionStrategy,
@@ -95,6 +100,8 @@ async def fetch_and_process_page(
     Returns:
         - List[dict]: A list of processed news_items from the page.
     """
+    from crawl4ai import CacheMode, CrawlerRunConfig
+
     url = article_details["link"]
     source = article_details["source"]
 